@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs microbenchmarks of performance-critical trading bot components.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import json
+import numpy as np
+import pickle
+import random
+import sys
+
+from timeit import default_timer
+
+from trading_bot.book import OrderBook
+from trading_bot.buffer import RealtimeTradeStreamBuffer, StreamFeatureEngine
+from trading_bot.decoding import JSON_DECODERS, StreamDecoder
+from trading_bot.parsing import parse_depth_state, parse_depth_states
+from trading_bot.periods import TradePeriodAggregator
+from trading_bot.prediction import TradePredictionModel
+from trading_bot.records import DepthSnapshot, DepthUpdate, Trade
+from trading_bot.window import SlotRingSum, SlotRingWindow, SlotRollingMax
+
+
+
+
+def _time_calls(fn, num_calls):
+  """Returns the average time in seconds of calling the function."""
+
+  t0 = default_timer()
+  for _ in range(num_calls):
+    fn()
+  return (default_timer() - t0) / num_calls
+
+
+
+
+def benchmark_records(num_iters):
+  """Compares trade records against the dictionaries they replaced, and the
+  plain tuples channels send them as."""
+
+  values = (1520000000000, 0.0812, 1.25, True, 123456789, 123456790,
+            1520000000010, 0.0795, 0.0833, 182734.5)
+
+  def make_dict():
+    return dict(zip(Trade._fields, values))
+
+  def make_record():
+    return Trade(*values)
+
+  trade_dict = make_dict()
+  trade = make_record()
+
+  # Channels pickle records as plain tuples and remake them on the consumer
+  # side, so their round trip includes the `_make`.
+  def round_trip_tuple():
+    return Trade._make(pickle.loads(pickle.dumps(tuple(trade), pickle.HIGHEST_PROTOCOL)))
+
+  print("%-10s %14s %14s %14s %14s %14s" % ("type", "construct (us)", "pickle (bytes)",
+                                            "pickle (us)", "round trip (us)", "json (bytes)"))
+  for name, make_fn, obj, round_trip_fn in [
+      ("dict", make_dict, trade_dict, None),
+      ("Trade", make_record, trade, None),
+      ("tuple", lambda: tuple(values), tuple(trade), round_trip_tuple)]:
+    pickle_size = len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    pickle_time = _time_calls(lambda: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL),
+                              num_iters)
+    if round_trip_fn is None:
+      round_trip_fn = lambda: pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    print("%-10s %14.3f %14d %14.3f %14.3f %14d" % (
+        name, _time_calls(make_fn, num_iters) * 1e6, pickle_size, pickle_time * 1e6,
+        _time_calls(round_trip_fn, num_iters) * 1e6, len(json.dumps(obj))))
+
+
+
+
+def _make_depth_events(num_pairs, num_events, num_levels, rng):
+  """Returns depth snapshots and updates for synthetic symbol pairs, with
+  updates that change, add, and remove levels near the top of the book."""
+
+  snapshots = []
+  for i in range(num_pairs):
+    mid = rng.randint(100000, 10000000)
+    bids = [(mid - j - 1, rng.uniform(0.1, 10.)) for j in range(num_levels)]
+    asks = [(mid + j + 1, rng.uniform(0.1, 10.)) for j in range(num_levels)]
+    snapshots.append((mid, DepthSnapshot("pair%d" % i, 1, bids, asks)))
+
+  updates = []
+  for k in range(num_events):
+    i = k % num_pairs
+    mid = snapshots[i][0]
+    bids = [(mid - rng.randint(1, 2 * num_levels), rng.choice([0., rng.uniform(0.1, 10.)]))
+            for _ in range(3)]
+    asks = [(mid + rng.randint(1, 2 * num_levels), rng.choice([0., rng.uniform(0.1, 10.)]))
+            for _ in range(3)]
+    update_id = k // num_pairs + 2
+    updates.append(DepthUpdate("pair%d" % i, update_id, update_id, bids, asks))
+
+  return [snapshot for _, snapshot in snapshots], updates
+
+
+
+
+def benchmark_orderbook(num_iters):
+  """Measures depth update throughput and memory of orderbooks for many
+  symbol pairs."""
+
+  num_pairs = 150
+  snapshots, updates = _make_depth_events(num_pairs, num_iters, 100, random.Random(0))
+
+  books = {}
+  for snapshot in snapshots:
+    books[snapshot.pair] = OrderBook(100, 0, (0.001, 0.005, 0.01))
+    books[snapshot.pair].apply_snapshot(snapshot)
+
+  t0 = default_timer()
+  for depth_update in updates:
+    books[depth_update.pair].apply_update(depth_update)
+  elapsed = default_timer() - t0
+
+  num_levels = 0
+  num_bytes = 0
+  for book in books.values():
+    for side in [book.bids, book.asks]:
+      num_levels += len(side)
+      num_bytes += sys.getsizeof(side._prices) + sys.getsizeof(side._quantities)
+      num_bytes += sum(sys.getsizeof(x) for x in side._prices + side._quantities)
+
+  print("pairs:             %d" % num_pairs)
+  print("updates/sec:       %.0f" % (len(updates) / elapsed))
+  print("levels/sec:        %.0f" % (6 * len(updates) / elapsed))
+  print("levels per book:   %.1f" % (num_levels / float(num_pairs)))
+  print("bytes per book:    %.0f" % (num_bytes / float(num_pairs)))
+
+
+
+
+def _parse_depth_state_loop(num_depth_bins, cur_state):
+  """Reference implementation of `parse_depth_state` that bins each level
+  separately."""
+
+  ask_levels = np.asarray(cur_state.asks, dtype="float64").reshape(-1, 2)
+  bid_levels = np.asarray(cur_state.bids, dtype="float64").reshape(-1, 2)
+  ask_levels = ask_levels[ask_levels[:, 1] > 0]
+  bid_levels = bid_levels[bid_levels[:, 1] > 0]
+
+  qty_spread = np.sum(ask_levels[:, 1]) - np.sum(bid_levels[:, 1])
+
+  binned = []
+  avg_prices = []
+  for levels in [bid_levels, ask_levels]:
+    prices = levels[:, 0].astype("float32")
+    weights = levels[:, 1].astype("float32")
+    if weights.shape[0] > 0:
+      weights /= (np.max(weights) + 1e-6)
+      avg_price = np.average(prices, weights=weights)
+      std_price = np.sqrt(np.average((prices-avg_price)**2, weights=weights))
+    else:
+      avg_price = 0.
+      std_price = 0.
+
+    bin_edges = np.linspace(avg_price - 3*std_price, avg_price + 3*std_price,
+                            num=num_depth_bins-1)
+    bin_arr = np.zeros((num_depth_bins,), dtype="float32")
+    for i in range(prices.shape[0]):
+      bin_ind = min(num_depth_bins-1, np.digitize(prices[i], bin_edges))
+      bin_arr[bin_ind] += weights[i]
+    bin_arr /= (np.max(bin_arr) + 1e-6)
+
+    binned.append(bin_arr)
+    avg_prices.append(avg_price)
+
+  return (cur_state.server_timestamp, binned[0], binned[1],
+          avg_prices[1] - avg_prices[0], qty_spread)
+
+
+
+def _make_depth_states(num_states, num_levels, top_levels, rng):
+  """Returns orderbook states for a synthetic symbol pair, with full sides of
+  random depth or zero-padded top level arrays."""
+
+  snapshots, updates = _make_depth_events(1, num_states, num_levels, rng)
+  book = OrderBook(num_states, top_levels)
+  book.apply_snapshot(snapshots[0])
+
+  states = []
+  for k, depth_update in enumerate(updates):
+    book.apply_update(depth_update)
+    states.append(book.get_state(k))
+  return states
+
+
+
+def benchmark_depth(num_iters):
+  """Checks that the vectorized and batched depth state parsers match the
+  per-level reference implementation and compares their speed."""
+
+  num_depth_bins = 16
+  rng = random.Random(0)
+  states = (_make_depth_states(num_iters // 2, 100, 0, rng)
+            + _make_depth_states(num_iters - num_iters // 2, 100, 20, rng))
+
+  expected = [_parse_depth_state_loop(num_depth_bins, state) for state in states]
+  actual = [parse_depth_state(num_depth_bins, state) for state in states]
+  batched = parse_depth_states(num_depth_bins, states)
+
+  max_diff = 0.
+  max_batch_diff = 0.
+  for i, tup in enumerate(expected):
+    for j in range(1, 5):
+      max_diff = max(max_diff, np.max(np.abs(tup[j] - actual[i][j])))
+      max_batch_diff = max(max_batch_diff, np.max(np.abs(tup[j] - batched[j][i])))
+  assert max_diff < 1e-4, max_diff
+  assert max_batch_diff < 1e-4, max_batch_diff
+
+  t0 = default_timer()
+  for state in states:
+    _parse_depth_state_loop(num_depth_bins, state)
+  loop_time = default_timer() - t0
+
+  t0 = default_timer()
+  for state in states:
+    parse_depth_state(num_depth_bins, state)
+  vector_time = default_timer() - t0
+
+  t0 = default_timer()
+  parse_depth_states(num_depth_bins, states)
+  batch_time = default_timer() - t0
+
+  print("states:            %d" % len(states))
+  print("max diff:          %g" % max_diff)
+  print("max batch diff:    %g" % max_batch_diff)
+  print("loop (us/state):   %.2f" % (loop_time / len(states) * 1e6))
+  print("vector (us/state): %.2f" % (vector_time / len(states) * 1e6))
+  print("batch (us/state):  %.2f" % (batch_time / len(states) * 1e6))
+
+
+
+
+def benchmark_buffer(num_iters):
+  """Measures the cost of orderbook and trade period updates of a realtime
+  trade stream buffer."""
+
+  rng = np.random.RandomState(0)
+  stream = RealtimeTradeStreamBuffer()
+  bid_arr = rng.rand(16).astype("float32")
+  ask_arr = rng.rand(16).astype("float32")
+  prices = 1. + rng.rand(num_iters)
+
+  order_book_time = _time_calls(
+      lambda: stream.update_order_book(1, bid_arr, ask_arr, 0.1, 0.2), num_iters)
+
+  t0 = default_timer()
+  for i in range(num_iters):
+    stream.update_trade_period(i, 1., 5, prices[i], prices[i] - 0.01, prices[i] + 0.01)
+    stream.get_features_window()
+  period_time = (default_timer() - t0) / num_iters
+
+  print("orderbook update (us): %.2f" % (order_book_time * 1e6))
+  print("period update (us):    %.2f" % (period_time * 1e6))
+
+
+
+
+def benchmark_features(num_iters):
+  """Measures the cost of closing a trading period for all symbol pairs with a
+  single feature engine, for increasing numbers of pairs, computing either the
+  default features or only a few cheap ones."""
+
+  rng = np.random.RandomState(0)
+
+  print("%-8s %18s %18s %18s" % ("pairs", "period (us)", "per pair (us)",
+                                 "cheap period (us)"))
+  for num_pairs in [1, 7, 30, 100, 300]:
+    slots = np.arange(num_pairs)
+    timestamps = np.zeros((num_pairs,), dtype="int64")
+    quantities = np.ones((num_pairs,))
+    num_trades = np.ones((num_pairs,), dtype="int64")
+    prices = 1. + rng.rand(num_iters, num_pairs)
+
+    period_times = []
+    for feature_names in [None, ["price", "quantity", "macd_short_long"]]:
+      engine = StreamFeatureEngine(num_pairs, feature_names)
+
+      t0 = default_timer()
+      for i in range(num_iters):
+        engine.update_trade_periods(slots, timestamps, quantities, num_trades,
+                                    prices[i], prices[i] - 0.01, prices[i] + 0.01)
+      period_times.append((default_timer() - t0) / num_iters)
+
+    print("%-8d %18.2f %18.2f %18.2f" % (num_pairs, period_times[0] * 1e6,
+                                         period_times[0] / num_pairs * 1e6,
+                                         period_times[1] * 1e6))
+
+
+
+
+def benchmark_prediction(num_iters):
+  """Compares predicting the feature windows of each symbol pair with separate
+  calls against predicting them in one batch, for increasing numbers of pairs."""
+
+  rng = np.random.RandomState(0)
+
+  print("%-8s %18s %18s" % ("pairs", "per pair (us)", "batch (us)"))
+  for num_pairs in [1, 7, 30, 100, 300]:
+    engine = StreamFeatureEngine(num_pairs)
+    slots = np.arange(num_pairs)
+    for slot in slots:
+      engine.update_order_book(slot, 1, rng.rand(16), rng.rand(16), 0.1, 0.2)
+    for i in range(engine._num_buffer_periods):
+      prices = 1. + rng.rand(num_pairs)
+      engine.update_trade_periods(slots, np.zeros((num_pairs,), dtype="int64"),
+                                  np.ones((num_pairs,)), np.ones((num_pairs,), dtype="int64"),
+                                  prices, prices - 0.01, prices + 0.01)
+    models = [TradePredictionModel("pair%d" % slot) for slot in slots]
+
+    is_ready, timestamps, feats_windows, bid_windows, ask_windows = (
+        engine.get_features_windows(slots))
+    assert np.all(is_ready)
+    for slot in slots:
+      feats_tup = engine.get_features_window(slot)
+      assert np.array_equal(feats_tup[1], feats_windows[slot])
+      assert np.array_equal(feats_tup[2], bid_windows[slot])
+
+    def predict_each():
+      for slot in slots:
+        feats_tup = engine.get_features_window(slot)
+        models[slot].predict_buy(*feats_tup)
+        models[slot].predict_sell(*feats_tup)
+
+    def predict_batch():
+      TradePredictionModel.predict_pairs(models, *engine.get_features_windows(slots)[1:])
+
+    print("%-8d %18.2f %18.2f" % (num_pairs, _time_calls(predict_each, num_iters) * 1e6,
+                                  _time_calls(predict_batch, num_iters) * 1e6))
+
+
+
+
+def _make_stream_frames(num_frames, rng):
+  """Returns combined stream frames in the layout sent by the exchange, with
+  trades and depth updates of 1 to 20 levels per side in equal numbers."""
+
+  frames = []
+  for k in range(num_frames):
+    timestamp = 1520000000000 + 10 * k
+    if k % 2 == 0:
+      data = {"e": "trade", "E": timestamp, "s": "ETHBTC", "t": k,
+              "p": "%.8f" % rng.uniform(0.05, 0.1), "q": "%.8f" % rng.uniform(0.001, 10.),
+              "b": 2 * k, "a": 2 * k + 1, "T": timestamp - 1, "m": rng.random() < 0.5,
+              "M": True}
+      stream = "ethbtc@trade"
+    else:
+      data = {"e": "depthUpdate", "E": timestamp, "s": "ETHBTC", "U": k, "u": k + 2}
+      for side in ["b", "a"]:
+        data[side] = [["%.8f" % rng.uniform(0.05, 0.1),
+                       "%.8f" % rng.choice([0., rng.uniform(0.001, 10.)])]
+                      for _ in range(rng.randint(1, 20))]
+      stream = "ethbtc@depth"
+    frames.append(json.dumps({"stream": stream, "data": data}, separators=(",", ":")))
+  return frames
+
+
+
+def benchmark_decoding(num_iters):
+  """Compares decoding stream frames with each installed JSON decoder, in full
+  and by extracting only the used fields."""
+
+  frames = _make_stream_frames(num_iters, random.Random(0))
+
+  expected = [json.loads(frame)["data"] for frame in frames]
+  actual = [StreamDecoder(extract_fields=True).decode(frame) for frame in frames]
+  for data, extracted in zip(expected, actual):
+    for key in extracted:
+      if data["e"] == "depthUpdate" and key in ["b", "a"]:
+        assert [tuple(level) for level in data[key]] == extracted[key]
+      else:
+        assert data[key] == extracted[key], key
+
+  print("%-20s %18s" % ("decoder", "messages/sec"))
+  for name in JSON_DECODERS:
+    for extract_fields in [False, True]:
+      decoder = StreamDecoder(name, extract_fields)
+      t0 = default_timer()
+      for frame in frames:
+        decoder.decode(frame)
+      elapsed = default_timer() - t0
+      print("%-20s %18.0f" % (name + (" (extract)" if extract_fields else ""),
+                              len(frames) / elapsed))
+
+
+
+
+def _close_trade_lists(bin_stats_dict, last_time_bin):
+  """Reference implementation of `TradePeriodAggregator` that keeps lists of the
+  quantity and price of every trade of each period and reduces them on close."""
+
+  closed_periods = []
+  for time_bin in sorted(bin_stats_dict.keys()):
+    if time_bin > last_time_bin:
+      break
+
+    quantities = np.array(bin_stats_dict[time_bin][0])
+    prices = np.array(bin_stats_dict[time_bin][1])
+    total_quantity = np.sum(quantities)
+    closed_periods.append((time_bin, total_quantity, len(quantities),
+                           np.sum(prices * quantities / total_quantity),
+                           np.min(prices), np.max(prices)))
+    del bin_stats_dict[time_bin]
+
+  return closed_periods
+
+
+
+def benchmark_periods(num_iters):
+  """Compares aggregating trades into periods with running values against
+  keeping lists of trades, for increasing numbers of trades per period."""
+
+  period_time = 3000
+  rng = random.Random(0)
+
+  print("%-16s %18s %18s" % ("trades/period", "lists (us/trade)", "running (us/trade)"))
+  for trades_per_period in [1, 10, 100, 1000]:
+    trades = [Trade(k * period_time // trades_per_period, rng.uniform(1., 2.),
+                    rng.uniform(0.1, 10.), True, 0, 0, 0, 0., 0., 0.)
+              for k in range(num_iters)]
+    close_every = trades_per_period
+
+    t0 = default_timer()
+    bin_stats_dict = {}
+    expected = []
+    for k, trade in enumerate(trades):
+      time_bin = int(trade.trade_timestamp / float(period_time)) * period_time
+      try:
+        bin_stats_dict[time_bin][0].append(trade.quantity)
+        bin_stats_dict[time_bin][1].append(trade.price)
+      except KeyError:
+        bin_stats_dict[time_bin] = ([trade.quantity], [trade.price])
+      if k % close_every == close_every - 1:
+        expected.extend(_close_trade_lists(bin_stats_dict, time_bin - period_time))
+    lists_time = default_timer() - t0
+
+    t0 = default_timer()
+    trade_periods = TradePeriodAggregator(period_time)
+    actual = []
+    for k, trade in enumerate(trades):
+      trade_periods.add_trade(trade)
+      if k % close_every == close_every - 1:
+        actual.extend(trade_periods.close_periods(trade.trade_timestamp - period_time))
+    running_time = default_timer() - t0
+
+    assert np.allclose(expected, actual)
+    print("%-16d %18.2f %18.2f" % (trades_per_period, lists_time / len(trades) * 1e6,
+                                   running_time / len(trades) * 1e6))
+
+
+
+
+def benchmark_extrema(num_iters):
+  """Compares rolling maximums over increasing window lengths kept by
+  reducing the buffered window on each append against the rolling maximum."""
+
+  num_pairs = 30
+  slots = np.arange(num_pairs)
+  values = np.random.RandomState(0).rand(num_iters, num_pairs).astype("float32")
+
+  print("%-8s %18s %18s" % ("length", "window max (us)", "rolling max (us)"))
+  for length in [9, 26, 100, 500, 2000]:
+    ring_window = SlotRingWindow(length, (), "float32", num_pairs)
+    rolling_max = SlotRollingMax(length, (), "float32", num_pairs)
+
+    t0 = default_timer()
+    for i in range(num_iters):
+      ring_window.append(slots, values[i])
+      window_maxes = np.max(ring_window.latest_rows(slots, length), axis=1)
+    window_time = (default_timer() - t0) / num_iters
+
+    t0 = default_timer()
+    for i in range(num_iters):
+      rolling_maxes = rolling_max.append(slots, values[i])
+    rolling_time = (default_timer() - t0) / num_iters
+
+    assert np.array_equal(window_maxes, rolling_maxes)
+    print("%-8d %18.2f %18.2f" % (length, window_time * 1e6, rolling_time * 1e6))
+
+
+
+
+def benchmark_history(num_iters):
+  """Compares joint buy and sell probabilities over increasing history lengths
+  computed by shifting per pair histories and taking their products against
+  running sums of log probabilities."""
+
+  num_pairs = 30
+  slots = np.arange(num_pairs)
+  probs = np.random.RandomState(0).rand(num_iters, num_pairs, 2, 1).astype("float32")
+  probs = np.concatenate([probs, 1. - probs], axis=3)
+
+  print("%-8s %18s %18s %12s" % ("length", "product (us)", "log sum (us)", "underflows"))
+  for length in [5, 20, 100, 500]:
+    histories = [np.zeros((length, 2, 2), dtype="float32") + 0.5 for _ in slots]
+    log_sums = SlotRingSum(length, (2, 2), num_pairs)
+
+    t0 = default_timer()
+    for i in range(num_iters):
+      joints = np.zeros((num_pairs, 2, 2), dtype="float32")
+      for slot, history in enumerate(histories):
+        history[:-1] = history[1:]
+        history[-1] = probs[i, slot]
+        joints[slot] = np.prod(history, axis=0)
+    prod_time = (default_timer() - t0) / num_iters
+
+    t0 = default_timer()
+    for i in range(num_iters):
+      log_sums.append(slots, np.log(probs[i].astype("float64")))
+      sums = log_sums.sums(slots)
+      sum_probs = 0.5 * (1. + np.tanh(0.5 * (sums[:, :, 1] - sums[:, :, 0])))
+    sum_time = (default_timer() - t0) / num_iters
+
+    # Long products of probabilities underflow float32, which the log sums
+    # avoid, so only products of normal floats are compared.
+    totals = np.sum(joints, axis=2)
+    is_normal = totals >= np.finfo("float32").tiny
+    assert np.allclose(joints[:, :, 1][is_normal] / totals[is_normal], sum_probs[is_normal],
+                       atol=1e-4)
+    print("%-8d %18.2f %18.2f %12d" % (length, prod_time * 1e6, sum_time * 1e6,
+                                       np.count_nonzero(~is_normal)))
+
+
+
+
+_BENCHMARKS = {
+  "buffer": benchmark_buffer,
+  "decoding": benchmark_decoding,
+  "depth": benchmark_depth,
+  "extrema": benchmark_extrema,
+  "features": benchmark_features,
+  "history": benchmark_history,
+  "orderbook": benchmark_orderbook,
+  "periods": benchmark_periods,
+  "prediction": benchmark_prediction,
+  "records": benchmark_records,
+}
+
+
+
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("benchmark", choices=sorted(_BENCHMARKS),
+                      help="Name of the benchmark to run")
+  parser.add_argument("--iters", default=100000, type=int, metavar="n",
+                      help="Number of iterations to time (default: 100000)")
+
+  args = parser.parse_args()
+
+  _BENCHMARKS[args.benchmark](args.iters)
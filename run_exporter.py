@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Exports recorded sessions as training samples in memory-mapped shards.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import multiprocessing
+import os
+import sys
+
+from trading_bot.config import read_config_file
+from trading_bot.export import export_sessions, get_recorded_sessions, write_manifest
+
+
+
+
+def _export_sessions(args):
+  return export_sessions(*args)
+
+
+
+
+def main(out_dir, sessions, pairs, label_periods, shard_size, num_workers, config_filename):
+  """Entry point method."""
+
+  config = read_config_file(config_filename)
+
+  recordings = [(timestamp, pair)
+                for timestamp, pair in get_recorded_sessions(config["data_store_dir"])
+                if (not sessions or timestamp in sessions) and (not pairs or pair in pairs)]
+  if not recordings:
+    print("No recorded sessions to export.")
+    return
+
+  try:
+    os.makedirs(out_dir)
+  except OSError: pass
+
+  # Sessions are split into one group per worker, and the sessions of a group
+  # share a feature engine, since updating many slots at once costs little
+  # more than updating one, and are packed into the same shards.
+  num_workers = min(num_workers, len(recordings))
+  tasks = [(config, recordings[i::num_workers], out_dir, "%03d" % i, label_periods,
+            shard_size) for i in range(num_workers)]
+
+  shards = []
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    num_sessions = 0
+    for task, task_shards in zip(tasks, pool.imap(_export_sessions, tasks)):
+      shards.extend(task_shards)
+      num_sessions += len(task[1])
+      sys.stdout.write("\r[ % 3d%% ] %d / %d sessions" % (
+          100 * num_sessions // len(recordings), num_sessions, len(recordings)))
+      sys.stdout.flush()
+    sys.stdout.write("\n")
+  finally:
+    pool.close()
+    pool.join()
+
+  write_manifest(out_dir, config, label_periods, shard_size, shards)
+  print("Exported %d samples in %d shards." % (sum(shard["num_samples"] for shard in shards),
+                                               len(shards)))
+
+
+
+
+
+
+
+
+
+if __name__ == "__main__":
+  import argparse
+  from os import path
+
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("out_dir", help="Directory to write shards and manifest to")
+  parser.add_argument("--sessions", nargs="+", default=[], type=int, metavar="t",
+                      help="Timestamps of sessions to export (default: all)")
+  parser.add_argument("--pairs", nargs="+", default=[], type=str, metavar="p",
+                      help="Trading pairs to export (default: all)")
+  parser.add_argument("--label-periods", default=20, type=int, metavar="n",
+                      help="Number of periods ahead of the future return labels (default: 20)")
+  parser.add_argument("--shard-size", default=4096, type=int, metavar="n",
+                      help="Number of samples per shard (default: 4096)")
+  parser.add_argument("--workers", default=multiprocessing.cpu_count(), type=int, metavar="n",
+                      help="Number of sessions exported in parallel (default: CPU count)")
+
+  parser.add_argument("--config", default="config.json", type=str, metavar="f",
+                      help="Configuration json file (default: config.json)")
+
+  args = parser.parse_args()
+
+  main(path.realpath(args.out_dir), args.sessions, [pair.lower() for pair in args.pairs],
+       args.label_periods, args.shard_size, args.workers, path.realpath(args.config))
@@ -25,7 +25,7 @@ from trading_bot.state import AppState
 _PROCESS_WAIT_TIMEOUT = 5
 
 _PROCESSES = []
-_APP_STATE = AppState()
+_APP_STATE = None
 
 
 
@@ -34,7 +34,11 @@ _APP_STATE = AppState()
 def main(timestamp, trading_pair, model_pair, config_filename):
   """Entry point method."""
 
+  global _APP_STATE
+
   config = read_config_file(config_filename)
+  config["num_analysis_workers"] = 1
+  _APP_STATE = AppState(config)
   real_update_res = config["proc_update_res"]
   config["proc_update_res"] = 0
   
@@ -67,7 +71,7 @@ def main(timestamp, trading_pair, model_pair, config_filename):
   try:
     reader = SavedStreamReader(_APP_STATE, timestamp, trading_pair,
                                config["data_store_dir"], real_update_res,
-                               __progress_callback)
+                               __progress_callback, config["json_decoder"])
     reader.run()
     sys.stdout.write("\n")
     sys.stdout.flush()
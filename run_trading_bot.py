@@ -20,9 +20,7 @@ import tornado.web
 import tornado.websocket
 
 from trading_bot.config import read_config_file
-from trading_bot.proc import AsyncRunnerProcess
-from trading_bot.runners import AnalysisRunner, ConnectionRunner, OrderBookRunner
-from trading_bot.runners import SnapshotRunner, SocketStreamRunner, TradeExecutorRunner
+from trading_bot.proc import create_runner_processes
 from trading_bot.state import AppState
 
 
@@ -31,7 +29,7 @@ _PROCESS_WAIT_TIMEOUT = 5
 
 _CONNECTED_CLIENTS = {}
 _PROCESSES = []
-_APP_STATE = AppState()
+_APP_STATE = None
 
 
 
@@ -79,8 +77,10 @@ class SocketHandler(tornado.websocket.WebSocketHandler):
 def main(config_filename):
   """Entry point method."""
 
+  global _APP_STATE
 
   config = read_config_file(config_filename)
+  _APP_STATE = AppState(config)
   _APP_STATE.trade_pairs = config["trade_pairs"]
   _APP_STATE.save_pairs = config["save_pairs"]
 
@@ -100,12 +100,7 @@ def main(config_filename):
 
   
 
-  _PROCESSES.append(AsyncRunnerProcess(_APP_STATE, config, ConnectionRunner))
-  _PROCESSES.append(AsyncRunnerProcess(_APP_STATE, config, SocketStreamRunner))
-  _PROCESSES.append(AsyncRunnerProcess(_APP_STATE, config, SnapshotRunner))
-  _PROCESSES.append(AsyncRunnerProcess(_APP_STATE, config, OrderBookRunner))
-  _PROCESSES.append(AsyncRunnerProcess(_APP_STATE, config, AnalysisRunner))
-  _PROCESSES.append(AsyncRunnerProcess(_APP_STATE, config, TradeExecutorRunner))
+  _PROCESSES.extend(create_runner_processes(_APP_STATE, config))
 
 
 
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+Defines classes for incrementally maintaining orderbooks.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import math
+import numpy as np
+
+from bisect import bisect_left, bisect_right
+
+from trading_bot.records import BookAnalytics, OrderBookState
+
+
+
+# Number of decimal places of integer price units, unless the pair's precision
+# is given.
+_PRICE_PRECISION = 8
+
+
+
+
+class BookSide(object):
+  """One side of an orderbook. Levels are keyed by integer price units and
+  kept in sorted arrays of prices and quantities, ascending by price. Levels
+  are found by binary search and levels with zero quantity are removed. The
+  total quantity of all levels is kept as levels change."""
+
+
+  def __init__(self, is_bid):
+    self._is_bid = is_bid
+    self._prices = []
+    self._quantities = []
+    self.quantity = 0.
+
+
+  def __len__(self):
+    return len(self._prices)
+
+
+  def clear(self):
+    del self._prices[:]
+    del self._quantities[:]
+    self.quantity = 0.
+
+
+
+  def set_level(self, price, quantity):
+    """Sets the quantity at the price level in integer units, removing the
+    level if the quantity is zero. Returns the change in quantity."""
+
+    i = bisect_left(self._prices, price)
+    if i < len(self._prices) and self._prices[i] == price:
+      delta = quantity - self._quantities[i]
+      if quantity == 0:
+        del self._prices[i]
+        del self._quantities[i]
+      else:
+        self._quantities[i] = quantity
+    elif quantity != 0:
+      delta = quantity
+      self._prices.insert(i, price)
+      self._quantities.insert(i, quantity)
+    else:
+      return 0.
+
+    self.quantity += delta
+    return delta
+
+
+
+  def best(self):
+    """Returns a tuple of the best price in integer units and its quantity, or
+    `None` if the side is empty."""
+
+    if not self._prices:
+      return None
+    if self._is_bid:
+      return self._prices[-1], self._quantities[-1]
+    return self._prices[0], self._quantities[0]
+
+
+
+  def is_within(self, price, bound):
+    """Returns whether the price in integer units is at or better than the
+    bound."""
+
+    if self._is_bid:
+      return price >= bound
+    return price <= bound
+
+
+  def quantity_within(self, bound):
+    """Returns the total quantity of the levels at or better than the price
+    bound in integer units."""
+
+    if self._is_bid:
+      return sum(self._quantities[bisect_left(self._prices, bound):], 0.)
+    return sum(self._quantities[:bisect_right(self._prices, bound)], 0.)
+
+
+
+  def get_levels(self, price_divisor):
+    """Returns a list of (price, quantity) tuples ascending by price, with
+    prices converted from integer units by dividing by `price_divisor`."""
+
+    return [(price / price_divisor, quantity)
+            for price, quantity in zip(self._prices, self._quantities)]
+
+
+
+  def copy_top_levels(self, price_divisor, out):
+    """Copies the best levels into the preallocated (N, 2) array of prices and
+    quantities, best level first. Rows past the number of levels are zeroed."""
+
+    n = out.shape[0]
+    if self._is_bid:
+      prices = self._prices[:-n-1:-1]
+      quantities = self._quantities[:-n-1:-1]
+    else:
+      prices = self._prices[:n]
+      quantities = self._quantities[:n]
+
+    k = len(prices)
+    out[:k, 0] = prices
+    out[:k, 0] /= price_divisor
+    out[:k, 1] = quantities
+    out[k:, :] = 0
+
+
+
+
+
+class EventBuffer(object):
+  """Bounded buffer of depth updates in order of final update id. The final ids
+  are indexed so the updates newer than a snapshot are found by binary search.
+  The oldest update is dropped when the buffer is full by advancing a head
+  offset, and the dropped updates are compacted away once per capacity appends."""
+
+
+  def __init__(self, capacity):
+    if capacity <= 0:
+      raise ValueError("Invalid event buffer capacity: %s" % capacity)
+
+    self._capacity = capacity
+    self._events = []
+    self._final_ids = []
+    self._head = 0
+
+
+  def __len__(self):
+    return len(self._events) - self._head
+
+
+  def clear(self):
+    del self._events[:]
+    del self._final_ids[:]
+    self._head = 0
+
+
+
+  def append(self, depth_update):
+    """Adds the `DepthUpdate`, dropping the oldest update if the buffer is full.
+    Updates that are not newer than the latest buffered update are ignored."""
+
+    if len(self) > 0 and depth_update.final_update_id <= self._final_ids[-1]:
+      return
+
+    self._events.append(depth_update)
+    self._final_ids.append(depth_update.final_update_id)
+
+    if len(self) > self._capacity:
+      self._head += 1
+      if self._head >= self._capacity:
+        del self._events[:self._head]
+        del self._final_ids[:self._head]
+        self._head = 0
+
+
+
+  def events_after(self, update_id):
+    """Returns a list of the buffered updates with a final update id greater than
+    `update_id`, oldest first."""
+
+    return self._events[bisect_right(self._final_ids, update_id, self._head):]
+
+
+
+
+
+class OrderBook(object):
+  """Maintains the orderbook of a single symbol pair by applying depth updates
+  incrementally to a depth snapshot, with prices in integer units of the given
+  precision. Each update must continue from the last update applied. If an
+  update is missing, the book goes out of sync and buffers updates until a
+  newer snapshot is applied.
+
+  The cumulative depth within each of the given fractional distances from the
+  mid price is kept as levels change. It is only recomputed from the levels
+  when the best bid or ask changes, since that moves the mid price."""
+
+
+  def __init__(self, max_buffered_events, top_levels=0, depth_distances=(),
+               price_precision=_PRICE_PRECISION):
+    self._price_divisor = 10. ** price_precision
+    self._update_id = None
+    self._events = EventBuffer(max_buffered_events)
+    self._had_gap = False
+    self.changed = False
+    self.num_gaps = 0
+    self.num_resyncs = 0
+    self.bids = BookSide(True)
+    self.asks = BookSide(False)
+
+    self._depth_distances = tuple(sorted(depth_distances))
+    self._depths_valid = False
+    self._bid_bounds = []
+    self._ask_bounds = []
+    self._bid_depths = []
+    self._ask_depths = []
+
+    if top_levels > 0:
+      self._top_bids = np.zeros((top_levels, 2), dtype="float64")
+      self._top_asks = np.zeros((top_levels, 2), dtype="float64")
+    else:
+      self._top_bids = None
+      self._top_asks = None
+
+
+  @property
+  def update_id(self):
+    """The id of the last update applied, or `None` if the book is out of sync."""
+    return self._update_id
+
+  @property
+  def is_synced(self):
+    """Whether the book is in sync with the exchange."""
+    return self._update_id is not None
+
+
+
+  def _set_level(self, side, price, quantity, bounds, depths):
+    if not self._depths_valid:
+      side.set_level(price, quantity)
+      return
+
+    # The mid price moves if the level is better than the best level, or if it
+    # removes the best level.
+    best = side.best()
+    if (best is None or (side.is_within(price, best[0])
+                         and (price != best[0] or quantity == 0))):
+      self._depths_valid = False
+      side.set_level(price, quantity)
+      return
+
+    delta = side.set_level(price, quantity)
+    for i, bound in enumerate(bounds):
+      if side.is_within(price, bound):
+        depths[i] += delta
+
+
+  def _apply_levels(self, depth_update):
+    for price, quantity in depth_update.bids:
+      self._set_level(self.bids, price, quantity, self._bid_bounds, self._bid_depths)
+    for price, quantity in depth_update.asks:
+      self._set_level(self.asks, price, quantity, self._ask_bounds, self._ask_depths)
+    self.changed = True
+
+
+
+  def apply_update(self, depth_update):
+    """Applies the `DepthUpdate` if the book is in sync, or buffers it
+    otherwise. If updates are missing between the book and this update, the book
+    goes out of sync."""
+
+    if self._update_id is None:
+      self._events.append(depth_update)
+      return
+
+    if depth_update.final_update_id <= self._update_id:
+      return
+
+    if depth_update.first_update_id > self._update_id + 1:
+      self.num_gaps += 1
+      self._had_gap = True
+      self._update_id = None
+      self._events.append(depth_update)
+      return
+
+    self._apply_levels(depth_update)
+    self._update_id = depth_update.final_update_id
+
+
+
+  def apply_snapshot(self, snapshot):
+    """Replaces the book with the `DepthSnapshot` and replays the buffered
+    updates newer than it, if the book is out of sync. Returns whether the
+    snapshot was applied. It is not applied if the book is already in sync, or
+    if updates between the snapshot and the oldest buffered update are missing."""
+
+    if self._update_id is not None:
+      return False
+
+    events = self._events.events_after(snapshot.update_id)
+    if events and events[0].first_update_id > snapshot.update_id + 1:
+      return False
+
+    self.bids.clear()
+    self.asks.clear()
+    for price, quantity in snapshot.bids:
+      self.bids.set_level(price, quantity)
+    for price, quantity in snapshot.asks:
+      self.asks.set_level(price, quantity)
+    self._update_id = snapshot.update_id
+    self._events.clear()
+    self._depths_valid = False
+    self.changed = True
+
+    if self._had_gap:
+      self._had_gap = False
+      self.num_resyncs += 1
+
+    for depth_update in events:
+      self.apply_update(depth_update)
+
+    return True
+
+
+
+  def _update_depths(self, best_bid_price, best_ask_price):
+    mid_price = (best_bid_price + best_ask_price) / 2.
+    self._bid_bounds = [int(math.ceil(mid_price * (1. - distance)))
+                        for distance in self._depth_distances]
+    self._ask_bounds = [int(math.floor(mid_price * (1. + distance)))
+                        for distance in self._depth_distances]
+    self._bid_depths = [self.bids.quantity_within(bound) for bound in self._bid_bounds]
+    self._ask_depths = [self.asks.quantity_within(bound) for bound in self._ask_bounds]
+    self._depths_valid = True
+
+
+
+  def get_analytics(self):
+    """Returns the `BookAnalytics` of the book, or `None` if either side is
+    empty."""
+
+    best_bid = self.bids.best()
+    best_ask = self.asks.best()
+    if best_bid is None or best_ask is None:
+      return None
+
+    if not self._depths_valid and self._depth_distances:
+      self._update_depths(best_bid[0], best_ask[0])
+
+    bid_price = best_bid[0] / self._price_divisor
+    ask_price = best_ask[0] / self._price_divisor
+    bid_quantity = best_bid[1]
+    ask_quantity = best_ask[1]
+    top_quantity = bid_quantity + ask_quantity
+
+    return BookAnalytics(bid_price, bid_quantity, ask_price, ask_quantity,
+                         ask_price - bid_price, (bid_price + ask_price) / 2.,
+                         (bid_price * ask_quantity + ask_price * bid_quantity) / top_quantity,
+                         (bid_quantity - ask_quantity) / top_quantity,
+                         self.bids.quantity, self.asks.quantity,
+                         tuple(self._bid_depths), tuple(self._ask_depths))
+
+
+
+  def get_state(self, server_timestamp):
+    """Returns an `OrderBookState` with the current levels and analytics of the
+    book and clears the `changed` flag. If the book was created with a number of
+    top levels, each side is instead an (N, 2) array of the best N prices and
+    quantities, best level first and zero-padded."""
+
+    self.changed = False
+    analytics = self.get_analytics()
+
+    if self._top_bids is None:
+      return OrderBookState(server_timestamp, self.bids.get_levels(self._price_divisor),
+                            self.asks.get_levels(self._price_divisor), analytics)
+
+    self.bids.copy_top_levels(self._price_divisor, self._top_bids)
+    self.asks.copy_top_levels(self._price_divisor, self._top_asks)
+    return OrderBookState(server_timestamp, self._top_bids.copy(),
+                          self._top_asks.copy(), analytics)
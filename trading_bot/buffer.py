@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """
-Defines a class for buffering real time trade stream features.
+Defines classes for buffering real time trade stream features.
 """
 
 from __future__ import absolute_import
@@ -11,9 +11,14 @@ from __future__ import print_function
 
 import numpy as np
 
+from trading_bot.features import (DEFAULT_FEATURE_NAMES, HORIZON_DAYS, NUM_PERIOD_COLS,
+                                  PERIOD_DOWN_AVG, PERIOD_HIGH, PERIOD_LOW,
+                                  PERIOD_NEG_DIR, PERIOD_POS_DIR, PERIOD_PRICE,
+                                  PERIOD_QUANTITY, PERIOD_TR, PERIOD_UP_AVG,
+                                  STATE_DTYPE, get_features, get_indicators)
+from trading_bot.window import SlotRingWindow
 
 
-_EPSILON = float(1e-6)
 _FLOAT_DTYPE = "float32"
 
 
@@ -23,307 +28,311 @@ _NUM_DEPTH_BINS = 16
 
   
 
-# Parameters for technical indicator signals.
-_DAYS_SHORT = 9
-_DAYS_MED = 14
-_DAYS_LONG = 26
-
-
 _NUM_FEAT_PERIODS = 24
 
 
+# Number of periods buffered before features are available, long enough for
+# the moving averages of the longest horizon to settle.
+_NUM_WARMUP_PERIODS = int(3.45 * (max(HORIZON_DAYS) + 1)) + 1
 
-class RealtimeTradeStreamBuffer(object):
-  """Models a stream of real time trading data with trading periods updated at
-  regular, evenly-spaced intervals. Stream features are buffered over a
-  window of recent history."""
 
 
-  def __init__(self):
-    self._last_order_book_timestamp = 0
-    self._last_period_timestamp = 0
+class StreamFeatureEngine(object):
+  """Models streams of real time trading data for a number of slots, usually
+  one per symbol pair, with trading periods updated at regular, evenly-spaced
+  intervals. Stream features are buffered over a window of recent history.
 
-    self._last_avg_spread = 0.
-    self._last_qty_spread = 0.
+  Only the requested features, and the indicators they depend on, are
+  computed. Indicators are shared between the features that use them. The state
+  of every slot is kept in arrays, so that closing a trading period updates the
+  features of any number of slots with a fixed number of array operations."""
 
-    self._last_bids = None
-    self._last_asks = None
 
-    self._cur_buffered_periods = 0
-    
+  def __init__(self, num_slots=0, feature_names=None):
+    if feature_names is None:
+      feature_names = DEFAULT_FEATURE_NAMES
 
+    self._num_slots = 0
 
-    self._bid_window = np.zeros((_NUM_DEPTH_BINS, _NUM_DEPTH_BINS),
-                                dtype=_FLOAT_DTYPE)
-    self._ask_window = np.zeros((_NUM_DEPTH_BINS, _NUM_DEPTH_BINS),
-                                dtype=_FLOAT_DTYPE)
+    self._last_order_book_timestamps = np.zeros((0,), dtype="int64")
+    self._last_period_timestamps = np.zeros((0,), dtype="int64")
 
+    self._last_avg_spreads = np.zeros((0,), dtype="float64")
+    self._last_qty_spreads = np.zeros((0,), dtype="float64")
 
-    self._num_feats = len(self.get_feat_labels())
-    self._feats_window = np.zeros((_NUM_FEAT_PERIODS, self._num_feats),
-                                  dtype=_FLOAT_DTYPE)
+    self._cur_buffered_periods = np.zeros((0,), dtype="int64")
 
+    # Incremented whenever the feature, bid or ask window of a slot advances.
+    self._window_versions = np.zeros((0,), dtype="int64")
 
 
-    self._days_short = _DAYS_SHORT
-    self._ema_alpha_short = 2. / (self._days_short + 1)
+    self._bid_windows = SlotRingWindow(_NUM_DEPTH_BINS, (_NUM_DEPTH_BINS,), _FLOAT_DTYPE)
+    self._ask_windows = SlotRingWindow(_NUM_DEPTH_BINS, (_NUM_DEPTH_BINS,), _FLOAT_DTYPE)
 
-    self._days_med = _DAYS_MED
-    self._ema_alpha_med = 2. / (self._days_med + 1)
 
-    self._days_long = _DAYS_LONG
-    self._ema_alpha_long = 2. / (self._days_long + 1)
+    self._feature_names = list(feature_names)
+    self._features = get_features(self._feature_names)
+    self._num_feats = len(self._features)
+    self._feats_windows = SlotRingWindow(_NUM_FEAT_PERIODS, (self._num_feats,),
+                                         _FLOAT_DTYPE)
 
 
-    self._price_ema_short = 0.
-    self._price_ema_med = 0.
-    self._price_ema_long = 0.
+    self._indicators = get_indicators(self._feature_names)
+    self._indicator_states = {}
+    self._indicator_objects = {}
+    for indicator in self._indicators:
+      if indicator.state_fn is not None:
+        self._indicator_objects[indicator.name] = indicator.state_fn()
+      elif indicator.state_shape is not None:
+        self._indicator_states[indicator.name] = np.zeros(
+            (0,) + tuple(indicator.state_shape), dtype=STATE_DTYPE)
 
-    self._up_avg_ema_short = 0.
-    self._up_avg_ema_med = 0.
-    self._up_avg_ema_long = 0.
-    self._down_avg_ema_short = 0.
-    self._down_avg_ema_med = 0.
-    self._down_avg_ema_long = 0.
 
-    self._pos_dir_ema_short = 0.
-    self._pos_dir_ema_med = 0.
-    self._pos_dir_ema_long = 0.
-    self._neg_dir_ema_short = 0.
-    self._neg_dir_ema_med = 0.
-    self._neg_dir_ema_long = 0.
+    # Every column of a period record is appended at once, so they share a
+    # buffer, which holds the longest window read by an indicator.
+    self._num_buffer_periods = _NUM_WARMUP_PERIODS
+    self._period_buffers = SlotRingWindow(
+        max([indicator.window for indicator in self._indicators] + [1]),
+        (NUM_PERIOD_COLS,), STATE_DTYPE)
 
-    self._tr_ema_short = 0.
-    self._tr_ema_med = 0.
-    self._tr_ema_long = 0.
+    self._windows = [self._bid_windows, self._ask_windows, self._feats_windows,
+                     self._period_buffers]
 
-    self._adx_ema_short = 0.
-    self._adx_ema_med = 0.
-    self._adx_ema_long = 0.
+    # Period contexts passed to indicators and features, reused by every update
+    # since indicators replace their values on each.
+    self._context = {"period_buffers": self._period_buffers}
+    self._slot_context = {}
 
+    # Periods of single slots are updated with scalar operations if every
+    # indicator and feature computed supports it.
+    self._has_slot_fns = all(item.slot_fn is not None
+                             for item in self._indicators + self._features)
 
-    self._num_buffer_periods = int(3.45 * (self._days_long + 1)) + 1
 
-    self._price_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
-    self._quantity_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
+    for _ in range(num_slots):
+      self.add_slot()
 
-    self._lows_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
-    self._highs_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
 
-    self._up_avg_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
-    self._down_avg_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
 
-    self._pos_dir_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
-    self._neg_dir_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
+  @property
+  def num_slots(self):
+    return self._num_slots
 
-    self._tr_buffer = np.zeros((self._num_buffer_periods,), dtype=_FLOAT_DTYPE)
 
 
+  def add_slot(self):
+    """Adds a slot for a new stream and returns its index. Storage grows by
+    doubling, so adding slots one at a time is cheap."""
 
-  def update_order_book(self, server_timestamp, bid_arr, ask_arr, avg_spread,
-                        qty_spread):
-    """Updates the stream buffer with the given order book data."""
+    slot = self._num_slots
+    self._num_slots += 1
 
-    self._last_order_book_timestamp = server_timestamp
-    self._last_avg_spread = avg_spread
-    self._last_qty_spread = qty_spread
+    capacity = self._last_order_book_timestamps.shape[0]
+    if self._num_slots > capacity:
+      capacity = max(1, 2 * capacity)
 
-    self._bid_window[:-1, :] = self._bid_window[1:, :]
-    self._bid_window[-1, :] = bid_arr
+      def grow(arr):
+        return np.concatenate([arr, np.zeros((capacity - arr.shape[0],) + arr.shape[1:],
+                                             dtype=arr.dtype)])
 
-    self._ask_window[:-1, :] = self._ask_window[1:, :]
-    self._ask_window[-1, :] = ask_arr
+      self._last_order_book_timestamps = grow(self._last_order_book_timestamps)
+      self._last_period_timestamps = grow(self._last_period_timestamps)
+      self._last_avg_spreads = grow(self._last_avg_spreads)
+      self._last_qty_spreads = grow(self._last_qty_spreads)
+      self._cur_buffered_periods = grow(self._cur_buffered_periods)
+      self._window_versions = grow(self._window_versions)
 
+      for name in self._indicator_states:
+        self._indicator_states[name] = grow(self._indicator_states[name])
+      for state in self._indicator_objects.values():
+        state.resize(capacity)
 
+      for window in self._windows:
+        window.resize(capacity)
 
-  def get_feat_labels(self):
-    """Returns a list of strings containing labels for the feature window columns."""
+    return slot
 
-    return ["price", "quantity", "orderbook_avg_spread", "orderbook_qty_spread",
-            "percent_range_short", "percent_range_med", "percent_range_long", # Williams %R
-            "rsi_short", "rsi_med", "rsi_long", "adx_short", "adx_med", "adx_long",
-            "macd_short_med", "macd_short_long", "macd_med_long"]
 
 
+  def update_order_book(self, slot, server_timestamp, bid_arr, ask_arr, avg_spread,
+                        qty_spread):
+    """Updates the stream of the slot with the given order book data."""
 
+    self._last_order_book_timestamps[slot] = server_timestamp
+    self._last_avg_spreads[slot] = avg_spread
+    self._last_qty_spreads[slot] = qty_spread
 
-  def _compute_features(self, feats_arr):
-    """Computes all features for the latest period from all buffered
-    periods and order books into the specified features array."""
+    self._bid_windows.append_slot(slot, bid_arr)
+    self._ask_windows.append_slot(slot, ask_arr)
+    self._window_versions[slot] += 1
 
-    highest_high_short = np.max(self._highs_buffer[-self._days_short:])
-    highest_high_med = np.max(self._highs_buffer[-self._days_med:])
-    highest_high_long = np.max(self._highs_buffer[-self._days_long:])
 
-    lowest_low_short = np.min(self._lows_buffer[-self._days_short:])
-    lowest_low_med = np.min(self._lows_buffer[-self._days_med:])
-    lowest_low_long = np.min(self._lows_buffer[-self._days_long:])
 
-    percent_range_short = ((highest_high_short - self._price_buffer[-1])
-                           / (highest_high_short - lowest_low_short + _EPSILON) * -100.)
-    percent_range_med = ((highest_high_med - self._price_buffer[-1])
-                           / (highest_high_med - lowest_low_med + _EPSILON) * -100.)
-    percent_range_long = ((highest_high_long - self._price_buffer[-1])
-                           / (highest_high_long - lowest_low_long + _EPSILON) * -100.)
+  def get_feat_labels(self):
+    """Returns a list of strings containing labels for the feature window columns."""
+    return list(self._feature_names)
 
 
-    rsi_short = 100. - 100. / (1.+self._up_avg_ema_short/(self._down_avg_ema_short + _EPSILON))
-    rsi_med = 100. - 100. / (1.+self._up_avg_ema_med/(self._down_avg_ema_med + _EPSILON))
-    rsi_long = 100. - 100. / (1.+self._up_avg_ema_long/(self._down_avg_ema_long + _EPSILON))
 
 
-    pos_di_short = 100. * self._pos_dir_ema_short / (self._tr_ema_short + _EPSILON)
-    neg_di_short = 100. * self._neg_dir_ema_short / (self._tr_ema_short + _EPSILON)
-    pos_di_med = 100. * self._pos_dir_ema_med / (self._tr_ema_med + _EPSILON)
-    neg_di_med = 100. * self._neg_dir_ema_med / (self._tr_ema_med + _EPSILON)
-    pos_di_long = 100. * self._pos_dir_ema_long / (self._tr_ema_long + _EPSILON)
-    neg_di_long = 100. * self._neg_dir_ema_long / (self._tr_ema_long + _EPSILON)
+  def _get_slot_index(self, slots):
+    """Returns an index of the array of slot indices into the per slot state
+    arrays, which is a slice if the slots are a single slot or every slot in
+    order, so that state is read and written through views."""
 
-    cur_adx_short = np.abs(pos_di_short - neg_di_short) / (pos_di_short + neg_di_short + _EPSILON)
-    cur_adx_med = np.abs(pos_di_med - neg_di_med) / (pos_di_med + neg_di_med + _EPSILON)
-    cur_adx_long = np.abs(pos_di_long - neg_di_long) / (pos_di_long + neg_di_long + _EPSILON)
+    if len(slots) == 1:
+      return slice(slots[0], slots[0] + 1)
+    if len(slots) == self._num_slots and np.all(np.diff(slots) == 1):
+      return slice(0, self._num_slots)
+    return slots
 
-    self._adx_ema_short = self._adx_ema_short + (self._ema_alpha_short
-                            * (cur_adx_short - self._adx_ema_short))
-    self._adx_ema_med = self._adx_ema_med + (self._ema_alpha_med
-                            * (cur_adx_med - self._adx_ema_med))
-    self._adx_ema_long = self._adx_ema_long + (self._ema_alpha_long
-                            * (cur_adx_long - self._adx_ema_long))
 
 
-    feats_arr[0] = self._price_buffer[-1]
-    feats_arr[1] = self._quantity_buffer[-1]
-    feats_arr[2] = self._last_avg_spread
-    feats_arr[3] = self._last_qty_spread
+  def _compute_features(self, slots, index, periods):
+    """Updates the indicators of the slots from all buffered periods and order
+    books, given their latest periods, and returns an array of the features of
+    the latest period with a row for each slot."""
 
-    feats_arr[4] = percent_range_short
-    feats_arr[5] = percent_range_med
-    feats_arr[6] = percent_range_long
+    context = self._context
+    context["slots"] = slots
+    context["periods"] = periods
+    context["avg_spreads"] = self._last_avg_spreads[index]
+    context["qty_spreads"] = self._last_qty_spreads[index]
 
-    feats_arr[7] = rsi_short
-    feats_arr[8] = rsi_med
-    feats_arr[9] = rsi_long
+    for indicator in self._indicators:
+      if indicator.name in self._indicator_states:
+        state = self._indicator_states[indicator.name]
+        state[index], context[indicator.name] = indicator.update_fn(state[index], context)
+      else:
+        _, context[indicator.name] = indicator.update_fn(
+            self._indicator_objects.get(indicator.name), context)
 
-    feats_arr[10] = self._adx_ema_short * 100.
-    feats_arr[11] = self._adx_ema_med * 100.
-    feats_arr[12] = self._adx_ema_long * 100.
+    feats_arr = np.empty((len(slots), self._num_feats), dtype=_FLOAT_DTYPE)
+    for i, feature in enumerate(self._features):
+      feats_arr[:, i] = feature.compute_fn(context)
 
-    feats_arr[13] = self._price_ema_short - self._price_ema_med
-    feats_arr[14] = self._price_ema_short - self._price_ema_long
-    feats_arr[15] = self._price_ema_med - self._price_ema_long
+    return feats_arr
 
     
 
 
 
 
-  def update_trade_period(self, server_period_timestamp, total_quantity,
-                          total_num_trades, avg_price, low_price, high_price):
-    """Updates the stream buffer with the given trading period data."""
+  def _update_trade_period_slot(self, slot, server_period_timestamp, total_quantity,
+                                avg_price, low_price, high_price):
+    """Updates the stream of the slot with the given trading period data, as
+    `update_trade_periods` does for arrays of slots, with scalar operations."""
 
-    self._last_period_timestamp = server_period_timestamp
-
-    last_avg = self._price_buffer[-1]
-    last_low = self._lows_buffer[-1]
-    last_high = self._highs_buffer[-1]
-
-
-    # Update trade buffers.
-    self._price_buffer[:-1] = self._price_buffer[1:]
-    self._quantity_buffer[:-1] = self._quantity_buffer[1:]
-    self._lows_buffer[:-1] = self._lows_buffer[1:]
-    self._highs_buffer[:-1] = self._highs_buffer[1:]
-    self._up_avg_buffer[:-1] = self._up_avg_buffer[1:]
-    self._down_avg_buffer[:-1] = self._down_avg_buffer[1:]
-    self._pos_dir_buffer[:-1] = self._pos_dir_buffer[1:]
-    self._neg_dir_buffer[:-1] = self._neg_dir_buffer[1:]
-    self._tr_buffer[:-1] = self._tr_buffer[1:]
-
-    self._price_buffer[-1] = avg_price
-    self._quantity_buffer[-1] = total_quantity
-    self._lows_buffer[-1] = low_price
-    self._highs_buffer[-1] = high_price
-    self._tr_buffer[-1] = np.max([high_price - low_price,
-                                  np.abs(high_price - last_avg),
-                                  np.abs(low_price - last_avg)])
-
-    if avg_price > last_avg:
-      self._up_avg_buffer[-1] = avg_price - last_avg
-      self._down_avg_buffer[-1] = 0
-    else:
-      self._up_avg_buffer[-1] = 0
-      self._down_avg_buffer[-1] = last_avg - avg_price
-    
+    self._last_period_timestamps[slot] = server_period_timestamp
+
+    last_period = self._period_buffers.window(slot)[-1].tolist()
+    last_avg = last_period[PERIOD_PRICE]
+    last_low = last_period[PERIOD_LOW]
+    last_high = last_period[PERIOD_HIGH]
+
+    period = [0.] * NUM_PERIOD_COLS
+    period[PERIOD_PRICE] = avg_price
+    period[PERIOD_QUANTITY] = total_quantity
+    period[PERIOD_LOW] = low_price
+    period[PERIOD_HIGH] = high_price
+    period[PERIOD_TR] = max(high_price - low_price, abs(high_price - last_avg),
+                            abs(low_price - last_avg))
+
+    avg_move = avg_price - last_avg
+    period[PERIOD_UP_AVG] = max(avg_move, 0)
+    period[PERIOD_DOWN_AVG] = max(-avg_move, 0)
 
     up_move = high_price - last_high
     down_move = last_low - low_price
+    period[PERIOD_POS_DIR] = up_move if up_move > max(down_move, 0) else 0
+    period[PERIOD_NEG_DIR] = down_move if down_move > max(up_move, 0) else 0
+
+    self._period_buffers.append_slot(slot, period)
+
+
+    context = self._slot_context
+    context["slot"] = slot
+    context["period"] = period
+    context["avg_spread"] = float(self._last_avg_spreads[slot])
+    context["qty_spread"] = float(self._last_qty_spreads[slot])
+
+    for indicator in self._indicators:
+      if indicator.name in self._indicator_states:
+        state = self._indicator_states[indicator.name]
+        state[slot], context[indicator.name] = indicator.slot_fn(state[slot].tolist(),
+                                                                 context)
+      else:
+        _, context[indicator.name] = indicator.slot_fn(
+            self._indicator_objects.get(indicator.name), context)
+
+    self._feats_windows.append_slot(slot, np.array(
+        [feature.slot_fn(context) for feature in self._features], dtype=_FLOAT_DTYPE))
+    self._window_versions[slot] += 1
+
+    if (self._last_order_book_timestamps[slot] > 0
+        and self._cur_buffered_periods[slot] < self._num_buffer_periods):
+      self._cur_buffered_periods[slot] += 1
+
+
+
+  def update_trade_periods(self, slots, server_period_timestamps, total_quantities,
+                           total_num_trades, avg_prices, low_prices, high_prices):
+    """Updates the streams of the array of distinct slot indices with the given
+    arrays of trading period data, one element per slot."""
 
-    if up_move > down_move and up_move > 0:
-      self._pos_dir_buffer[-1] = up_move
-    else:
-      self._pos_dir_buffer[-1] = 0
+    if len(slots) == 1 and self._has_slot_fns:
+      self._update_trade_period_slot(int(slots[0]), server_period_timestamps[0],
+                                     float(total_quantities[0]), float(avg_prices[0]),
+                                     float(low_prices[0]), float(high_prices[0]))
+      return
 
-    if down_move > up_move and down_move > 0:
-      self._neg_dir_buffer[-1] = down_move
-    else:
-      self._neg_dir_buffer[-1] = 0
+    slots = np.asarray(slots, dtype="int64")
+    index = self._get_slot_index(slots)
 
+    self._last_period_timestamps[index] = server_period_timestamps
 
+    last_periods = self._period_buffers.latest(slots)
+    last_avgs = last_periods[:, PERIOD_PRICE]
+    last_lows = last_periods[:, PERIOD_LOW]
+    last_highs = last_periods[:, PERIOD_HIGH]
 
-    # Update exponential moving averages.
-    self._price_ema_short = self._price_ema_short + (self._ema_alpha_short
-                              * (self._price_buffer[-1] - self._price_ema_short))
-    self._price_ema_med = self._price_ema_med + (self._ema_alpha_med
-                            * (self._price_buffer[-1] - self._price_ema_med))
-    self._price_ema_long = self._price_ema_long + (self._ema_alpha_long
-                             * (self._price_buffer[-1] - self._price_ema_long))
 
-    self._up_avg_ema_short = self._up_avg_ema_short + (self._ema_alpha_short
-                               * (self._up_avg_buffer[-1] - self._up_avg_ema_short))
-    self._up_avg_ema_med = self._up_avg_ema_med + (self._ema_alpha_med
-                             * (self._up_avg_buffer[-1] - self._up_avg_ema_med))
-    self._up_avg_ema_long = self._up_avg_ema_long + (self._ema_alpha_long
-                              * (self._up_avg_buffer[-1] - self._up_avg_ema_long))
-    self._down_avg_ema_short = self._down_avg_ema_short + (self._ema_alpha_short
-                                 * (self._down_avg_buffer[-1] - self._down_avg_ema_short))
-    self._down_avg_ema_med = self._down_avg_ema_med + (self._ema_alpha_med
-                               * (self._down_avg_buffer[-1] - self._down_avg_ema_med))
-    self._down_avg_ema_long = self._down_avg_ema_long + (self._ema_alpha_long
-                                * (self._down_avg_buffer[-1] - self._down_avg_ema_long))
+    # Update trade buffers. Columns are filled from one array of the inputs,
+    # so they are converted once.
+    periods = np.empty((len(slots), NUM_PERIOD_COLS), dtype=STATE_DTYPE)
+    inputs = np.array([avg_prices, total_quantities, low_prices, high_prices],
+                      dtype=STATE_DTYPE).T
+    periods[:, :PERIOD_HIGH + 1] = inputs
+    avg_prices, _, low_prices, high_prices = inputs.T
 
-    self._pos_dir_ema_short = self._pos_dir_ema_short + (self._ema_alpha_short
-                                * (self._pos_dir_buffer[-1] - self._pos_dir_ema_short))
-    self._pos_dir_ema_med = self._pos_dir_ema_med + (self._ema_alpha_med
-                              * (self._pos_dir_buffer[-1] - self._pos_dir_ema_med))
-    self._pos_dir_ema_long = self._pos_dir_ema_long + (self._ema_alpha_long
-                               * (self._pos_dir_buffer[-1] - self._pos_dir_ema_long))
-    self._neg_dir_ema_short = self._neg_dir_ema_short + (self._ema_alpha_short
-                                * (self._neg_dir_buffer[-1] - self._neg_dir_ema_short))
-    self._neg_dir_ema_med = self._neg_dir_ema_med + (self._ema_alpha_med
-                              * (self._neg_dir_buffer[-1] - self._neg_dir_ema_med))
-    self._neg_dir_ema_long = self._neg_dir_ema_long + (self._ema_alpha_long
-                               * (self._neg_dir_buffer[-1] - self._neg_dir_ema_long))
+    periods[:, PERIOD_TR] = np.maximum(np.maximum(high_prices - low_prices,
+                                                  np.abs(high_prices - last_avgs)),
+                                       np.abs(low_prices - last_avgs))
 
-    self._tr_ema_short = self._tr_ema_short + (self._ema_alpha_short
-                           * (self._tr_buffer[-1] - self._tr_ema_short))
-    self._tr_ema_med = self._tr_ema_med + (self._ema_alpha_med
-                         * (self._tr_buffer[-1] - self._tr_ema_med))
-    self._tr_ema_long = self._tr_ema_long + (self._ema_alpha_long
-                          * (self._tr_buffer[-1] - self._tr_ema_long))
+    avg_moves = avg_prices - last_avgs
+    periods[:, PERIOD_UP_AVG] = np.maximum(avg_moves, 0)
+    periods[:, PERIOD_DOWN_AVG] = np.maximum(-avg_moves, 0)
 
 
+    up_moves = high_prices - last_highs
+    down_moves = last_lows - low_prices
 
+    periods[:, PERIOD_POS_DIR] = np.where(up_moves > np.maximum(down_moves, 0), up_moves, 0)
+    periods[:, PERIOD_NEG_DIR] = np.where(down_moves > np.maximum(up_moves, 0), down_moves, 0)
 
+    self._period_buffers.append(slots, periods)
 
-    # Update feature vector window.
-    self._feats_window[:-1, :] = self._feats_window[1:, :]
-    self._compute_features(self._feats_window[-1, :])
+
+
+    # Update indicators and feature vector windows.
+    self._feats_windows.append(slots, self._compute_features(slots, index, periods))
+    self._window_versions[index] += 1
 
 
     # Increment count of buffered periods only if orderbook is also already set.
-    if (self._last_order_book_timestamp > 0
-        and self._cur_buffered_periods < self._num_buffer_periods):
-      self._cur_buffered_periods += 1
+    self._cur_buffered_periods[index] += (
+        (self._last_order_book_timestamps[index] > 0)
+        & (self._cur_buffered_periods[index] < self._num_buffer_periods))
 
 
 
@@ -331,19 +340,88 @@ class RealtimeTradeStreamBuffer(object):
 
 
 
-  def get_features_window(self):
-    """Returns a tuple containing the latest server timestamp and a
-    reference to the multidimensional array storing all features of the current
-    feature window, if the trading period buffer is full. Otherwise, returns `None`."""
+  def get_features_window(self, slot):
+    """Returns a tuple containing the latest server timestamp of the slot and
+    views of the multidimensional arrays storing all features of its current
+    feature window, if its trading period buffer is full. Otherwise, returns
+    `None`."""
 
-    if self._cur_buffered_periods >= self._num_buffer_periods:
-      return (self._last_period_timestamp, self._feats_window,
-              self._bid_window, self._ask_window)
+    if self._cur_buffered_periods[slot] >= self._num_buffer_periods:
+      return (self._last_period_timestamps[slot], self._feats_windows.window(slot),
+              self._bid_windows.window(slot), self._ask_windows.window(slot))
 
     return None
 
 
 
+  def get_window_versions(self, slots):
+    """Returns an array of the window version of each of the slots, which
+    changes whenever a period close or order book update advances any of the
+    windows of the slot. Windows of the same version are identical."""
+
+    return self._window_versions[np.asarray(slots, dtype="int64")]
+
+
 
+  def get_features_windows(self, slots):
+    """Returns a tuple containing a boolean array of whether the trading period
+    buffer of each of the slots is full, and the latest server timestamps and
+    stacked feature, bid and ask windows of the slots whose buffers are full, in
+    the order given."""
 
+    slots = np.asarray(slots, dtype="int64")
+    is_ready = self._cur_buffered_periods[slots] >= self._num_buffer_periods
+    ready_slots = slots[is_ready]
+    return (is_ready, self._last_period_timestamps[ready_slots],
+            self._feats_windows.windows(ready_slots), self._bid_windows.windows(ready_slots),
+            self._ask_windows.windows(ready_slots))
+
+
+
+
+
+
+
+class RealtimeTradeStreamBuffer(object):
+  """Models a stream of real time trading data with trading periods updated at
+  regular, evenly-spaced intervals. Stream features are buffered over a
+  window of recent history. Wraps a `StreamFeatureEngine` with a single slot."""
+
+
+  def __init__(self, feature_names=None):
+    self._engine = StreamFeatureEngine(1, feature_names)
+    self._slots = np.array([0])
+
+
+
+  def update_order_book(self, server_timestamp, bid_arr, ask_arr, avg_spread,
+                        qty_spread):
+    """Updates the stream buffer with the given order book data."""
+
+    self._engine.update_order_book(0, server_timestamp, bid_arr, ask_arr, avg_spread,
+                                   qty_spread)
+
+
+
+  def get_feat_labels(self):
+    """Returns a list of strings containing labels for the feature window columns."""
+    return self._engine.get_feat_labels()
+
+
+
+  def update_trade_period(self, server_period_timestamp, total_quantity,
+                          total_num_trades, avg_price, low_price, high_price):
+    """Updates the stream buffer with the given trading period data."""
+
+    self._engine.update_trade_periods(self._slots, [server_period_timestamp],
+                                      [total_quantity], [total_num_trades],
+                                      [avg_price], [low_price], [high_price])
+
+
+
+  def get_features_window(self):
+    """Returns a tuple containing the latest server timestamp and a
+    reference to the multidimensional array storing all features of the current
+    feature window, if the trading period buffer is full. Otherwise, returns `None`."""
 
+    return self._engine.get_features_window(0)
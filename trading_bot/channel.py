@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Defines bounded, process-safe channels for passing data between runners.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+
+import collections
+import multiprocessing
+import threading
+
+from multiprocessing.managers import SyncManager
+
+
+
+OVERFLOW_POLICIES = ["block", "drop_oldest", "coalesce"]
+
+
+# Indices into the shared channel counters array.
+_DEPTH = 0
+_HIGH_WATER_MARK = 1
+_NUM_DROPPED = 2
+_NUM_COALESCED = 3
+_NUM_COUNTERS = 4
+
+
+
+
+class _ChannelBuffer(object):
+  """Buffer living in the manager process that implements the overflow policy
+  of a channel. Every operation is a single call through the manager proxy and
+  returns the updated counters so clients never need to query them."""
+
+
+  def __init__(self, capacity, policy):
+    self._capacity = capacity
+    self._policy = policy
+    self._items = collections.deque()
+    self._coalesced = {}
+    self._cond = threading.Condition()
+    self._high_water_mark = 0
+    self._num_dropped = 0
+    self._num_coalesced = 0
+
+
+  def _is_full(self):
+    return self._capacity > 0 and len(self._items) >= self._capacity
+
+
+  def _counters(self):
+    return (len(self._items), self._high_water_mark, self._num_dropped,
+            self._num_coalesced)
+
+
+  def put(self, item):
+    """Adds the item according to the overflow policy and returns the updated
+    channel counters."""
+
+    with self._cond:
+
+      if self._policy == "coalesce":
+        key = item[0]
+        if key in self._coalesced:
+          self._coalesced[key] = item
+          self._num_coalesced += 1
+          return self._counters()
+
+        if self._is_full():
+          del self._coalesced[self._items.popleft()]
+          self._num_dropped += 1
+        self._items.append(key)
+        self._coalesced[key] = item
+
+      else:
+        if self._policy == "block":
+          while self._is_full():
+            self._cond.wait()
+        elif self._is_full():
+          self._items.popleft()
+          self._num_dropped += 1
+        self._items.append(item)
+
+      self._high_water_mark = max(self._high_water_mark, len(self._items))
+      return self._counters()
+
+
+  def get_nowait(self):
+    """Removes and returns a tuple containing the oldest item and the updated
+    channel depth. Raises `queue.Empty` if there are no items."""
+
+    with self._cond:
+      if not self._items:
+        raise queue.Empty
+
+      item = self._items.popleft()
+      if self._policy == "coalesce":
+        item = self._coalesced.pop(item)
+      self._cond.notify()
+
+      return item, len(self._items)
+
+
+  def qsize(self):
+    return len(self._items)
+
+
+
+
+class ChannelManager(SyncManager):
+  """Manager that additionally hosts channel buffers."""
+  pass
+
+ChannelManager.register("ChannelBuffer", _ChannelBuffer)
+
+
+
+
+class Channel(object):
+  """Encapsulates a process-safe queue with a fixed capacity and an overflow
+  policy. Channel depth and high-water-mark counters are kept in shared memory
+  so they can be read without a round trip to the manager process.
+
+  The "block" policy blocks producers while the channel is full, "drop_oldest"
+  discards the oldest item to make room, and "coalesce" keeps only the latest
+  item for each key, where the key is the first element of each item (usually
+  the symbol pair). A capacity of 0 leaves the channel unbounded.
+
+  If `record_cls` is given, items carry a record of that namedtuple class,
+  either as the item itself or at `record_index` of the item. Records cross
+  the process boundary as plain tuples, which pickle several times faster, and
+  are rebuilt when they are taken from the channel."""
+
+
+  def __init__(self, mp_mgr, name, capacity=0, policy="block", record_cls=None,
+               record_index=None):
+    if policy not in OVERFLOW_POLICIES:
+      raise ValueError("Invalid overflow policy: %s" % policy)
+    if capacity < 0:
+      raise ValueError("Invalid channel capacity: %s" % capacity)
+
+    self.name = name
+    self.capacity = capacity
+    self.policy = policy
+    self._record_cls = record_cls
+    self._record_index = record_index
+    self._buffer = mp_mgr.ChannelBuffer(capacity, policy)
+    self._counters = multiprocessing.RawArray("l", _NUM_COUNTERS)
+
+
+
+  def _encode(self, item):
+    if self._record_cls is None:
+      return item
+    i = self._record_index
+    if i is None:
+      return tuple(item)
+    return item[:i] + (tuple(item[i]),) + item[i + 1:]
+
+
+
+  def _decode(self, item):
+    if self._record_cls is None:
+      return item
+    i = self._record_index
+    if i is None:
+      return self._record_cls._make(item)
+    return item[:i] + (self._record_cls._make(item[i]),) + item[i + 1:]
+
+
+
+  def put(self, item):
+    """Adds an item to the channel, applying the overflow policy if full."""
+
+    counters = self._buffer.put(self._encode(item))
+    for i in range(_NUM_COUNTERS):
+      self._counters[i] = counters[i]
+
+
+
+  def get_nowait(self):
+    """Removes and returns the oldest item. Raises `queue.Empty` if there are
+    no items."""
+
+    item, depth = self._buffer.get_nowait()
+    self._counters[_DEPTH] = depth
+    return self._decode(item)
+
+
+
+  def qsize(self):
+    return self._buffer.qsize()
+
+  def empty(self):
+    return self.qsize() == 0
+
+
+
+  def stats(self):
+    """Returns a dictionary of channel telemetry counters."""
+
+    return {"capacity": self.capacity,
+            "policy": self.policy,
+            "depth": self._counters[_DEPTH],
+            "high_water_mark": self._counters[_HIGH_WATER_MARK],
+            "num_dropped": self._counters[_NUM_DROPPED],
+            "num_coalesced": self._counters[_NUM_COALESCED]}
+
+
+
+
+class LocalChannel(Channel):
+  """Channel for producers and consumers that all run in the same process.
+  Items are passed by reference without serialization. The counters are
+  shared with the channel it replaces, so telemetry is unaffected. Since
+  blocking would stall the only loop able to drain the channel, the "block"
+  policy drops the oldest item instead when the channel is full."""
+
+
+  def __init__(self, channel):
+    self.name = channel.name
+    self.capacity = channel.capacity
+    self.policy = channel.policy
+    self._record_cls = None
+    self._record_index = None
+    if self.policy == "block":
+      self._buffer = _ChannelBuffer(channel.capacity, "drop_oldest")
+    else:
+      self._buffer = _ChannelBuffer(channel.capacity, channel.policy)
+    self._counters = channel._counters
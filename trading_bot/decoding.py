@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Defines decoders for JSON messages from the exchange stream and recordings.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import json
+import re
+
+from collections import OrderedDict
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import ujson
+except ImportError:
+  ujson = None
+
+
+
+
+# Installed JSON decoding functions by name, fastest first. The standard
+# library decoder is always available.
+JSON_DECODERS = OrderedDict()
+if orjson is not None:
+  JSON_DECODERS["orjson"] = orjson.loads
+if ujson is not None:
+  JSON_DECODERS["ujson"] = ujson.loads
+JSON_DECODERS["json"] = json.loads
+
+
+
+def get_json_decoder(name="auto"):
+  """Returns the named JSON decoding function, or the fastest installed one if
+  the name is "auto"."""
+
+  if name == "auto":
+    return next(iter(JSON_DECODERS.values()))
+  try:
+    return JSON_DECODERS[name]
+  except KeyError:
+    raise ValueError("JSON decoder is not installed: %s" % name)
+
+
+
+
+# Layouts of the fields used from trade and depth update events, in the order
+# the exchange sends them.
+_TRADE_RE = re.compile(r'"data":\{"e":"trade","E":(\d+),"s":"([^"]+)","t":\d+,'
+                       r'"p":"([^"]+)","q":"([^"]+)","b":(\d+),"a":(\d+),"T":(\d+),'
+                       r'"m":(true|false)')
+_DEPTH_RE = re.compile(r'"data":\{"e":"depthUpdate","E":(\d+),"s":"([^"]+)",'
+                       r'"U":(\d+),"u":(\d+),"b":(\[.*?\]),"a":(\[.*\])\}')
+_LEVEL_RE = re.compile(r'\["([^"]*)","([^"]*)"')
+
+
+
+
+class StreamDecoder(object):
+  """Decodes frames of the exchange combined stream and returns the dictionary
+  of event data. If `extract_fields` is set, the fields used from trade and
+  depth update frames are pulled out with regular expressions instead of
+  decoding the whole frame, and depth levels are lists of (price level string,
+  quantity string) tuples. Other frames, and frames that do not have the
+  expected layout, are decoded in full with the JSON decoder."""
+
+
+  def __init__(self, json_decoder="auto", extract_fields=False):
+    self._loads = get_json_decoder(json_decoder)
+    self._extract_fields = extract_fields
+
+
+
+  def decode(self, msg):
+    """Returns the event data of the frame."""
+
+    if self._extract_fields:
+      if isinstance(msg, bytes):
+        msg = msg.decode("utf-8")
+
+      match = _TRADE_RE.search(msg)
+      if match is not None:
+        return {"e": "trade", "E": int(match.group(1)), "s": match.group(2),
+                "p": match.group(3), "q": match.group(4), "b": int(match.group(5)),
+                "a": int(match.group(6)), "T": int(match.group(7)),
+                "m": match.group(8) == "true"}
+
+      match = _DEPTH_RE.search(msg)
+      if match is not None:
+        return {"e": "depthUpdate", "E": int(match.group(1)), "s": match.group(2),
+                "U": int(match.group(3)), "u": int(match.group(4)),
+                "b": _LEVEL_RE.findall(match.group(5)),
+                "a": _LEVEL_RE.findall(match.group(6))}
+
+    return self._loads(msg)["data"]
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Defines functions for exporting recorded sessions as training samples in
+memory-mapped shards, and an object for reading them back.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import bisect
+import collections
+import gzip
+import itertools
+import json
+import numpy as np
+import os
+
+from trading_bot.buffer import StreamFeatureEngine
+from trading_bot.decoding import get_json_decoder
+from trading_bot.parsing import parse_depth_state
+from trading_bot.periods import TradePeriodAggregator
+from trading_bot.prediction import TradePredictionModel
+from trading_bot.records import OrderBookState, Trade
+
+
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Arrays of each shard, in sample tuple order.
+SHARD_ARRAYS = ["timestamps", "feats", "bids", "asks", "labels"]
+
+# Array of each shard with the index of each sample's session in the shard's
+# list of sessions.
+SESSION_IDS_ARRAY = "session_ids"
+
+
+
+
+def get_recorded_sessions(data_store_dir):
+  """Returns a sorted list of tuples of the session timestamp and symbol pair
+  of every recording in the data directory with both trades and depths."""
+
+  sessions = []
+  for session_dir in os.listdir(data_store_dir):
+    if not session_dir.isdigit():
+      continue
+    filenames = set(os.listdir(os.path.join(data_store_dir, session_dir)))
+    for filename in filenames:
+      prefix = "%s_" % session_dir
+      if (filename.startswith(prefix) and filename.endswith("_trades.txt.gz")
+          and filename.replace("_trades.", "_depth.") in filenames):
+        sessions.append((int(session_dir), filename[len(prefix):-len("_trades.txt.gz")]))
+  return sorted(sessions)
+
+
+
+def _read_session_events(data_store_dir, timestamp, pair, loads):
+  """Yields the `Trade` and `OrderBookState` records of the recorded session in
+  server timestamp order. Depths come before trades with the same timestamp."""
+
+  data_dir = os.path.join(data_store_dir, "%d" % timestamp)
+  with gzip.open(os.path.join(data_dir, "%d_%s_trades.txt.gz" % (timestamp, pair)),
+                 "rb") as trades_in:
+    with gzip.open(os.path.join(data_dir, "%d_%s_depth.txt.gz" % (timestamp, pair)),
+                   "rb") as depth_in:
+
+      def read_next(f_in, from_json_obj):
+        line = f_in.readline()
+        return from_json_obj(loads(line)) if line.strip() else None
+
+      trade = read_next(trades_in, Trade.from_json_obj)
+      depth = read_next(depth_in, OrderBookState.from_json_obj)
+      while trade is not None or depth is not None:
+        if trade is None or (depth is not None
+                             and depth.server_timestamp <= trade.server_timestamp):
+          yield depth
+          depth = read_next(depth_in, OrderBookState.from_json_obj)
+        else:
+          yield trade
+          trade = read_next(trades_in, Trade.from_json_obj)
+
+
+
+
+class _ShardWriter(object):
+  """Writes samples into shards of `shard_size` samples, each stored as `.npy`
+  files that are written through memory maps. The shard arrays are created with
+  the shapes of the first sample written to them, and the arrays of a last
+  shard that is not full are rewritten with its number of samples. Each shard
+  also lists the sessions of its samples, and has an array of the index in
+  that list of each sample's session."""
+
+
+  def __init__(self, out_dir, prefix, shard_size):
+    self._out_dir = out_dir
+    self._prefix = prefix
+    self._shard_size = shard_size
+    self._files = None
+    self._arrays = None
+    self._session_ids = None
+    self._num_samples = 0
+    self.shards = []
+
+
+
+  def _open_array(self, name, dtype, shape):
+    filename = "%s_%05d_%s.npy" % (self._prefix, len(self.shards), name)
+    self._files[name] = filename
+    return np.lib.format.open_memmap(os.path.join(self._out_dir, filename), mode="w+",
+                                     dtype=dtype, shape=(self._shard_size,) + shape)
+
+
+
+  def add(self, sample, session):
+    """Adds a sample of the session, given as a tuple of its timestamp and
+    symbol pair."""
+
+    if self._arrays is None:
+      self._files = {}
+      self._arrays = []
+      for name, value in zip(SHARD_ARRAYS, sample):
+        value = np.asarray(value)
+        self._arrays.append(self._open_array(name, value.dtype, value.shape))
+      self._session_ids = self._open_array(SESSION_IDS_ARRAY, np.int32, ())
+      self.shards.append({"files": self._files, "num_samples": 0, "sessions": []})
+
+    sessions = self.shards[-1]["sessions"]
+    session = list(session)
+    if session not in sessions:
+      sessions.append(session)
+    self._session_ids[self._num_samples] = sessions.index(session)
+
+    for array, value in zip(self._arrays, sample):
+      array[self._num_samples] = value
+    self._num_samples += 1
+
+    if self._num_samples == self._shard_size:
+      self.close()
+
+
+
+  def close(self):
+    """Flushes the shard being written."""
+
+    if self._arrays is not None:
+      arrays = self._arrays + [self._session_ids]
+      names = SHARD_ARRAYS + [SESSION_IDS_ARRAY]
+      for name, array in zip(names, arrays):
+        if self._num_samples == self._shard_size:
+          array.flush()
+        else:
+          filename = os.path.join(self._out_dir, self._files[name])
+          with open(filename + ".tmp", "wb") as f_out:
+            np.save(f_out, array[:self._num_samples])
+          os.rename(filename + ".tmp", filename)
+      self.shards[-1]["num_samples"] = self._num_samples
+      self._arrays = None
+      self._session_ids = None
+      self._num_samples = 0
+
+
+
+
+def _replay_session(config, engine, slot, timestamp, pair):
+  """Replays the recorded session of the symbol pair into the orderbook of the
+  slot of the feature engine, and yields the list of trading periods closed
+  before each event that closes any, as tuples of the timestamp, total
+  quantity, number of trades, average price, low price and high price.
+
+  Periods are closed and filled as the analysis runner does at each recorded
+  server timestamp."""
+
+  period_time = config["period_time"]
+  loads = get_json_decoder(config["json_decoder"])
+  trade_periods = TradePeriodAggregator(period_time)
+  last_closed_time_bin = 0
+
+  for event in _read_session_events(config["data_store_dir"], timestamp, pair, loads):
+
+    last_time_bin = ((event.server_timestamp // period_time) - 1) * period_time
+    if last_time_bin > last_closed_time_bin:
+      last_closed_time_bin = last_time_bin
+
+      periods = trade_periods.close_periods(last_time_bin)
+      if not periods:
+        last_avg_price = trade_periods.last_avg_price
+        periods = [(last_time_bin, 0., 0, last_avg_price, last_avg_price, last_avg_price)]
+      yield periods
+
+    if isinstance(event, Trade):
+      trade_periods.add_trade(event)
+    else:
+      _, bid_arr, ask_arr, avg_spread, qty_spread = parse_depth_state(
+          config["num_depth_bins"], event)
+      engine.update_order_book(slot, event.server_timestamp, bid_arr, ask_arr, avg_spread,
+                               qty_spread)
+
+
+
+def export_sessions(config, sessions, out_dir, prefix, label_periods, shard_size):
+  """Streams the recorded sessions, given as a list of tuples of the session
+  timestamp and symbol pair, through the feature engine and writes a sample
+  for each trading period closed with a full feature window to shards in the
+  output directory, with file names starting with the prefix. Returns a list
+  of dictionaries describing the shards.
+
+  Each session has its own slot of one engine, and the sessions are replayed
+  in lockstep, so the periods they close are updated together. Each sample has
+  the period timestamp, the feature, bid and ask windows after the period
+  closes, and a label of the log return of the average price `label_periods`
+  periods later, so the last periods of each session have no samples."""
+
+  engine = StreamFeatureEngine(len(sessions), TradePredictionModel.feature_names)
+  replays = [_replay_session(config, engine, slot, timestamp, pair)
+             for slot, (timestamp, pair) in enumerate(sessions)]
+  writer = _ShardWriter(out_dir, prefix, shard_size)
+
+  # Samples of each slot waiting for the average prices of their label periods.
+  pending_samples = [collections.deque() for _ in sessions]
+
+  active_slots = list(range(len(sessions)))
+  while active_slots:
+
+    # Closed periods of all sessions are updated together, one closed period
+    # per session at a time.
+    closed_periods = []
+    for slot in list(active_slots):
+      try:
+        periods = next(replays[slot])
+      except StopIteration:
+        active_slots.remove(slot)
+        continue
+      for num_closed, period in enumerate(periods):
+        closed_periods.append((num_closed, slot) + period)
+
+    closed_periods.sort(key=lambda period: period[0])
+    for _, periods in itertools.groupby(closed_periods, key=lambda period: period[0]):
+      (_, slots, period_timestamps, total_quantities, total_num_trades, avg_prices,
+       low_prices, high_prices) = [np.array(column) for column in zip(*periods)]
+      engine.update_trade_periods(slots, period_timestamps, total_quantities,
+                                  total_num_trades, avg_prices, low_prices, high_prices)
+
+      is_ready, timestamps, feats_windows, bid_windows, ask_windows = (
+          engine.get_features_windows(slots))
+
+      for slot, avg_price in zip(slots, avg_prices):
+        slot_samples = pending_samples[slot]
+        for sample in slot_samples:
+          sample[-1].append(avg_price)
+        while slot_samples and len(slot_samples[0][-1]) > label_periods:
+          period_timestamp, feats, bids, asks, prices = slot_samples.popleft()
+          if prices[0] > 0 and prices[-1] > 0:
+            writer.add((period_timestamp, feats, bids, asks,
+                        np.float32(np.log(prices[-1] / prices[0]))), sessions[slot])
+
+      for i, slot in enumerate(slots[is_ready]):
+        pending_samples[slot].append((timestamps[i], feats_windows[i], bid_windows[i],
+                                      ask_windows[i], [avg_prices[is_ready][i]]))
+
+  writer.close()
+  return writer.shards
+
+
+
+def write_manifest(out_dir, config, label_periods, shard_size, shards):
+  """Writes the manifest of the exported shards to the output directory."""
+
+  manifest = {"feature_names": list(TradePredictionModel.feature_names),
+              "period_time": config["period_time"],
+              "num_depth_bins": config["num_depth_bins"],
+              "label_periods": label_periods,
+              "shard_size": shard_size,
+              "num_samples": sum(shard["num_samples"] for shard in shards),
+              "shards": shards}
+  with open(os.path.join(out_dir, MANIFEST_FILENAME), "w") as f_out:
+    json.dump(manifest, f_out, indent=2)
+
+
+
+
+class ExportedDataset(object):
+  """Reads the samples of exported shards by index. The shard arrays are
+  memory-mapped, so samples are read without decoding, and only the pages of
+  the samples read are loaded."""
+
+
+  def __init__(self, out_dir):
+    with open(os.path.join(out_dir, MANIFEST_FILENAME), "r") as f_in:
+      self.manifest = json.load(f_in)
+
+    self._shards = [shard for shard in self.manifest["shards"] if shard["num_samples"] > 0]
+    self._arrays = [[np.load(os.path.join(out_dir, shard["files"][name]), mmap_mode="r")
+                     for name in SHARD_ARRAYS] for shard in self._shards]
+    self._session_ids = [np.load(os.path.join(out_dir, shard["files"][SESSION_IDS_ARRAY]),
+                                 mmap_mode="r") for shard in self._shards]
+    self._ends = list(np.cumsum([shard["num_samples"] for shard in self._shards]))
+
+
+
+  def __len__(self):
+    return int(self._ends[-1]) if self._ends else 0
+
+
+
+  def _find_sample(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError("Sample index out of range: %d" % i)
+
+    shard = bisect.bisect_right(self._ends, i)
+    return shard, i - (self._ends[shard - 1] if shard > 0 else 0)
+
+
+
+  def __getitem__(self, i):
+    """Returns a tuple of the period timestamp, feature window, bid window, ask
+    window and label of the sample."""
+
+    shard, row = self._find_sample(i)
+    return tuple(array[row] for array in self._arrays[shard])
+
+
+
+  def get_session(self, i):
+    """Returns a tuple of the session timestamp and symbol pair of the
+    sample."""
+
+    shard, row = self._find_sample(i)
+    timestamp, pair = self._shards[shard]["sessions"][self._session_ids[shard][row]]
+    return timestamp, pair
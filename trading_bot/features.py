@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the registry of stream features and the indicators they are computed
+from.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import numpy as np
+
+from collections import namedtuple, OrderedDict
+
+from trading_bot.window import SlotRollingMax
+
+
+
+_EPSILON = float(1e-6)
+
+# Periods and indicators are float64, the precision of Python floats, so that
+# single slots are updated with Python floats to the same values as arrays.
+STATE_DTYPE = "float64"
+
+
+
+# Parameters for technical indicator signals. Indicator state is kept in
+# arrays with a column for each of the short, medium and long horizons.
+_DAYS_SHORT = 9
+_DAYS_MED = 14
+_DAYS_LONG = 26
+HORIZON_DAYS = [_DAYS_SHORT, _DAYS_MED, _DAYS_LONG]
+_HORIZON_NAMES = ["short", "med", "long"]
+
+_EMA_ALPHAS = np.array([2. / (days + 1) for days in HORIZON_DAYS], dtype=STATE_DTYPE)
+
+
+
+# Columns of the buffered trading period records.
+PERIOD_PRICE = 0
+PERIOD_QUANTITY = 1
+PERIOD_LOW = 2
+PERIOD_HIGH = 3
+PERIOD_UP_AVG = 4
+PERIOD_DOWN_AVG = 5
+PERIOD_POS_DIR = 6
+PERIOD_NEG_DIR = 7
+PERIOD_TR = 8
+NUM_PERIOD_COLS = 9
+
+
+
+
+Indicator = namedtuple("Indicator", ["name", "inputs", "state_shape", "window",
+                                     "update_fn", "state_fn", "slot_fn"])
+
+Feature = namedtuple("Feature", ["name", "inputs", "compute_fn", "slot_fn"])
+
+
+_INDICATORS = OrderedDict()
+_FEATURES = OrderedDict()
+
+
+
+
+def register_indicator(name, inputs, state_shape, window, update_fn, state_fn=None,
+                       slot_fn=None):
+  """Registers an indicator that is updated on each period close. The inputs
+  are the names of previously registered indicators it reads. The state shape
+  is the shape of the state array kept per slot, or `None` if it has no state
+  array. The window is the number of latest buffered periods it reads.
+
+  `update_fn` is called with an array of the state of each slot being updated,
+  or `None`, and the period context dictionary. It returns a tuple of the new
+  state array, or `None`, and the value of the indicator, which is added to the
+  context under its name. Indicators with state that is not an array of rows
+  instead give a `state_fn` that creates a state object with a
+  `resize(num_slots)` method, which `update_fn` is called with and updates.
+
+  The context contains the "slots" being updated, the latest "periods" records
+  of the slots, the "period_buffers" window, the "avg_spreads" and "qty_spreads"
+  of the slots, and the values of inputs.
+
+  `slot_fn` optionally updates a single slot the same way with Python floats,
+  which cost a fraction of array operations on one row. It is called like
+  `update_fn`, with the state row of the slot as a list instead of an array of
+  rows, and a context of the "slot", the "period" record as a list, its
+  "avg_spread" and "qty_spread", and the values of inputs computed by their
+  `slot_fn`."""
+
+  for input_name in inputs:
+    if input_name not in _INDICATORS:
+      raise ValueError("Unknown indicator input: %s" % input_name)
+  _INDICATORS[name] = Indicator(name, list(inputs), state_shape, window, update_fn,
+                                state_fn, slot_fn)
+
+
+
+def register_feature(name, inputs, compute_fn, slot_fn=None):
+  """Registers a feature column computed from the named indicators.
+  `compute_fn` is called with the period context dictionary and returns an
+  array of the feature value of each slot being updated. `slot_fn` optionally
+  returns the feature value of a single slot from a single slot context."""
+
+  for input_name in inputs:
+    if input_name not in _INDICATORS:
+      raise ValueError("Unknown feature input: %s" % input_name)
+  _FEATURES[name] = Feature(name, list(inputs), compute_fn, slot_fn)
+
+
+
+def get_features(feature_names):
+  """Returns the list of registered features with the given names."""
+
+  try:
+    return [_FEATURES[name] for name in feature_names]
+  except KeyError as e:
+    raise ValueError("Unknown feature: %s" % e.args[0])
+
+
+
+def get_indicators(feature_names):
+  """Returns the list of indicators that the named features depend on, in
+  registration order, so that each indicator comes after its inputs."""
+
+  required = set()
+  pending = [input_name for feature in get_features(feature_names)
+             for input_name in feature.inputs]
+  while pending:
+    name = pending.pop()
+    if name not in required:
+      required.add(name)
+      pending.extend(_INDICATORS[name].inputs)
+
+  return [indicator for name, indicator in _INDICATORS.items() if name in required]
+
+
+
+
+def _ema(emas, values):
+  return emas + _EMA_ALPHAS * (values - emas)
+
+_EMA_SLOT_ALPHAS = _EMA_ALPHAS.tolist()
+
+def _ema_slot(emas, value):
+  return [ema + alpha * (value - ema) for ema, alpha in zip(emas, _EMA_SLOT_ALPHAS)]
+
+
+
+def _update_price_emas(emas, context):
+  emas = _ema(emas, context["periods"][:, PERIOD_PRICE, None])
+  return emas, emas
+
+def _update_price_emas_slot(emas, context):
+  emas = _ema_slot(emas, context["period"][PERIOD_PRICE])
+  return emas, emas
+
+register_indicator("price_emas", [], (3,), 1, _update_price_emas,
+                   slot_fn=_update_price_emas_slot)
+
+
+
+def _update_gain_emas(emas, context):
+  emas = _ema(emas, context["periods"][:, PERIOD_UP_AVG:PERIOD_DOWN_AVG + 1, None])
+  return emas, emas
+
+def _update_gain_emas_slot(emas, context):
+  period = context["period"]
+  emas = [_ema_slot(emas[0], period[PERIOD_UP_AVG]),
+          _ema_slot(emas[1], period[PERIOD_DOWN_AVG])]
+  return emas, emas
+
+register_indicator("gain_emas", [], (2, 3), 1, _update_gain_emas,
+                   slot_fn=_update_gain_emas_slot)
+
+
+
+def _update_dir_emas(emas, context):
+  # Directional movements are followed by the true range in period records.
+  emas = _ema(emas, context["periods"][:, PERIOD_POS_DIR:PERIOD_TR + 1, None])
+  return emas, emas
+
+def _update_dir_emas_slot(emas, context):
+  period = context["period"]
+  emas = [_ema_slot(emas[0], period[PERIOD_POS_DIR]),
+          _ema_slot(emas[1], period[PERIOD_NEG_DIR]),
+          _ema_slot(emas[2], period[PERIOD_TR])]
+  return emas, emas
+
+register_indicator("dir_emas", [], (3, 3), 1, _update_dir_emas,
+                   slot_fn=_update_dir_emas_slot)
+
+
+
+def _update_adx_emas(adx_emas, context):
+  dir_emas = context["dir_emas"]
+  dis = 100. * dir_emas[:, :2] / (dir_emas[:, 2, None] + _EPSILON)
+  cur_adxs = np.abs(dis[:, 0] - dis[:, 1]) / (dis[:, 0] + dis[:, 1] + _EPSILON)
+
+  adx_emas = _ema(adx_emas, cur_adxs)
+  return adx_emas, adx_emas
+
+def _update_adx_emas_slot(adx_emas, context):
+  cur_adxs = []
+  for pos_dir, neg_dir, tr in zip(*context["dir_emas"]):
+    pos_di = 100. * pos_dir / (tr + _EPSILON)
+    neg_di = 100. * neg_dir / (tr + _EPSILON)
+    cur_adxs.append(abs(pos_di - neg_di) / (pos_di + neg_di + _EPSILON))
+
+  adx_emas = [ema + alpha * (cur_adx - ema)
+              for ema, alpha, cur_adx in zip(adx_emas, _EMA_SLOT_ALPHAS, cur_adxs)]
+  return adx_emas, adx_emas
+
+register_indicator("adx_emas", ["dir_emas"], (3,), 1, _update_adx_emas,
+                   slot_fn=_update_adx_emas_slot)
+
+
+
+class _ExtremaState(object):
+  """Rolling maximums of the highs and negated lows over each horizon, so that
+  the lowest lows are negated rolling maximums."""
+
+  def __init__(self):
+    self.rolling_maxes = [SlotRollingMax(days, (2,), STATE_DTYPE) for days in HORIZON_DAYS]
+
+  def resize(self, num_slots):
+    for rolling_max in self.rolling_maxes:
+      rolling_max.resize(num_slots)
+
+
+_HIGH_LOW_SIGNS = np.array([1., -1.], dtype=STATE_DTYPE)
+
+def _update_extrema(state, context):
+  values = context["periods"][:, [PERIOD_HIGH, PERIOD_LOW]] * _HIGH_LOW_SIGNS
+  maxes = np.stack([rolling_max.append(context["slots"], values)
+                    for rolling_max in state.rolling_maxes], axis=2)
+  return None, (maxes[:, 0], -maxes[:, 1])
+
+def _update_extrema_slot(state, context):
+  period = context["period"]
+  values = (period[PERIOD_HIGH], -period[PERIOD_LOW])
+  maxes = [rolling_max.append_slot(context["slot"], values).tolist()
+           for rolling_max in state.rolling_maxes]
+  return None, ([high for high, _ in maxes], [-low for _, low in maxes])
+
+register_indicator("extrema", [], None, 1, _update_extrema, _ExtremaState,
+                   _update_extrema_slot)
+
+
+
+# Features of each horizon are computed together, as columns of indicators.
+
+def _update_percent_ranges(_, context):
+  highest_highs, lowest_lows = context["extrema"]
+  return None, ((highest_highs - context["periods"][:, PERIOD_PRICE, None])
+                / (highest_highs - lowest_lows + _EPSILON) * -100.)
+
+def _update_percent_ranges_slot(_, context):
+  price = context["period"][PERIOD_PRICE]
+  return None, [(highest_high - price) / (highest_high - lowest_low + _EPSILON) * -100.
+                for highest_high, lowest_low in zip(*context["extrema"])]
+
+register_indicator("percent_ranges", ["extrema"], None, 1, _update_percent_ranges,
+                   slot_fn=_update_percent_ranges_slot)
+
+
+
+def _update_rsis(_, context):
+  gain_emas = context["gain_emas"]
+  return None, 100. - 100. / (1 + gain_emas[:, 0] / (gain_emas[:, 1] + _EPSILON))
+
+def _update_rsis_slot(_, context):
+  return None, [100. - 100. / (1 + up_avg / (down_avg + _EPSILON))
+                for up_avg, down_avg in zip(*context["gain_emas"])]
+
+register_indicator("rsis", ["gain_emas"], None, 1, _update_rsis,
+                   slot_fn=_update_rsis_slot)
+
+
+
+
+register_feature("price", [], lambda context: context["periods"][:, PERIOD_PRICE],
+                 lambda context: context["period"][PERIOD_PRICE])
+register_feature("quantity", [], lambda context: context["periods"][:, PERIOD_QUANTITY],
+                 lambda context: context["period"][PERIOD_QUANTITY])
+register_feature("orderbook_avg_spread", [], lambda context: context["avg_spreads"],
+                 lambda context: context["avg_spread"])
+register_feature("orderbook_qty_spread", [], lambda context: context["qty_spreads"],
+                 lambda context: context["qty_spread"])
+
+
+def _column_fns(name, i):
+  return (lambda context: context[name][:, i]), (lambda context: context[name][i])
+
+def _adx_fns(i):
+  return ((lambda context: context["adx_emas"][:, i] * 100.),
+          (lambda context: context["adx_emas"][i] * 100.))
+
+def _macd_fns(i, j):
+  return ((lambda context: context["price_emas"][:, i] - context["price_emas"][:, j]),
+          (lambda context: context["price_emas"][i] - context["price_emas"][j]))
+
+
+# Williams %R
+for i, horizon_name in enumerate(_HORIZON_NAMES):
+  register_feature("percent_range_%s" % horizon_name, ["percent_ranges"],
+                   *_column_fns("percent_ranges", i))
+
+for i, horizon_name in enumerate(_HORIZON_NAMES):
+  register_feature("rsi_%s" % horizon_name, ["rsis"], *_column_fns("rsis", i))
+
+for i, horizon_name in enumerate(_HORIZON_NAMES):
+  register_feature("adx_%s" % horizon_name, ["adx_emas"], *_adx_fns(i))
+
+for i, j in [(0, 1), (0, 2), (1, 2)]:
+  register_feature("macd_%s_%s" % (_HORIZON_NAMES[i], _HORIZON_NAMES[j]), ["price_emas"],
+                   *_macd_fns(i, j))
+
+
+
+
+# Features computed unless a model requests others, in feature window order.
+DEFAULT_FEATURE_NAMES = ["price", "quantity", "orderbook_avg_spread", "orderbook_qty_spread",
+                         "percent_range_short", "percent_range_med", "percent_range_long",
+                         "rsi_short", "rsi_med", "rsi_long", "adx_short", "adx_med", "adx_long",
+                         "macd_short_med", "macd_short_long", "macd_med_long"]
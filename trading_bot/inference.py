@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Defines a pool of processes for running prediction models outside of the
+analysis loop.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+
+import multiprocessing
+import numpy as np
+import zlib
+
+from time import time
+
+from trading_bot.models import ModelRegistry
+from trading_bot.prediction import TradePredictionModel
+
+
+
+_FLOAT_DTYPE = "float32"
+
+# Type codes and dtypes of the shared arrays of timestamps, feature windows,
+# bid windows, ask windows, buy probabilities and sell probabilities.
+_ARRAY_TYPES = [("q", "int64"), ("f", _FLOAT_DTYPE), ("f", _FLOAT_DTYPE),
+                ("f", _FLOAT_DTYPE), ("f", _FLOAT_DTYPE), ("f", _FLOAT_DTYPE)]
+
+
+
+
+def _array_views(raw_arrays, shapes):
+  return [np.frombuffer(raw_array, dtype=dtype).reshape(shape)
+          for raw_array, (_, dtype), shape in zip(raw_arrays, _ARRAY_TYPES, shapes)]
+
+
+
+def _run_worker(worker, task_queue, result_queue, raw_arrays, shapes, models_dir,
+                check_interval):
+  """Loads models of the symbol pairs assigned to the worker and predicts the
+  rows of the shared arrays given by each task. New model versions are loaded
+  in the background and swapped in between batches. Rows of pairs whose models
+  fail to load are not predicted, and are reported with the worker's count of
+  load errors."""
+
+  timestamps, feats_windows, bid_windows, ask_windows, buy_probs, sell_probs = (
+      _array_views(raw_arrays, shapes))
+  registry = ModelRegistry(models_dir, check_interval)
+
+  while True:
+    task = task_queue.get()
+    if task is None:
+      break
+
+    if task[0] == "unload":
+      registry.unload(task[1])
+      continue
+    if task[0] == "swap":
+      registry.swap()
+      continue
+
+    _, batch_id, rows, pairs = task
+    batch_models = [registry.load(pair) for pair in pairs]
+    failed_rows = [row for row, model in zip(rows, batch_models) if model is None]
+    if failed_rows:
+      rows = [row for row, model in zip(rows, batch_models) if model is not None]
+      batch_models = [model for model in batch_models if model is not None]
+
+    if rows:
+      buy_probs[rows], sell_probs[rows] = TradePredictionModel.predict_pairs(
+          batch_models, timestamps[rows], feats_windows[rows], bid_windows[rows],
+          ask_windows[rows])
+    result_queue.put((worker, batch_id, failed_rows, registry.num_load_errors))
+
+  registry.close()
+
+
+
+
+class InferencePool(object):
+  """Pool of worker processes that run the prediction models of symbol pairs.
+  The stacked windows of a batch of pairs are written to arrays in shared
+  memory with room for `capacity` pairs, and each worker predicts the rows of
+  the pairs assigned to it by a stable hash, writing the probabilities back to
+  shared memory. The workers are started with the first batch, since the
+  array shapes are taken from its windows. Each worker loads the models of its
+  pairs from `models_dir` with a `ModelRegistry`, which checks for new
+  versions every `check_interval` seconds.
+
+  Only one batch is in flight at a time, since its rows are read by the
+  workers until they finish. A batch that is not finished by the deadline
+  stays in flight, and its results are discarded when it finishes. Models that
+  fail to load are counted in `num_load_errors`, and their pairs are not
+  predicted."""
+
+
+  def __init__(self, num_workers, capacity, models_dir="", check_interval=0):
+    self._num_workers = num_workers
+    self._capacity = capacity
+    self._models_dir = models_dir
+    self._check_interval = check_interval
+    self._processes = []
+    self._task_queues = []
+    self._result_queue = None
+    self._arrays = None
+    self._batch_id = 0
+    self._num_pending = 0
+    self._failed_rows = []
+    self._worker_load_errors = [0] * num_workers
+    self.num_batches = 0
+
+
+
+  def _start(self, window_shapes):
+    shapes = ([(self._capacity,)] + [(self._capacity,) + tuple(shape) for shape in window_shapes]
+              + [(self._capacity, 2), (self._capacity, 2)])
+    raw_arrays = [multiprocessing.RawArray(typecode, int(np.prod(shape)))
+                  for (typecode, _), shape in zip(_ARRAY_TYPES, shapes)]
+    self._arrays = _array_views(raw_arrays, shapes)
+
+    self._result_queue = multiprocessing.Queue()
+    for worker in range(self._num_workers):
+      task_queue = multiprocessing.Queue()
+      process = multiprocessing.Process(target=_run_worker,
+                                        args=(worker, task_queue, self._result_queue,
+                                              raw_arrays,
+                                              shapes, self._models_dir,
+                                              self._check_interval))
+      process.daemon = True
+      process.start()
+      self._task_queues.append(task_queue)
+      self._processes.append(process)
+
+
+
+  def close(self):
+    """Stops the worker processes."""
+
+    for task_queue in self._task_queues:
+      task_queue.put(None)
+    for process in self._processes:
+      process.join()
+    self._processes = []
+    self._task_queues = []
+
+
+
+  @property
+  def capacity(self):
+    return self._capacity
+
+
+  @property
+  def num_load_errors(self):
+    """Number of models that failed to load in the workers, as of their latest
+    results."""
+    return sum(self._worker_load_errors)
+
+
+  @property
+  def in_flight(self):
+    """Whether a submitted batch is not finished yet."""
+    return self._num_pending > 0
+
+
+
+  def _worker(self, pair):
+    return (zlib.crc32(pair.encode("utf-8")) & 0xffffffff) % self._num_workers
+
+
+
+  def unload(self, pair):
+    """Unloads the model of the symbol pair from its worker."""
+
+    if self._task_queues:
+      self._task_queues[self._worker(pair)].put(("unload", pair))
+
+
+
+  def swap_models(self):
+    """Has the workers swap in the new model versions they loaded, before any
+    batch submitted after this call."""
+
+    for task_queue in self._task_queues:
+      task_queue.put(("swap",))
+
+
+
+  def _poll(self, timeout):
+    """Waits up to `timeout` seconds for the workers of the batch in flight to
+    finish, and returns whether they did."""
+
+    deadline = time() + timeout
+    while self._num_pending > 0:
+      try:
+        worker, batch_id, failed_rows, num_load_errors = self._result_queue.get(
+            timeout=max(0., deadline - time()))
+      except queue.Empty:
+        return False
+      self._worker_load_errors[worker] = num_load_errors
+      if batch_id == self._batch_id:
+        self._failed_rows.extend(failed_rows)
+        self._num_pending -= 1
+    return True
+
+
+
+  def predict(self, pairs, timestamps, feats_windows, bid_windows, ask_windows, timeout):
+    """Predicts the stacked windows of up to `capacity` symbol pairs with the
+    workers and returns a tuple of (N, 2) arrays of buy and sell probability
+    distributions and a boolean array of whether each pair was predicted, which
+    it is not if its model failed to load. Returns `None` if the batch in
+    flight is still not finished, or if the workers do not finish within
+    `timeout` seconds."""
+
+    if not self._poll(0.):
+      return None
+
+    if self._arrays is None:
+      self._start([feats_windows.shape[1:], bid_windows.shape[1:], ask_windows.shape[1:]])
+
+    num_pairs = len(pairs)
+    for array, values in zip(self._arrays, [timestamps, feats_windows, bid_windows,
+                                            ask_windows]):
+      array[:num_pairs] = values
+
+    worker_rows = [[] for _ in range(self._num_workers)]
+    for row, pair in enumerate(pairs):
+      worker_rows[self._worker(pair)].append(row)
+
+    self._batch_id += 1
+    self._failed_rows = []
+    self.num_batches += 1
+    for worker, rows in enumerate(worker_rows):
+      if rows:
+        self._task_queues[worker].put(("predict", self._batch_id, rows,
+                                       [pairs[row] for row in rows]))
+        self._num_pending += 1
+
+    if not self._poll(timeout):
+      return None
+    is_predicted = np.ones((num_pairs,), dtype=bool)
+    is_predicted[self._failed_rows] = False
+    return (self._arrays[4][:num_pairs].copy(), self._arrays[5][:num_pairs].copy(),
+            is_predicted)
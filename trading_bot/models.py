@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Defines a registry that loads the prediction model artifacts of symbol pairs
+in the background and swaps in new versions.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+
+import numpy as np
+import os
+import sys
+import threading
+import traceback
+
+from trading_bot.prediction import TradePredictionModel
+
+
+
+
+def get_latest_model_version(models_dir, pair):
+  """Returns the name of the latest version directory of the symbol pair's
+  model artifacts, or `None` if it has none. Versions are directories in
+  `<models_dir>/<pair>` and the latest sorts last by name."""
+
+  if not models_dir:
+    return None
+  try:
+    versions = [name for name in os.listdir(os.path.join(models_dir, pair))
+                if os.path.isdir(os.path.join(models_dir, pair, name))]
+  except OSError:
+    return None
+  return max(versions) if versions else None
+
+
+
+def load_model_weights(model_dir):
+  """Returns a dictionary of the weight arrays of the `.npy` files in the model
+  directory by file name. Arrays are memory-mapped read-only, so processes
+  that load the same artifacts share their pages."""
+
+  return {name[:-len(".npy")]: np.load(os.path.join(model_dir, name), mmap_mode="r")
+          for name in sorted(os.listdir(model_dir)) if name.endswith(".npy")}
+
+
+
+def load_model(models_dir, pair, version):
+  """Returns a `TradePredictionModel` of the symbol pair with the weights of
+  the model version, or without weights if the version is `None`."""
+
+  if version is None:
+    return TradePredictionModel(pair)
+  return TradePredictionModel(pair, load_model_weights(os.path.join(models_dir, pair,
+                                                                    version)), version)
+
+
+
+
+class ModelRegistry(object):
+  """Keeps the current prediction model of each requested symbol pair. Models
+  are loaded by a background thread, which also checks for new versions of the
+  loaded models every `check_interval` seconds if it is greater than 0. Loaded
+  models only replace the current ones when `swap` is called, so a caller
+  that swaps between trading periods never mixes model versions within a
+  period. Models that fail to load are counted, their tracebacks are written to
+  stderr, and the current model of the pair is kept. A version that failed is
+  not loaded again."""
+
+
+  def __init__(self, models_dir="", check_interval=0):
+    self._models_dir = models_dir
+    self._check_interval = check_interval
+    self._models = {}
+    self._requested = set()
+    self._requests = queue.Queue()
+    self._loaded = queue.Queue()
+    self._failed_versions = {}
+    self._thread = None
+    self.num_load_errors = 0
+
+
+
+  def _start(self):
+    self._thread = threading.Thread(target=self._run_loader)
+    self._thread.daemon = True
+    self._thread.start()
+
+
+
+  def close(self):
+    """Stops the loader thread and unloads every model."""
+
+    if self._thread is not None:
+      self._requests.put(None)
+      self._thread.join()
+      self._thread = None
+    for model in self._models.values():
+      model.unload()
+    self._models.clear()
+    self._requested.clear()
+
+
+
+  def _run_loader(self):
+    # Versions of the models loaded or being swapped in, by pair. Only used by
+    # the loader thread.
+    versions = {}
+    timeout = self._check_interval if self._check_interval > 0 else None
+
+    while True:
+      try:
+        request = self._requests.get(timeout=timeout)
+      except queue.Empty:
+        request = ("check",)
+      if request is None:
+        break
+
+      if request[0] == "unload":
+        versions.pop(request[1], None)
+        continue
+      if request[0] == "loaded":
+        versions[request[1]] = request[2]
+        continue
+
+      pairs = list(versions) if request[0] == "check" else [request[1]]
+      for pair in pairs:
+        version = get_latest_model_version(self._models_dir, pair)
+        if pair in versions and versions[pair] == version:
+          continue
+        versions[pair] = version
+        try:
+          self._loaded.put((pair, load_model(self._models_dir, pair, version)))
+        except Exception:
+          self._loaded.put((pair, (version, traceback.format_exc())))
+
+
+
+  def _add_load_error(self, pair, version, error):
+    self.num_load_errors += 1
+    self._failed_versions[pair] = version
+    sys.stderr.write("Failed to load model %s version %s:\n%s" % (pair, version, error))
+
+
+
+  def get(self, pair):
+    """Returns the current model of the symbol pair, or `None` if it has not
+    been swapped in yet."""
+    return self._models.get(pair)
+
+
+
+  def request(self, pair):
+    """Requests that the latest model of the symbol pair is loaded in the
+    background, to be swapped in by a later `swap`."""
+
+    if pair not in self._requested:
+      self._requested.add(pair)
+      if self._thread is None:
+        self._start()
+      self._requests.put(("load", pair))
+
+
+
+  def load(self, pair):
+    """Returns the current model of the symbol pair, loading the latest version
+    and making it current first if it has none. Returns `None` if the latest
+    version fails to load."""
+
+    model = self._models.get(pair)
+    if model is None:
+      version = get_latest_model_version(self._models_dir, pair)
+      if pair in self._failed_versions and self._failed_versions[pair] == version:
+        return None
+      try:
+        model = load_model(self._models_dir, pair, version)
+      except Exception:
+        self._add_load_error(pair, version, traceback.format_exc())
+        return None
+      self._models[pair] = model
+      self._requested.add(pair)
+      if self._check_interval > 0:
+        if self._thread is None:
+          self._start()
+        self._requests.put(("loaded", pair, version))
+    return model
+
+
+
+  def unload(self, pair):
+    """Unloads the model of the symbol pair."""
+
+    self._requested.discard(pair)
+    model = self._models.pop(pair, None)
+    if model is not None:
+      model.unload()
+    if self._thread is not None:
+      self._requests.put(("unload", pair))
+
+
+
+  def swap(self):
+    """Replaces the current models with the models loaded since the last swap,
+    and returns a list of the symbol pairs whose models were replaced."""
+
+    swapped = []
+    while True:
+      try:
+        pair, model = self._loaded.get_nowait()
+      except queue.Empty:
+        break
+
+      if not isinstance(model, TradePredictionModel):
+        self._add_load_error(pair, *model)
+        continue
+      if pair not in self._requested:
+        model.unload()
+        continue
+
+      old_model = self._models.get(pair)
+      self._models[pair] = model
+      if old_model is not None:
+        old_model.unload()
+      swapped.append(pair)
+
+    return swapped
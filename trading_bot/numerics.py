@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Defines objects for converting and rounding the prices and quantities of
+trading pairs in integer units.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+from trading_bot.parsing import int_units_to_num_str, num_str_to_int_units
+
+
+
+# Number of decimal places of prices and quantities of pairs without exchange
+# info.
+_DEFAULT_PRECISION = 8
+
+
+
+
+def _num_str_to_int_units(num_str, precision):
+  # The exchange sends numbers with exactly the asset precision's number of
+  # decimal places, which only need the point removed.
+  if precision > 0 and len(num_str) > precision and num_str[-precision-1] == ".":
+    return int(num_str.replace(".", ""))
+  return num_str_to_int_units(num_str, precision)
+
+
+
+def _round_units(units, step, round_up):
+  if step <= 1:
+    return units
+  if round_up:
+    return -(-units // step) * step
+  return units // step * step
+
+
+
+
+class PairNumerics(object):
+  """Integer unit conversions and rounding helpers for the prices and
+  quantities of a symbol pair, built once from its `PairInfo`. Prices are in
+  units of the quote precision and quantities in units of the base precision,
+  and the tick and step sizes and order limits are in the same units. Without
+  a pair info, both precisions are 8 decimal places and there are no limits."""
+
+
+  def __init__(self, pair_info=None):
+    if pair_info is None:
+      self.price_precision = _DEFAULT_PRECISION
+      self.quantity_precision = _DEFAULT_PRECISION
+      self.tick_size = 1
+      self.step_size = 1
+      self.min_price = None
+      self.max_price = None
+      self.min_quantity = None
+      self.max_quantity = None
+      self.min_notional = None
+    else:
+      self.price_precision = pair_info.quote_precision
+      self.quantity_precision = pair_info.base_precision
+      self.tick_size = pair_info.quote_step_size
+      self.step_size = pair_info.base_step_size
+      self.min_price = pair_info.min_quote_price
+      self.max_price = pair_info.max_quote_price
+      self.min_quantity = pair_info.min_base_qty
+      self.max_quantity = pair_info.max_base_qty
+      self.min_notional = pair_info.min_notational_product
+
+    self.price_divisor = 10. ** self.price_precision
+    self.quantity_divisor = 10. ** self.quantity_precision
+
+
+
+  def price_to_int(self, price_str):
+    """Converts a price string to integer units."""
+    return _num_str_to_int_units(price_str, self.price_precision)
+
+  def price_to_str(self, price):
+    """Converts a price in integer units to a string."""
+    return int_units_to_num_str(price, self.price_precision)
+
+  def price_to_float(self, price):
+    """Converts a price in integer units to a float."""
+    return price / self.price_divisor
+
+
+  def quantity_to_int(self, quantity_str):
+    """Converts a quantity string to integer units."""
+    return _num_str_to_int_units(quantity_str, self.quantity_precision)
+
+  def quantity_to_str(self, quantity):
+    """Converts a quantity in integer units to a string."""
+    return int_units_to_num_str(quantity, self.quantity_precision)
+
+  def quantity_to_float(self, quantity):
+    """Converts a quantity in integer units to a float."""
+    return quantity / self.quantity_divisor
+
+
+
+  def round_price(self, price, round_up=False):
+    """Rounds a price in integer units down, or up, to a multiple of the tick
+    size."""
+    return _round_units(price, self.tick_size, round_up)
+
+  def round_quantity(self, quantity, round_up=False):
+    """Rounds a quantity in integer units down, or up, to a multiple of the step
+    size."""
+    return _round_units(quantity, self.step_size, round_up)
+
+
+
+  def is_valid_order(self, price, quantity):
+    """Returns whether an order of the price and quantity in integer units is on
+    the tick and step sizes and within the price, quantity and notional limits
+    of the pair. Limits and sizes of 0 are not enforced, as on the exchange."""
+
+    if ((self.tick_size and price % self.tick_size != 0)
+        or (self.step_size and quantity % self.step_size != 0)):
+      return False
+    if (price < (self.min_price or 0) or quantity < (self.min_quantity or 0)
+        or price * quantity < (self.min_notional or 0)):
+      return False
+    if ((self.max_price and price > self.max_price)
+        or (self.max_quantity and quantity > self.max_quantity)):
+      return False
+    return True
+
+
+
+
+class PairNumericsCache(object):
+  """Builds and keeps the `PairNumerics` of each symbol pair from the pair
+  infos in the app state, so each process reads the exchange info once per
+  pair."""
+
+
+  def __init__(self, app_state):
+    self._app_state = app_state
+    self._numerics = {}
+
+
+  def clear(self):
+    self._numerics.clear()
+
+
+  def get(self, pair):
+    """Returns the `PairNumerics` of the symbol pair."""
+
+    try:
+      return self._numerics[pair]
+    except KeyError:
+      numerics = PairNumerics(self._app_state._get_pair_info(pair))
+      self._numerics[pair] = numerics
+      return numerics
@@ -11,7 +11,7 @@ from __future__ import print_function
 import json
 import numpy as np
 
-from collections import namedtuple
+from trading_bot.records import PairInfo
 
 
 _FLOAT_DTYPE = "float32"
@@ -56,97 +56,143 @@ def int_units_to_num_str(int_val, precision):
 
 
 
-def parse_depth_state(num_depth_bins, cur_state):
-  """Parses the depth state dictionary and constructs Numpy arrays for the
-  current bids and asks, reduced to the specified number of depth bins."""
-  
-  all_asks = []
-  ask_weights = []
-  total_ask_qty = 0.
-  for key in cur_state["asks"]:
-    all_asks.append(float(key))
-    ask_weights.append(cur_state["asks"][key])
-    total_ask_qty += cur_state["asks"][key]
+def _bin_depth_side(prices, weights, num_depth_bins):
+  """Returns the array of normalized weights of one orderbook side, binned
+  over the weighted mean price plus or minus three weighted standard
+  deviations, along with the weighted mean price."""
+
+  if weights.shape[0] > 0:
+    avg_price = np.average(prices, weights=weights)
+    std_price = np.sqrt(np.average((prices-avg_price)**2, weights=weights))
+  else:
+    avg_price = 0.
+    std_price = 0.
+
+  bin_edges = np.linspace(avg_price - 3*std_price, avg_price + 3*std_price,
+                          num=num_depth_bins-1)
+
+  bin_arr = np.bincount(np.digitize(prices, bin_edges), weights=weights,
+                        minlength=num_depth_bins).astype(_FLOAT_DTYPE)
+  bin_arr /= (np.max(bin_arr) + _EPSILON)
+
+  return bin_arr, avg_price
+
 
-  all_bids = []
-  bid_weights = []
-  total_bid_qty = 0.
-  for key in cur_state["bids"]:
-    all_bids.append(float(key))
-    bid_weights.append(cur_state["bids"][key])
-    total_bid_qty += cur_state["bids"][key]
 
 
 
-  qty_spread = total_ask_qty - total_bid_qty
+def parse_depth_state(num_depth_bins, cur_state):
+  """Parses the `OrderBookState` and constructs Numpy arrays for the
+  current bids and asks, reduced to the specified number of depth bins."""
+  
+  ask_levels = np.asarray(cur_state.asks, dtype="float64").reshape(-1, 2)
+  bid_levels = np.asarray(cur_state.bids, dtype="float64").reshape(-1, 2)
 
+  # Skip zero-padded levels of fixed-size states.
+  ask_levels = ask_levels[ask_levels[:, 1] > 0]
+  bid_levels = bid_levels[bid_levels[:, 1] > 0]
 
-  all_asks = np.array(all_asks, dtype=_FLOAT_DTYPE)
-  all_bids = np.array(all_bids, dtype=_FLOAT_DTYPE)
+  qty_spread = np.sum(ask_levels[:, 1]) - np.sum(bid_levels[:, 1])
 
-  ask_weights = np.array(ask_weights, dtype=_FLOAT_DTYPE)
+
+  ask_weights = ask_levels[:, 1].astype(_FLOAT_DTYPE)
   if ask_weights.shape[0] > 0:
     ask_weights /= (np.max(ask_weights) + _EPSILON)
-    avg_ask = np.average(all_asks, weights=ask_weights)
-    std_ask = np.sqrt(np.average((all_asks-avg_ask)**2, weights=ask_weights))
-  else:
-    avg_ask = 0.
-    std_ask = 0.
+  ask_arr, avg_ask = _bin_depth_side(ask_levels[:, 0].astype(_FLOAT_DTYPE),
+                                     ask_weights, num_depth_bins)
 
-  bid_weights = np.array(bid_weights, dtype=_FLOAT_DTYPE)
+  bid_weights = bid_levels[:, 1].astype(_FLOAT_DTYPE)
   if bid_weights.shape[0] > 0:
     bid_weights /= (np.max(bid_weights) + _EPSILON)
-    avg_bid = np.average(all_bids, weights=bid_weights)
-    std_bid = np.sqrt(np.average((all_bids-avg_bid)**2, weights=bid_weights))
-  else:
-    avg_bid = 0.
-    std_bid = 0.
+  bid_arr, avg_bid = _bin_depth_side(bid_levels[:, 0].astype(_FLOAT_DTYPE),
+                                     bid_weights, num_depth_bins)
 
+  avg_spread = avg_ask - avg_bid
 
-  min_ask = avg_ask - 3*std_ask
-  max_ask = avg_ask + 3*std_ask
-  min_bid = avg_bid - 3*std_bid
-  max_bid = avg_bid + 3*std_bid
 
-  avg_spread = avg_ask - avg_bid
+  return cur_state.server_timestamp, bid_arr, ask_arr, avg_spread, qty_spread
 
 
-  ask_bin_edges = np.linspace(min_ask, max_ask, num=num_depth_bins-1)
-  bid_bin_edges = np.linspace(min_bid, max_bid, num=num_depth_bins-1)
 
 
-  ask_arr = np.zeros((num_depth_bins,), dtype=_FLOAT_DTYPE)
-  for i in range(all_asks.shape[0]):
-    bin_ind = min(num_depth_bins-1, np.digitize(all_asks[i], ask_bin_edges))
-    ask_arr[bin_ind] += ask_weights[i]
-  ask_arr /= (np.max(ask_arr) + _EPSILON)
 
-  bid_arr = np.zeros((num_depth_bins,), dtype=_FLOAT_DTYPE)
-  for i in range(all_bids.shape[0]):
-    bin_ind = min(num_depth_bins-1, np.digitize(all_bids[i], bid_bin_edges))
-    bid_arr[bin_ind] += bid_weights[i]
-  bid_arr /= (np.max(bid_arr) + _EPSILON)
 
+def _bin_depth_sides(sides, num_depth_bins):
+  """Batch version of `_bin_depth_side` for a sequence of orderbook sides, each
+  an array of (price, quantity) rows with nonzero quantities. Returns an (S, B)
+  array of binned weights and an (S,) array of weighted mean prices.
 
-  return cur_state["server_timestamp"], bid_arr, ask_arr, avg_spread, qty_spread
+  Sides with the same number of levels are binned together, so the sums of each
+  side are computed in the same order as by `_bin_depth_side`. Prices are only
+  a few float32 units apart, so a different order would move bin edges."""
 
+  bin_arr = np.zeros((len(sides), num_depth_bins), dtype=_FLOAT_DTYPE)
+  avg_prices = np.zeros((len(sides),), dtype=_FLOAT_DTYPE)
 
+  num_levels = np.array([side.shape[0] for side in sides], dtype="int64")
 
+  for group_num_levels in np.unique(num_levels):
+    if group_num_levels == 0:
+      continue
 
+    group_inds = np.flatnonzero(num_levels == group_num_levels)
+    levels_arr = np.stack([sides[i] for i in group_inds])
+    num_group_sides = group_inds.shape[0]
 
+    prices = levels_arr[:, :, 0].astype(_FLOAT_DTYPE)
+    weights = levels_arr[:, :, 1].astype(_FLOAT_DTYPE)
+    weights /= (np.max(weights, axis=1, keepdims=True) + _EPSILON)
 
-def parse_trade(period_time, cur_trade, bin_stats_dict):
-  """Parses the trade dictionary and accumulates trade statistics for the
-  next update."""
+    total_weights = np.sum(weights, axis=1)
+    group_avg_prices = np.sum(prices * weights, axis=1) / total_weights
+    group_std_prices = np.sqrt(np.sum((prices - group_avg_prices[:, None])**2 * weights,
+                                      axis=1) / total_weights)
 
-  timestamp = cur_trade["trade_timestamp"]
-  time_bin = int(timestamp / float(period_time)) * period_time
 
-  try:
-    bin_stats_dict[time_bin][0].append(cur_trade["quantity"])
-    bin_stats_dict[time_bin][1].append(cur_trade["price"])
-  except KeyError:
-    bin_stats_dict[time_bin] = ([cur_trade["quantity"]], [cur_trade["price"]])
+    bin_edges = np.linspace(group_avg_prices - 3*group_std_prices,
+                            group_avg_prices + 3*group_std_prices,
+                            num=num_depth_bins-1, axis=1)
+
+    # Same as np.digitize for each side, which counts the edges at or below
+    # each price.
+    bin_inds = np.sum(prices[:, :, None] >= bin_edges[:, None, :], axis=2)
+    bin_inds += np.arange(num_group_sides)[:, None] * num_depth_bins
+
+    group_bin_arr = np.bincount(bin_inds.ravel(), weights=weights.ravel(),
+                                minlength=num_group_sides*num_depth_bins)
+    group_bin_arr = group_bin_arr.reshape(num_group_sides, num_depth_bins).astype(_FLOAT_DTYPE)
+    group_bin_arr /= (np.max(group_bin_arr, axis=1, keepdims=True) + _EPSILON)
+
+    bin_arr[group_inds] = group_bin_arr
+    avg_prices[group_inds] = group_avg_prices
+
+  return bin_arr, avg_prices
+
+
+
+def _get_depth_levels(side):
+  levels = np.asarray(side, dtype="float64").reshape(-1, 2)
+  return levels[levels[:, 1] > 0]
+
+
+
+def parse_depth_states(num_depth_bins, cur_states):
+  """Batch version of `parse_depth_state` for a sequence of `OrderBookState`
+  objects. Returns arrays of the server timestamps, the (S, B) binned bids
+  and asks, and the average and quantity spreads of the S states."""
+
+  ask_sides = [_get_depth_levels(cur_state.asks) for cur_state in cur_states]
+  bid_sides = [_get_depth_levels(cur_state.bids) for cur_state in cur_states]
+
+  qty_spreads = np.array([np.sum(ask_levels[:, 1]) - np.sum(bid_levels[:, 1])
+                          for ask_levels, bid_levels in zip(ask_sides, bid_sides)])
+
+  ask_arr, avg_asks = _bin_depth_sides(ask_sides, num_depth_bins)
+  bid_arr, avg_bids = _bin_depth_sides(bid_sides, num_depth_bins)
+
+  timestamps = np.array([cur_state.server_timestamp for cur_state in cur_states])
+
+  return timestamps, bid_arr, ask_arr, avg_asks - avg_bids, qty_spreads
 
 
 
@@ -155,15 +201,15 @@ def parse_trade(period_time, cur_trade, bin_stats_dict):
 
 def parse_exchange_pair_infos(exchange_info_json_str):
   """Parses the exchange info json string retrieved from the exchange server and
-  returns a dictionary of pair info objects describing trading pair parameters."""
+  returns a dictionary of `PairInfo` records describing trading pair parameters."""
+
+  return get_exchange_pair_infos(json.loads(exchange_info_json_str))
+
 
-  PairInfo = namedtuple("PairInfo", ["base_symbol", "quote_symbol", "base_precision",
-                                     "base_step_size", "min_base_qty", "max_base_qty",
-                                     "quote_precision", "quote_step_size",
-                                     "min_quote_price", "max_quote_price",
-                                     "min_notational_product"])
 
-  exchange_info = json.loads(exchange_info_json_str)
+def get_exchange_pair_infos(exchange_info):
+  """Returns a dictionary of `PairInfo` records describing trading pair
+  parameters from the decoded exchange info."""
 
   pair_infos = {}
 
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Defines an object for aggregating trades into trading periods.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+
+
+# Number of periods that can be open at once, from the oldest period not yet
+# closed.
+_NUM_OPEN_PERIODS = 4
+
+
+
+
+class TradePeriodAggregator(object):
+  """Aggregates the trades of a symbol pair into trading periods of
+  `period_time` milliseconds. The number of trades, volume, volume-weighted
+  price sum, low and high of each open period are kept as running values in a
+  ring of period slots indexed by period number, so adding a trade costs O(1)
+  and memory does not grow with the number of trades in a period.
+
+  Periods are closed in order up to a given time. A trade for a period past the
+  ring evicts the oldest open periods, which are kept until they are closed. A
+  trade for a period that is already closed is counted and dropped."""
+
+
+  def __init__(self, period_time, num_open_periods=_NUM_OPEN_PERIODS):
+    self._period_time = period_time
+    self._num_open_periods = num_open_periods
+    self._periods = [None] * num_open_periods
+    self._num_trades = [0] * num_open_periods
+    self._quantities = [0.] * num_open_periods
+    self._price_sums = [0.] * num_open_periods
+    self._lows = [0.] * num_open_periods
+    self._highs = [0.] * num_open_periods
+    self._first_open_period = None
+    self._evicted_periods = []
+    self.last_avg_price = 0.
+    self.num_late_trades = 0
+
+
+
+  def _get_period(self, period):
+    """Returns a tuple of the timestamp, total quantity, number of trades,
+    average price, low price and high price of the period, or `None` if it has
+    no trades."""
+
+    i = period % self._num_open_periods
+    if self._periods[i] != period:
+      return None
+
+    quantity = self._quantities[i]
+    if quantity > 0:
+      avg_price = self._price_sums[i] / quantity
+    else:
+      avg_price = (self._lows[i] + self._highs[i]) / 2.
+    return (period * self._period_time, quantity, self._num_trades[i], avg_price,
+            self._lows[i], self._highs[i])
+
+
+  def _evict_periods(self, first_open_period):
+    for period in range(self._first_open_period,
+                        min(first_open_period, self._first_open_period + self._num_open_periods)):
+      period_tup = self._get_period(period)
+      if period_tup is not None:
+        self._evicted_periods.append(period_tup)
+        self._periods[period % self._num_open_periods] = None
+    self._first_open_period = first_open_period
+
+
+
+  def add_trade(self, trade):
+    """Adds the `Trade` to the running values of its period."""
+
+    period = int(trade.trade_timestamp // self._period_time)
+
+    if self._first_open_period is None:
+      self._first_open_period = period
+    elif period < self._first_open_period:
+      self.num_late_trades += 1
+      return
+    elif period >= self._first_open_period + self._num_open_periods:
+      self._evict_periods(period - self._num_open_periods + 1)
+
+    price = trade.price
+    quantity = trade.quantity
+    i = period % self._num_open_periods
+    if self._periods[i] != period:
+      self._periods[i] = period
+      self._num_trades[i] = 1
+      self._quantities[i] = quantity
+      self._price_sums[i] = price * quantity
+      self._lows[i] = price
+      self._highs[i] = price
+    else:
+      self._num_trades[i] += 1
+      self._quantities[i] += quantity
+      self._price_sums[i] += price * quantity
+      if price < self._lows[i]:
+        self._lows[i] = price
+      elif price > self._highs[i]:
+        self._highs[i] = price
+
+
+
+  def close_periods(self, timestamp):
+    """Closes the periods starting at or before the timestamp and returns a list
+    of tuples of the timestamp, total quantity, number of trades, average price,
+    low price and high price of each closed period with trades, oldest first."""
+
+    last_period = int(timestamp // self._period_time)
+    if self._first_open_period is None:
+      self._first_open_period = last_period + 1
+      return []
+    if last_period < self._first_open_period:
+      return []
+
+    self._evict_periods(last_period + 1)
+    closed_periods = self._evicted_periods
+    self._evicted_periods = []
+    if closed_periods:
+      self.last_avg_price = closed_periods[-1][3]
+    return closed_periods
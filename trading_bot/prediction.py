@@ -12,6 +12,9 @@ from __future__ import print_function
 
 import numpy as np
 
+from collections import OrderedDict
+
+from trading_bot.features import DEFAULT_FEATURE_NAMES
 
 
 
@@ -23,17 +26,76 @@ _FLOAT_DTYPE = "float32"
 
 class TradePredictionModel(object):
   """Encapsulates a prediction model for determining whether to buy or
-  sell based on features from trading signals."""
+  sell based on features from trading signals. Predictions are made for
+  batches of windows, so that the windows of every symbol pair whose models
+  share parameters are evaluated in a single call."""
+
+  # Names of the stream features the model uses, in the column order of the
+  # feature windows it is given. Only these features are computed.
+  feature_names = DEFAULT_FEATURE_NAMES
 
 
-  def __init__(self, pair):
+  def __init__(self, pair, weights=None, version=None):
+    """Creates the model of the symbol pair from a dictionary of weight arrays
+    by name, which may be memory-mapped, and the name of their version."""
 
-    pass
+    self.pair = pair
+    self.weights = weights
+    self.version = version
 
 
 
   def unload(self):
-    pass
+    self.weights = None
+
+
+
+  @property
+  def batch_key(self):
+    """Key shared by models whose parameters are the same, so that their
+    windows can be predicted in one batch. Models without weights share the
+    default parameters, and models with weights are only batched with models
+    of the same pair and version."""
+
+    if self.weights is None:
+      return None
+    return (self.pair, self.version)
+
+
+
+
+  def predict(self, timestamps, feats_windows, bid_windows, ask_windows):
+    """Returns a tuple of (N, 2) arrays of buy and sell probability
+    distributions for a batch of N stacked windows. State 0 means hold and
+    state 1 means buy or sell."""
+
+    probs = np.zeros((feats_windows.shape[0], 2), dtype=_FLOAT_DTYPE) + .5
+    return probs, probs.copy()
+
+
+
+  @staticmethod
+  def predict_pairs(models, timestamps, feats_windows, bid_windows, ask_windows):
+    """Returns a tuple of (N, 2) arrays of buy and sell probability
+    distributions for the stacked windows of N symbol pairs, each predicted by
+    the model of its pair. The windows of models with the same batch key are
+    predicted in one call."""
+
+    batches = OrderedDict()
+    for i, model in enumerate(models):
+      batches.setdefault(model.batch_key, []).append(i)
+
+    if len(batches) == 1:
+      return models[0].predict(timestamps, feats_windows, bid_windows, ask_windows)
+
+    buy_probs = np.zeros((len(models), 2), dtype=_FLOAT_DTYPE)
+    sell_probs = np.zeros((len(models), 2), dtype=_FLOAT_DTYPE)
+    for inds in batches.values():
+      inds = np.array(inds)
+      buy_probs[inds], sell_probs[inds] = models[inds[0]].predict(
+          timestamps[inds], feats_windows[inds], bid_windows[inds], ask_windows[inds])
+
+    return buy_probs, sell_probs
 
 
 
@@ -42,7 +104,8 @@ class TradePredictionModel(object):
     """Returns a probability distribution over two states: state 0 means
     hold and state 1 means buy."""
 
-    return np.array([.5, .5], dtype=_FLOAT_DTYPE)
+    return self.predict(np.array([timestamp]), feats_window[None], bid_window[None],
+                        ask_window[None])[0][0]
 
 
 
@@ -50,7 +113,8 @@ class TradePredictionModel(object):
     """Returns a probability distribution over two states: state 0 means
     hold and state 1 means sell."""
 
-    return np.array([.5, .5], dtype=_FLOAT_DTYPE)
+    return self.predict(np.array([timestamp]), feats_window[None], bid_window[None],
+                        ask_window[None])[1][0]
 
 
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """
-Defines a class for buffering real time trade stream features.
+Defines a process class for executing runners and methods for arranging runners
+into processes.
 """
 
 from __future__ import absolute_import
@@ -13,18 +14,27 @@ import traceback
 
 from time import sleep
 
+from trading_bot import runners
+
 
 
 class AsyncRunnerProcess(multiprocessing.Process):
   """Implements a multiprocessing Process object that asynchronously executes a
-  `Runner` object specified by the instantiating caller."""
+  `Runner` object specified by the instantiating caller. A list of `Runner`
+  classes, or of tuples of a `Runner` class and its keyword arguments, may be
+  given to run several runners in turn in the same loop, in which case
+  `local_channels` names the channels to keep in-process."""
 
 
-  def __init__(self, app_state, config, runner_cls, **kwargs):
+  def __init__(self, app_state, config, runner_cls, local_channels=None, **kwargs):
     multiprocessing.Process.__init__(self)
 
+    if not isinstance(runner_cls, list):
+      runner_cls = [runner_cls]
+
     self._app_state = app_state
-    self._runner_cls = runner_cls
+    self._runner_classes = list(runner_cls)
+    self._local_channels = list(local_channels or [])
     self._config = config
     self._sleep_time = config["proc_update_res"] / 1000.
 
@@ -34,11 +44,22 @@ class AsyncRunnerProcess(multiprocessing.Process):
     """Enters the main loop for the process."""
 
     try:
-      runner = self._runner_cls(self._app_state, self._config)
-      runner.on_start()
+      self._app_state.localize_channels(self._local_channels)
+
+      group = []
+      for runner_entry in self._runner_classes:
+        if isinstance(runner_entry, tuple):
+          runner_cls, runner_kwargs = runner_entry
+        else:
+          runner_cls, runner_kwargs = runner_entry, {}
+        group.append(runner_cls(self._app_state, self._config, **runner_kwargs))
+
+      for runner in group:
+        runner.on_start()
 
       while True:
-        runner.on_update()
+        for runner in group:
+          runner.on_update()
         if self._sleep_time > 0:
           sleep(self._sleep_time)
 
@@ -48,3 +69,61 @@ class AsyncRunnerProcess(multiprocessing.Process):
       raise
 
 
+
+
+
+
+def create_runner_processes(app_state, config):
+  """Creates a process for each group of runners in the configured topology.
+  The first instance of a sharded runner runs in its configured group and the
+  remaining instances each get their own process. Channels with declared
+  producers and consumers that all belong to one group are kept in-process
+  for that group."""
+
+  groups = []
+  shard_groups = []
+  for group_names in config["topology"]:
+    group = []
+    for name in group_names:
+      runner_cls = getattr(runners, name, None)
+      if runner_cls is None:
+        raise ValueError("Unknown runner in topology: %s" % name)
+
+      if runner_cls.sharded:
+        group.append((runner_cls, {"shard": 0}))
+        for shard in range(1, app_state._num_analysis_workers):
+          shard_groups.append([(runner_cls, {"shard": shard})])
+      else:
+        group.append((runner_cls, {}))
+
+    if len(group) > 1 and not all(runner_cls.fusable for runner_cls, _ in group):
+      raise ValueError("Runner group cannot share a process: %s" % group_names)
+    groups.append(group)
+
+  groups.extend(shard_groups)
+
+
+  # Groups of the declared producers and consumers of each channel. Channels
+  # without a declared producer or consumer, such as the executor channel that
+  # no runner feeds, may be used from other processes, so they are only kept
+  # in-process if both sides are declared and belong to one group.
+  producer_groups = {}
+  consumer_groups = {}
+  for i, group in enumerate(groups):
+    for runner_cls, runner_kwargs in group:
+      for name in runner_cls.input_channels:
+        for channel_name in app_state._channel_names(name, runner_kwargs.get("shard")):
+          consumer_groups.setdefault(channel_name, set()).add(i)
+      for name in runner_cls.output_channels:
+        for channel_name in app_state._channel_names(name):
+          producer_groups.setdefault(channel_name, set()).add(i)
+
+  processes = []
+  for i, group in enumerate(groups):
+    local_channels = [name for name in consumer_groups
+                      if name in producer_groups
+                      and producer_groups[name] | consumer_groups[name] == set([i])]
+    processes.append(AsyncRunnerProcess(app_state, config, group,
+                                        local_channels=local_channels))
+
+  return processes
@@ -10,11 +10,13 @@ from __future__ import print_function
 
 import datetime
 import gzip
-import json
 import os
 
 from time import sleep
 
+from trading_bot.decoding import get_json_decoder
+from trading_bot.records import OrderBookState, Trade
+
 
 
 _SLEEP_TIME = 0.0000001
@@ -30,15 +32,19 @@ class SavedStreamReader(object):
 
 
   def __init__(self, app_state, timestamp, trading_pair, data_store_dir,
-               update_resolution, progress_callback_fn):
+               update_resolution, progress_callback_fn, json_decoder="auto"):
     data_dir = os.path.join(data_store_dir, "%d" % timestamp)
     self._app_state = app_state
     self._trades_filename = os.path.join(data_dir, "%d_%s_trades.txt.gz" % (timestamp, trading_pair))
     self._depth_filename = os.path.join(data_dir, "%d_%s_depth.txt.gz" % (timestamp, trading_pair))
     self._update_resolution = update_resolution
     self._progress_callback_fn = progress_callback_fn
-    self._pending_depth_dict = None
+    self._loads = get_json_decoder(json_decoder)
+    self._pending_depth_state = None
     self._pair = trading_pair
+    shard = app_state._analysis_shard(trading_pair)
+    self._trade_queue = app_state._trade_queues[shard]
+    self._orderbook_state_queue = app_state._orderbook_state_queues[shard]
     self._cur_update = 0
 
 
@@ -77,9 +83,9 @@ class SavedStreamReader(object):
 
 
 
-    final_trade = json.loads(progress_line.decode("utf-8"))
+    final_trade = Trade.from_json_obj(self._loads(progress_line))
     self._start_timestamp = None
-    self._final_timestamp = final_trade["server_timestamp"]
+    self._final_timestamp = final_trade.server_timestamp
     self._final_date_str = datetime.datetime.utcfromtimestamp(self._final_timestamp
                               // 1000).strftime("%Y-%m-%d %H:%M:%S")
 
@@ -95,9 +101,9 @@ class SavedStreamReader(object):
           line = trades_in.readline()
           if not line:
             break
-          cur_trade_dict = json.loads(line)
+          cur_trade = Trade.from_json_obj(self._loads(line))
 
-          server_timestamp = cur_trade_dict["server_timestamp"]
+          server_timestamp = cur_trade.server_timestamp
 
           # Update stream to bring up to current time.
           if server_timestamp - last_update_timestamp >= self._update_resolution:
@@ -115,10 +121,10 @@ class SavedStreamReader(object):
             last_update_timestamp = server_timestamp
 
 
-          while not self._app_state._trade_queue.empty():
+          while not self._trade_queue.empty():
             sleep(_SLEEP_TIME)
           self._app_state.server_time = server_timestamp
-          self._app_state._trade_queue.put_nowait((self._pair, cur_trade_dict))
+          self._trade_queue.put((self._pair, cur_trade))
 
 
 
@@ -135,28 +141,28 @@ class SavedStreamReader(object):
     
 
     # Read and process all depths before current timestamp.
-    if self._pending_depth_dict is not None:
-      if self._pending_depth_dict["server_timestamp"] < server_timestamp:
-        while not self._app_state._orderbook_state_queue.empty():
+    if self._pending_depth_state is not None:
+      if self._pending_depth_state.server_timestamp < server_timestamp:
+        while not self._orderbook_state_queue.empty():
           sleep(_SLEEP_TIME)
         self._app_state.server_time = server_timestamp
-        self._app_state._orderbook_state_queue.put_nowait((self._pair, self._pending_depth_dict))
-        self._pending_depth_dict = None
+        self._orderbook_state_queue.put((self._pair, self._pending_depth_state))
+        self._pending_depth_state = None
 
-    if self._pending_depth_dict is None:
+    if self._pending_depth_state is None:
       while True:
         line = depth_file_in.readline()
         if not line:
           break
-        cur_depth_dict = json.loads(line)
+        cur_depth_state = OrderBookState.from_json_obj(self._loads(line))
 
-        if cur_depth_dict["server_timestamp"] < server_timestamp:
-          while not self._app_state._orderbook_state_queue.empty():
+        if cur_depth_state.server_timestamp < server_timestamp:
+          while not self._orderbook_state_queue.empty():
             sleep(_SLEEP_TIME)
           self._app_state.server_time = server_timestamp
-          self._app_state._orderbook_state_queue.put_nowait((self._pair, cur_depth_dict))
+          self._orderbook_state_queue.put((self._pair, cur_depth_state))
         else:
-          self._pending_depth_dict = cur_depth_dict
+          self._pending_depth_state = cur_depth_state
           break
 
 
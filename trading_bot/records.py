@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Defines compact record types for market data passed between runners and
+saved to recordings.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+from collections import namedtuple
+
+
+
+
+class Trade(namedtuple("Trade", ["trade_timestamp", "price", "quantity",
+                                 "is_buyer_maker", "buyer_id", "seller_id",
+                                 "server_timestamp", "low24", "high24", "vol24"])):
+  """A single trade along with the latest 24 hour ticker statistics of its
+  symbol pair. Serializes to JSON as a list of field values."""
+
+  __slots__ = ()
+
+
+  @classmethod
+  def from_json_obj(cls, obj):
+    """Constructs a trade from a decoded recording line, which is either a list
+    of field values or, in older recordings, a dictionary."""
+
+    if isinstance(obj, dict):
+      return cls(**obj)
+    return cls(*obj)
+
+
+
+
+class DepthUpdate(namedtuple("DepthUpdate", ["pair", "first_update_id",
+                                             "final_update_id", "bids", "asks"])):
+  """A change event for the orderbook of a symbol pair. The bids and asks are
+  sequences of (price in integer units, quantity) tuples, where a quantity of 0
+  removes the level."""
+
+  __slots__ = ()
+
+
+
+
+class DepthSnapshot(namedtuple("DepthSnapshot", ["pair", "update_id", "bids",
+                                                 "asks"])):
+  """A snapshot of the orderbook of a symbol pair as of the given update id. The
+  bids and asks are sequences of (price in integer units, quantity) tuples."""
+
+  __slots__ = ()
+
+
+
+
+class PairInfo(namedtuple("PairInfo", ["base_symbol", "quote_symbol", "base_precision",
+                                       "base_step_size", "min_base_qty", "max_base_qty",
+                                       "quote_precision", "quote_step_size",
+                                       "min_quote_price", "max_quote_price",
+                                       "min_notational_product"])):
+  """Trading parameters of a symbol pair from the exchange info. Quantities and
+  prices are in integer units of the base and quote precisions, and the minimum
+  notional is in units of their combined precision."""
+
+  __slots__ = ()
+
+
+
+
+class BookAnalytics(namedtuple("BookAnalytics", ["best_bid", "best_bid_quantity",
+                                                 "best_ask", "best_ask_quantity",
+                                                 "spread", "mid", "microprice",
+                                                 "imbalance", "bid_quantity",
+                                                 "ask_quantity", "bid_depths",
+                                                 "ask_depths"])):
+  """Statistics of the orderbook of a symbol pair. The imbalance is the
+  difference of the best bid and ask quantities over their sum. The total
+  quantity of each side is given, and the depths are tuples of the cumulative
+  quantity within each configured distance from the mid price."""
+
+  __slots__ = ()
+
+
+
+
+class OrderBookState(namedtuple("OrderBookState", ["server_timestamp", "bids",
+                                                   "asks", "analytics"])):
+  """The current orderbook of a symbol pair. The bids and asks are either
+  sequences of (price, quantity) tuples ascending by price, or (N, 2) Numpy
+  arrays of the best N levels, best level first and padded with zero rows. The
+  analytics are the `BookAnalytics` of the full book, or `None` if unavailable.
+  Serializes to JSON as a list of field values, excluding the analytics."""
+
+  __slots__ = ()
+
+
+  def __new__(cls, server_timestamp, bids, asks, analytics=None):
+    return super(OrderBookState, cls).__new__(cls, server_timestamp, bids, asks,
+                                              analytics)
+
+
+  def to_json_obj(self):
+    """Returns a JSON-serializable list of field values."""
+
+    return [self.server_timestamp,
+            self.bids.tolist() if hasattr(self.bids, "tolist") else self.bids,
+            self.asks.tolist() if hasattr(self.asks, "tolist") else self.asks]
+
+
+  @classmethod
+  def from_json_obj(cls, obj):
+    """Constructs an orderbook state from a decoded recording line, which is
+    either a list of field values or, in older recordings, a dictionary with
+    sides keyed by price level strings."""
+
+    if isinstance(obj, dict):
+      return cls(obj["server_timestamp"],
+                 sorted((float(level), obj["bids"][level]) for level in obj["bids"]),
+                 sorted((float(level), obj["asks"][level]) for level in obj["asks"]))
+    return cls(*obj)
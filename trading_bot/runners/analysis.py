@@ -15,17 +15,23 @@ except ImportError:
 
 
 import gzip
+import itertools
 import json
 import numpy as np
 import os
 
-from trading_bot.buffer import RealtimeTradeStreamBuffer
-from trading_bot.parsing import parse_depth_state, parse_trade
+from trading_bot.buffer import StreamFeatureEngine
+from trading_bot.inference import InferencePool
+from trading_bot.models import ModelRegistry
+from trading_bot.parsing import parse_depth_states
+from trading_bot.periods import TradePeriodAggregator
 from trading_bot.prediction import TradePredictionModel
 from trading_bot.runners.base import Runner
+from trading_bot.window import SlotRingSum
 
 
-_EPSILON = float(1e-6)
+# Probabilities are clipped to this minimum before taking their logs.
+_MIN_PROB = float(1e-300)
 _FLOAT_DTYPE = "float32"
 
 
@@ -33,17 +39,116 @@ _FLOAT_DTYPE = "float32"
 
 class AnalysisRunner(Runner):
   """Runner to analyze the current trades and orderbook to determine whether
-  trades should be executed."""
+  trades should be executed. Symbol pairs are sharded across a configurable
+  number of runners, and each runner only handles the pairs of its shard.
+
+  Pairs are only predicted when their feature windows advance, on a period
+  close or a new order book. Predictions are cached by pair and period
+  timestamp, so the probability histories gain one entry per period, and an
+  order book update within a period replaces the entry of that period.
+
+  Model artifacts are loaded in the background, and new model versions are
+  swapped in when periods close, so a version never changes mid-period.
+  Prediction models run either inline or in a pool of inference worker
+  processes. With workers, predictions that miss the inference deadline keep
+  the previous probabilities of their pairs and are retried on the next
+  update, so the analysis loop never waits longer than the deadline for the
+  models."""
+
+  input_channels = ["trade", "orderbook_state"]
+
+  # One runner is started for each analysis worker.
+  sharded = True
+
+
+  def __init__(self, app_state, config, shard=0, **kwargs):
+    Runner.__init__(self, app_state, config, **kwargs)
+    self._shard = shard
+
+    # Models outlive reconnects, so the pairs they are loaded for are kept here
+    # rather than reset on start.
+    self._model_pairs = set()
+    self._num_load_errors = 0
+    if config["num_inference_workers"] > 0:
+      self._inference_pool = InferencePool(config["num_inference_workers"],
+                                           config["inference_max_pairs"],
+                                           config["models_dir"],
+                                           config["model_check_interval"])
+      self._model_registry = None
+    else:
+      self._inference_pool = None
+      self._model_registry = ModelRegistry(config["models_dir"],
+                                           config["model_check_interval"])
 
 
   def on_start(self, **kwargs):
     self._last_closed_time_bin = 0
-    self._time_bin_stats = {}
-    self._realtime_streams = {}
-    self._last_avg_prices = {}
-    self._trade_models = {}
-    self._buy_probs_histories = {}
-    self._sell_probs_histories = {}
+    self._trade_periods = {}
+    self._feature_engine = StreamFeatureEngine(
+        feature_names=TradePredictionModel.feature_names)
+    self._stream_slots = {}
+    # Running sums of the log probabilities of the buy and sell states over the
+    # history of each stream slot. Histories start empty, which is the same as
+    # starting with uniform probabilities.
+    self._log_probs_histories = SlotRingSum(self._config["trade_history_length"], (2, 2))
+    # Tuples of the period timestamp and window version last predicted per pair.
+    self._predicted_windows = {}
+
+
+
+
+  def _get_stream_slot(self, pair):
+    try:
+      return self._stream_slots[pair]
+    except KeyError:
+      slot = self._feature_engine.add_slot()
+      self._stream_slots[pair] = slot
+      self._log_probs_histories.resize(self._feature_engine.num_slots)
+      return slot
+
+
+
+
+  def _predict_with_pool(self, pairs, timestamps, feats_windows, bid_windows, ask_windows):
+    """Predicts the windows of the symbol pairs with the inference workers and
+    returns a tuple of arrays of buy and sell probability distributions and a
+    boolean array of whether each pair was predicted. Pairs past the pool
+    capacity, whose predictions miss the deadline, or whose models fail to load
+    are counted as misses."""
+
+    num_pairs = min(len(pairs), self._inference_pool.capacity)
+    num_batches = self._inference_pool.num_batches
+    probs = self._inference_pool.predict(pairs[:num_pairs], timestamps[:num_pairs],
+                                         feats_windows[:num_pairs], bid_windows[:num_pairs],
+                                         ask_windows[:num_pairs],
+                                         self._config["inference_deadline"] / 1000.)
+
+    buy_probs = np.zeros((len(pairs), 2), dtype=_FLOAT_DTYPE)
+    sell_probs = np.zeros((len(pairs), 2), dtype=_FLOAT_DTYPE)
+    is_predicted = np.zeros((len(pairs),), dtype=bool)
+    if probs is not None:
+      buy_probs[:num_pairs], sell_probs[:num_pairs], is_predicted[:num_pairs] = probs
+    num_predictions = np.count_nonzero(is_predicted)
+    self._app_state._add_inference_counts(
+        self._shard, self._inference_pool.num_batches - num_batches, num_predictions,
+        len(pairs) - num_predictions)
+
+    return buy_probs, sell_probs, is_predicted
+
+
+
+  def _count_load_errors(self):
+    """Adds the models that failed to load since the last call to the load error
+    counter of the analysis worker."""
+
+    if self._inference_pool is None:
+      num_load_errors = self._model_registry.num_load_errors
+    else:
+      num_load_errors = self._inference_pool.num_load_errors
+    if num_load_errors != self._num_load_errors:
+      self._app_state._add_inference_counts(self._shard, 0, 0, 0,
+                                            num_load_errors - self._num_load_errors)
+      self._num_load_errors = num_load_errors
 
 
 
@@ -56,10 +161,10 @@ class AnalysisRunner(Runner):
 
 
 
-    # Empty trades queue and collect time bin stats.
+    # Empty trades queue and aggregate trades into periods.
     try:
       while True:
-        pair, cur_trade = self._app_state._trade_queue.get_nowait()
+        pair, cur_trade = self._app_state._trade_queues[self._shard].get_nowait()
 
         if pair in self._app_state.save_pairs:
           # Save trade data.
@@ -75,20 +180,22 @@ class AnalysisRunner(Runner):
 
         if pair in self._app_state.trade_pairs:
           try:
-            bin_stats_dict = self._time_bin_stats[pair]
+            trade_periods = self._trade_periods[pair]
           except KeyError:
-            bin_stats_dict = {}
-            self._time_bin_stats[pair] = bin_stats_dict
-          parse_trade(self._config["period_time"], cur_trade, bin_stats_dict)
+            trade_periods = TradePeriodAggregator(self._config["period_time"])
+            self._trade_periods[pair] = trade_periods
+          trade_periods.add_trade(cur_trade)
 
     except queue.Empty: pass
 
 
 
     # Empty orderbook queue and update each realtime stream's orderbook records.
+    # States are parsed together after the queue is emptied.
+    trade_depth_states = []
     try:
       while True:
-        pair, cur_state = self._app_state._orderbook_state_queue.get_nowait()
+        pair, cur_state = self._app_state._orderbook_state_queues[self._shard].get_nowait()
 
         if pair in self._app_state.save_pairs:
           # Save depth data.
@@ -99,25 +206,27 @@ class AnalysisRunner(Runner):
             os.makedirs(out_dir)
           except OSError: pass
           with gzip.open(out_file, "ab") as f_out:
-            f_out.write(b"%s\n" % json.dumps(cur_state).encode("utf-8"))
+            f_out.write(b"%s\n" % json.dumps(cur_state.to_json_obj()).encode("utf-8"))
 
         if pair in self._app_state.trade_pairs:
-          tup = parse_depth_state(self._config["num_depth_bins"], cur_state)
-
-          try:
-            realtime_stream = self._realtime_streams[pair]
-          except KeyError:
-            realtime_stream = RealtimeTradeStreamBuffer()
-            self._realtime_streams[pair] = realtime_stream
-
-          realtime_stream.update_order_book(*tup)
+          trade_depth_states.append((pair, cur_state))
         
     except queue.Empty: pass
 
+    if trade_depth_states:
+      _, bid_arr, ask_arr, avg_spreads, qty_spreads = parse_depth_states(
+          self._config["num_depth_bins"], [cur_state for _, cur_state in trade_depth_states])
+
+      for i, (pair, cur_state) in enumerate(trade_depth_states):
+        self._feature_engine.update_order_book(self._get_stream_slot(pair),
+                                               cur_state.server_timestamp, bid_arr[i],
+                                               ask_arr[i], avg_spreads[i], qty_spreads[i])
+
 
 
     # Close all time bins before the current open one and update each realtime
-    # streams trade period records.
+    # stream's trade period records. Streams are updated together, one closed
+    # period per stream at a time.
     cur_time_bin = (int(self._app_state.server_time
                         / float(self._config["period_time"]))
                     * self._config["period_time"])
@@ -127,119 +236,126 @@ class AnalysisRunner(Runner):
     if last_time_bin > self._last_closed_time_bin:
       self._last_closed_time_bin = last_time_bin
 
-      for pair in self._time_bin_stats:
-        bin_stats = self._time_bin_stats[pair]
-
-        try:
-          realtime_stream = self._realtime_streams[pair]
-        except KeyError:
-          realtime_stream = RealtimeTradeStreamBuffer()
-          self._realtime_streams[pair] = realtime_stream
-
-        did_close = False
-        for stats_time_bin in sorted(bin_stats.keys()):
-          if stats_time_bin > last_time_bin:
-            break
-
-          total_quantity = np.sum(bin_stats[stats_time_bin][0])
-          total_num_trades = len(bin_stats[stats_time_bin][0])
-          weights = np.array(bin_stats[stats_time_bin][0]) / total_quantity
-          avg_price = np.sum(np.array(bin_stats[stats_time_bin][1]) * weights)
-          low_price = np.min(bin_stats[stats_time_bin][1])
-          high_price = np.max(bin_stats[stats_time_bin][1])
-          self._last_avg_prices[pair] = avg_price
-          realtime_stream.update_trade_period(stats_time_bin, total_quantity,
-                                              total_num_trades, avg_price,
-                                              low_price, high_price)
-
-          del bin_stats[stats_time_bin]
-          did_close = True
-
-        if not did_close:
-          try:
-            last_avg_price = self._last_avg_prices[pair]
-          except KeyError:
-            last_avg_price = 0
-          total_quantity = 0.
-          total_num_trades = 0
-          avg_price = last_avg_price
-          low_price = last_avg_price
-          high_price = last_avg_price
-          realtime_stream.update_trade_period(last_time_bin, total_quantity,
-                                              total_num_trades, avg_price,
-                                              low_price, high_price)
-
-
-
-    # Unload any prediction models that are no longer needed.
-    to_delete = set()
-    for pair in self._trade_models:
-      if pair not in self._app_state.trade_pairs:
-        to_delete.add(pair)
-    for pair in to_delete:
-      self._trade_models[pair].unload()
-      del self._trade_models[pair]
+      # Swap in model versions loaded since the last period.
+      if self._inference_pool is None:
+        self._model_registry.swap()
+      else:
+        self._inference_pool.swap_models()
 
+      closed_periods = []
+      for pair, trade_periods in self._trade_periods.items():
+        slot = self._get_stream_slot(pair)
 
+        pair_periods = trade_periods.close_periods(last_time_bin)
+        for num_closed, period in enumerate(pair_periods):
+          closed_periods.append((num_closed, slot) + period)
 
+        if not pair_periods:
+          last_avg_price = trade_periods.last_avg_price
+          closed_periods.append((0, slot, last_time_bin, 0., 0, last_avg_price,
+                                 last_avg_price, last_avg_price))
 
+      closed_periods.sort(key=lambda period: period[0])
+      for _, periods in itertools.groupby(closed_periods, key=lambda period: period[0]):
+        (_, slots, period_timestamps, total_quantities, total_num_trades, avg_prices,
+         low_prices, high_prices) = [np.array(column) for column in zip(*periods)]
+        self._feature_engine.update_trade_periods(slots, period_timestamps, total_quantities,
+                                                  total_num_trades, avg_prices, low_prices,
+                                                  high_prices)
 
-    # Analyze stream features and determine whether to trade at this instant.
-    for pair in self._app_state.trade_pairs:
 
-      try:
-        realtime_stream = self._realtime_streams[pair]
-      except KeyError:
-        realtime_stream = RealtimeTradeStreamBuffer()
-        self._realtime_streams[pair] = realtime_stream
 
-      try:
-        trade_model = self._trade_models[pair]
-      except KeyError:
-        trade_model = TradePredictionModel(pair)
-        self._trade_models[pair] = trade_model
+    trade_pairs = [pair for pair in self._app_state.trade_pairs
+                   if self._app_state._analysis_shard(pair) == self._shard]
 
 
-      feats_tup = realtime_stream.get_features_window()
-      if feats_tup is not None:
-        buy_probs = trade_model.predict_buy(*feats_tup)
-        sell_probs = trade_model.predict_sell(*feats_tup)
+    # Unload any prediction models that are no longer needed.
+    to_delete = self._model_pairs.difference(trade_pairs)
+    for pair in to_delete:
+      if self._inference_pool is None:
+        self._model_registry.unload(pair)
       else:
-        buy_probs = np.array([0.5, 0.5], dtype=_FLOAT_DTYPE)
-        sell_probs = np.array([0.5, 0.5], dtype=_FLOAT_DTYPE)
-
-
-      try:
-        self._buy_probs_histories[pair][:-1] = self._buy_probs_histories[pair][1:]
-        self._buy_probs_histories[pair][-1] = buy_probs
-      except KeyError:
-        self._buy_probs_histories[pair] = np.zeros((self._config["trade_history_length"], 2),
-                                                   dtype=_FLOAT_DTYPE) + 0.5
+        self._inference_pool.unload(pair)
+      self._model_pairs.discard(pair)
+      self._predicted_windows.pop(pair, None)
 
-      try:
-        self._sell_probs_histories[pair][:-1] = self._sell_probs_histories[pair][1:]
-        self._sell_probs_histories[pair][-1] = sell_probs
-      except KeyError:
-        self._sell_probs_histories[pair] = np.zeros((self._config["trade_history_length"], 2),
-                                                    dtype=_FLOAT_DTYPE) + 0.5
 
 
-    # Broadcast trade events for which the joint probability over all
-    # history windows exceeds the defined threshold.
-    for pair in self._app_state.trade_pairs:
-      probs = np.prod(self._buy_probs_histories[pair], axis=0)
-      probs /= (np.sum(probs) + _EPSILON)
-
-      if probs[1] >= self._config["buy_threshold"]:
-        # TODO broadcast buy event and timestamp and pair
-        pass
-
-      probs = np.prod(self._sell_probs_histories[pair], axis=0)
-      probs /= (np.sum(probs) + _EPSILON)
 
-      if probs[1] >= self._config["sell_threshold"]:
-        # TODO broadcast sell event and timestamp and pair
-        pass
 
+    # Analyze stream features and determine whether to trade at this instant.
+    # Only pairs whose windows advanced since their last prediction are
+    # predicted, in one batch of the pairs whose feature windows are ready.
+    # Inline models are requested from the registry and pairs are predicted
+    # once their models are swapped in. Models run by inference workers are
+    # loaded in the workers.
+    for pair in trade_pairs:
+      if pair not in self._model_pairs:
+        if self._inference_pool is None:
+          self._model_registry.request(pair)
+        self._model_pairs.add(pair)
+
+    slots = np.array([self._get_stream_slot(pair) for pair in trade_pairs], dtype="int64")
+    window_versions = self._feature_engine.get_window_versions(slots)
+    is_stale = np.array([self._predicted_windows.get(pair, (None, None))[1] != version
+                         and (self._model_registry is None
+                              or self._model_registry.get(pair) is not None)
+                         for pair, version in zip(trade_pairs, window_versions)], dtype=bool)
+
+    self._count_load_errors()
+
+    predicted = np.zeros((0,), dtype="int64")
+    if np.any(is_stale):
+      is_ready, timestamps, feats_windows, bid_windows, ask_windows = (
+          self._feature_engine.get_features_windows(slots[is_stale]))
+
+      if np.any(is_ready):
+        ready = np.flatnonzero(is_stale)[is_ready]
+        ready_pairs = [trade_pairs[i] for i in ready]
+        if self._inference_pool is None:
+          all_buy_probs, all_sell_probs = TradePredictionModel.predict_pairs(
+              [self._model_registry.get(pair) for pair in ready_pairs], timestamps, feats_windows,
+              bid_windows, ask_windows)
+          is_predicted = np.ones((len(ready),), dtype=bool)
+        else:
+          all_buy_probs, all_sell_probs, is_predicted = self._predict_with_pool(
+              ready_pairs, timestamps, feats_windows, bid_windows, ask_windows)
+
+        # Inference workers may not predict every pair.
+        predicted = ready[is_predicted]
+        timestamps = timestamps[is_predicted]
+        all_buy_probs = all_buy_probs[is_predicted]
+        all_sell_probs = all_sell_probs[is_predicted]
+
+        # History entries are the log probabilities of the buy and sell states.
+        # A new period adds an entry, and a new order book within the same
+        # period replaces the entry of that period.
+        log_probs = np.log(np.maximum(np.stack([all_buy_probs, all_sell_probs],
+                                               axis=1).astype("float64"), _MIN_PROB))
+        is_new_period = np.array([self._predicted_windows.get(trade_pairs[i], (None, None))[0]
+                                  != timestamp for i, timestamp in zip(predicted, timestamps)],
+                                 dtype=bool)
+        predicted_slots = slots[predicted]
+        self._log_probs_histories.append(predicted_slots[is_new_period],
+                                         log_probs[is_new_period])
+        self._log_probs_histories.replace_latest(predicted_slots[~is_new_period],
+                                                 log_probs[~is_new_period])
+
+        for i, timestamp in zip(predicted, timestamps):
+          self._predicted_windows[trade_pairs[i]] = (timestamp, window_versions[i])
 
 
+    # Broadcast trade events for which the joint probability over all
+    # history windows exceeds the defined threshold. The joint probability of
+    # state 1, normalized over both states, is the logistic function of the
+    # difference of the summed log probabilities of the states.
+    log_prob_sums = self._log_probs_histories.sums(slots[predicted])
+    joint_probs = 0.5 * (1. + np.tanh(0.5 * (log_prob_sums[:, :, 1] - log_prob_sums[:, :, 0])))
+
+    for i in predicted[joint_probs[:, 0] >= self._config["buy_threshold"]]:
+      # TODO broadcast buy event and timestamp and pair
+      pass
+
+    for i in predicted[joint_probs[:, 1] >= self._config["sell_threshold"]]:
+      # TODO broadcast sell event and timestamp and pair
+      pass
@@ -10,7 +10,19 @@ from __future__ import print_function
 
 
 class Runner(object):
-  """Base class for asynchronously executed logic."""
+  """Base class for asynchronously executed logic. Subclasses list the app
+  state channels they read from and write to, which determines whether a
+  channel can be kept in-process when runners share a process."""
+
+  input_channels = []
+  output_channels = []
+
+  # Whether the runner can share a process loop with other runners.
+  fusable = True
+
+  # Whether one runner is started per analysis worker, each reading only its
+  # own instance of sharded input channels.
+  sharded = False
 
   def __init__(self, app_state, config, **kwargs):
     self._app_state = app_state
@@ -17,6 +17,7 @@ from io import BytesIO
 from time import time
 
 
+from trading_bot.parsing import get_exchange_pair_infos
 from trading_bot.runners.base import Runner
 
 
@@ -36,6 +37,7 @@ class ConnectionRunner(Runner):
     self._last_exchange_info_time = 0
     self._last_account_ping_time = 0
     self._time_drift = 0
+    self._pair_infos = None
 
 
 
@@ -277,7 +279,10 @@ class ConnectionRunner(Runner):
     exchange_info = self._request_timed_info(_REST_URL + "/v1/exchangeInfo")
     
     if exchange_info:
-      pass
+      pair_infos = get_exchange_pair_infos(exchange_info)
+      if pair_infos != self._pair_infos:
+        self._app_state._pair_infos = pair_infos
+        self._pair_infos = pair_infos
 
 
 
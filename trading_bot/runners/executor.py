@@ -24,6 +24,8 @@ from trading_bot.runners.base import Runner
 class TradeExecutorRunner(Runner):
   """Runner to execute and manage trade orders."""
 
+  input_channels = ["executor"]
+
 
   def on_start(self, **kwargs):
     pass
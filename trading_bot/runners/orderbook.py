@@ -16,31 +16,52 @@ except ImportError:
 
 from time import time
 
+from trading_bot.book import OrderBook
+from trading_bot.numerics import PairNumericsCache
 from trading_bot.runners.base import Runner
 
 
 
 
+class OrderBookRunner(Runner):
+  """Runner to maintain and broadcast the current state of the bid and ask
+  orderbook depths. Applies depth events incrementally as they arrive to
+  each symbol pair's `OrderBook`, and pushes the current state to the orderbook
+  queue. In "interval" publish mode every book is pushed periodically, and in
+  "change" mode a book is pushed as soon as it changes, coalescing changes that
+  occur within the minimum publish interval. Books that are out of sync are not
+  pushed, and a snapshot is requested for them from the `SnapshotRunner`.
 
-_MAX_EVENT_BUFFER_SIZE = 100
-
-
+  Each pushed state carries the analytics of its book, which are also set in
+  the app state for the UI at most once per orderbook interval."""
 
+  input_channels = ["depth_event", "depth_snapshot"]
+  output_channels = ["orderbook_state", "snapshot_request"]
 
 
+  def on_start(self, **kwargs):
+    self._books = {}
+    self._numerics = PairNumericsCache(self._app_state)
+    self._last_post_time = 0
+    self._last_pair_post_times = {}
+    self._last_request_times = {}
+    self._last_metrics = None
+    self._analytics = {}
+    self._analytics_changed = False
+    self._last_analytics_time = 0
 
-class OrderBookRunner(Runner):
-  """Runner to maintain and broadcast the current state of the bid and ask
-  orderbook depths. Applies depth events to depth snapshots and pushes
-  the current state to the orderbook queue."""
 
 
-  def on_start(self, **kwargs):
-    self._bid_events = {}
-    self._ask_events = {}
-    self._cur_bid_depths = {}
-    self._cur_ask_depths = {}
-    self._last_post_time = 0
+  def _get_book(self, pair):
+    try:
+      return self._books[pair]
+    except KeyError:
+      book = OrderBook(self._config["orderbook_max_buffered_events"],
+                       self._config["orderbook_top_levels"],
+                       self._config["orderbook_depth_distances"],
+                       self._numerics.get(pair).price_precision)
+      self._books[pair] = book
+      return book
 
 
 
@@ -53,125 +74,143 @@ class OrderBookRunner(Runner):
 
 
 
-    # Empty depth event queues and organize by symbol pair.
+    # Empty depth event queue and apply events to each symbol pair's book.
     try:
       while True:
-        bid_updates = self._app_state._bid_depth_event_queue.get_nowait()
-        pair = bid_updates[0]
-        try:
-          self._bid_events[pair].append(bid_updates)
-        except KeyError:
-          self._bid_events[pair] = [bid_updates]
+        depth_update = self._app_state._depth_event_queue.get_nowait()
+        self._get_book(depth_update.pair).apply_update(depth_update)
     except queue.Empty: pass
 
+
+
+    # Reset each symbol pair's book to the latest depth snapshots.
     try:
       while True:
-        ask_updates = self._app_state._ask_depth_event_queue.get_nowait()
-        pair = ask_updates[0]
-        try:
-          self._ask_events[pair].append(ask_updates)
-        except KeyError:
-          self._ask_events[pair] = [ask_updates]
+        snapshot = self._app_state._depth_snapshot_queue.get_nowait()
+        self._get_book(snapshot.pair).apply_snapshot(snapshot)
     except queue.Empty: pass
 
-    for pair in self._bid_events:
-      if len(self._bid_events[pair]) > _MAX_EVENT_BUFFER_SIZE:
-        self._bid_events[pair] = self._bid_events[pair][-_MAX_EVENT_BUFFER_SIZE:]
 
-    for pair in self._ask_events:
-      if len(self._ask_events[pair]) > _MAX_EVENT_BUFFER_SIZE:
-        self._ask_events[pair] = self._ask_events[pair][-_MAX_EVENT_BUFFER_SIZE:]
 
+    pairs = set(self._app_state.trade_pairs + self._app_state.save_pairs)
+    self._request_snapshots(pairs)
+    self._update_metrics(pairs)
 
 
 
+    if self._config["orderbook_publish_mode"] == "change":
+      self._post_changed_orderbooks()
+    else:
+      self._post_all_orderbooks()
 
-    # Update each symbol pair to the latest depth snapshots.
-    try:
-      while True:
-        pair, update_id, bids = self._app_state._bid_snapshot_queue.get_nowait()
-        self._cur_bid_depths[pair] = (update_id, bids)
-    except queue.Empty: pass
+    self._update_analytics()
 
-    try:
-      while True:
-        pair, update_id, asks = self._app_state._ask_snapshot_queue.get_nowait()
-        self._cur_ask_depths[pair] = (update_id, asks)
-    except queue.Empty: pass
 
 
 
 
+  def _request_snapshots(self, pairs):
+    """Requests a snapshot for each out of sync orderbook as soon as it goes
+    out of sync, then at most once per request timeout until it is synced."""
 
-    # Update and post current orderbooks if time interval has passed.
     cur_time = int(time())
 
-    if cur_time - self._last_post_time >= self._config["orderbook_interval"]:
-      self._last_post_time = cur_time
+    for pair in pairs:
+      if self._get_book(pair).is_synced:
+        self._last_request_times.pop(pair, None)
+        continue
 
-      for pair in set(self._app_state.trade_pairs + self._app_state.save_pairs):
+      try:
+        last_request_time = self._last_request_times[pair]
+      except KeyError:
+        last_request_time = 0
+
+      if cur_time - last_request_time >= self._config["request_timeout"]:
+        self._last_request_times[pair] = cur_time
+        self._app_state._snapshot_request_queue.put((pair, cur_time))
 
-        # Update current bids.
-        try:
-          update_id, bids = self._cur_bid_depths[pair]
-          bid_events = self._bid_events[pair]
-        except KeyError:
-          update_id = 0
-          bids = {}
-          bid_events = []
 
-        first_ind = len(bid_events)
-        for i in range(len(bid_events)):
-          _, min_update_id, max_update_id, bid_updates = bid_events[i]
 
-          if min_update_id >= update_id:
-            if i < first_ind:
-              first_ind = i
+  def _update_metrics(self, pairs):
+    """Sets the orderbook metrics in the app state if they changed."""
 
-            if max_update_id <= update_id:
-              bids.update(bid_updates)
+    metrics = {}
+    for pair in pairs:
+      book = self._get_book(pair)
+      metrics[pair] = {"synced": book.is_synced,
+                       "num_gaps": book.num_gaps,
+                       "num_resyncs": book.num_resyncs}
 
-        self._bid_events[pair] = bid_events[first_ind:]
+    if metrics != self._last_metrics:
+      self._app_state.orderbook_metrics = metrics
+      self._last_metrics = metrics
 
-        # Update current asks.
-        try:
-          update_id, asks = self._cur_ask_depths[pair]
-          ask_events = self._ask_events[pair]
-        except KeyError:
-          update_id = 0
-          asks = {}
-          ask_events = []
 
-        first_ind = len(ask_events)
-        for i in range(len(ask_events)):
-          _, min_update_id, max_update_id, ask_updates = ask_events[i]
 
-          if min_update_id >= update_id:
-            if i < first_ind:
-              first_ind = i
 
-            if max_update_id <= update_id:
-              asks.update(ask_updates)
 
-        self._ask_events[pair] = ask_events[first_ind:]
+  def _update_analytics(self):
+    """Sets the latest published orderbook analytics in the app state if they
+    changed and the orderbook interval has passed."""
+
+    cur_time = int(time())
+
+    if (self._analytics_changed and
+        cur_time - self._last_analytics_time >= self._config["orderbook_interval"]):
+      self._analytics_changed = False
+      self._last_analytics_time = cur_time
+      self._app_state.orderbook_analytics = dict(
+          (pair, dict(analytics._asdict()))
+          for pair, analytics in self._analytics.items() if analytics is not None)
+
 
 
-        # Post depth state.
-        cur_state = {}
-        cur_state["server_timestamp"] = self._app_state.server_time
-        cur_state["asks"] = asks
-        cur_state["bids"] = bids
 
-        self._app_state._orderbook_state_queue.put_nowait((pair, cur_state))
 
+  def _post_orderbook(self, pair, server_time):
+    cur_state = self._get_book(pair).get_state(server_time)
+    self._analytics[pair] = cur_state.analytics
+    self._analytics_changed = True
 
+    shard = self._app_state._analysis_shard(pair)
+    self._app_state._orderbook_state_queues[shard].put((pair, cur_state))
 
 
 
+  def _post_all_orderbooks(self):
+    """Posts all current orderbooks if the time interval has passed."""
+
+    cur_time = int(time())
+
+    if cur_time - self._last_post_time >= self._config["orderbook_interval"]:
+      self._last_post_time = cur_time
+
+      server_time = self._app_state.server_time
+      for pair in set(self._app_state.trade_pairs + self._app_state.save_pairs):
+        if self._get_book(pair).is_synced:
+          self._post_orderbook(pair, server_time)
+
 
 
-    
+  def _post_changed_orderbooks(self):
+    """Posts each changed orderbook that was not posted within the minimum
+    publish interval."""
 
+    cur_time_ms = int(time() * 1000)
+    server_time = None
 
+    for pair in set(self._app_state.trade_pairs + self._app_state.save_pairs):
+      book = self._get_book(pair)
+      if not book.changed or not book.is_synced:
+        continue
 
+      try:
+        last_post_time_ms = self._last_pair_post_times[pair]
+      except KeyError:
+        last_post_time_ms = 0
 
+      if cur_time_ms - last_post_time_ms >= self._config["orderbook_min_publish_interval"]:
+        if server_time is None:
+          server_time = self._app_state.server_time
+        self._last_pair_post_times[pair] = cur_time_ms
+        self._post_orderbook(pair, server_time)
@@ -8,12 +8,20 @@ from __future__ import division
 from __future__ import print_function
 
 
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+
 import json
 import pycurl
 
 from io import BytesIO
 from time import time
 
+from trading_bot.numerics import PairNumericsCache
+from trading_bot.records import DepthSnapshot
 from trading_bot.runners.base import Runner
 
 
@@ -24,12 +32,19 @@ _REST_URL = "https://www.binance.com/api"
 
 
 class SnapshotRunner(Runner):
-  """Runner to periodically get updated order depth snapshots from the REST
-  server."""
+  """Runner to get order depth snapshots from the REST server for symbol pairs
+  whose orderbooks are out of sync. Requested pairs are fetched immediately.
+  Pairs whose orderbook metrics are not synced are also fetched at most once
+  per snapshot interval, in case their requests were lost. Synced orderbooks
+  discard snapshots, so their pairs are not fetched."""
+
+  input_channels = ["snapshot_request"]
+  output_channels = ["depth_snapshot"]
 
 
   def on_start(self, **kwargs):
     self._last_snapshot_times = {}
+    self._numerics = PairNumericsCache(self._app_state)
 
 
 
@@ -37,65 +52,82 @@ class SnapshotRunner(Runner):
   def on_update(self, **kwargs):
 
     if self._app_state.connection_status != "CONNECTED":
-      self._last_snapshot_times = {}
+      self.on_start()
       return
 
 
+    # Empty snapshot request queue.
+    requested_pairs = set()
+    try:
+      while True:
+        pair, _ = self._app_state._snapshot_request_queue.get_nowait()
+        requested_pairs.add(pair)
+    except queue.Empty: pass
+
+
+    orderbook_metrics = self._app_state.orderbook_metrics
     for pair in set(self._app_state.trade_pairs + self._app_state.save_pairs):
 
-      try:
-        last_snapshot_time = self._last_snapshot_times[pair]
-      except KeyError:
-        last_snapshot_time = 0
+      if pair not in requested_pairs:
+        if orderbook_metrics.get(pair, {}).get("synced", False):
+          continue
 
-      start_time = int(time())
+        try:
+          last_snapshot_time = self._last_snapshot_times[pair]
+        except KeyError:
+          last_snapshot_time = 0
+        if int(time()) - last_snapshot_time < self._config["depth_snapshot_interval"]:
+          continue
 
-      if start_time - last_snapshot_time >= self._config["depth_snapshot_interval"]:
+      if not self._request_snapshot(pair):
+        return
 
-        uri = _REST_URL + "/v1/depth?symbol=%s&limit=100" % pair.upper()
 
-        try:
-          response = BytesIO()
 
-          curl = pycurl.Curl()
-          curl.setopt(pycurl.URL, uri)
-          curl.setopt(pycurl.ENCODING, "gzip")
-          curl.setopt(pycurl.TIMEOUT, self._config["request_timeout"])
-          curl.setopt(pycurl.HTTPHEADER, ["Accept:application/json",
-                                          "Accept-encoding:gzip"])
-          curl.setopt(pycurl.HTTPGET, 1)
-          curl.setopt(pycurl.WRITEFUNCTION, response.write)
-          curl.perform()
-          status_code = curl.getinfo(pycurl.HTTP_CODE)
-          curl.close()
 
-          if status_code == 429:
-            self._app_state.connection_status = "RATE_LIMITED"
-            return
+  def _request_snapshot(self, pair):
+    """Gets a depth snapshot of the symbol pair and pushes it to the snapshot
+    queue. Returns `False` if the server is rate limiting requests."""
+
+    uri = _REST_URL + "/v1/depth?symbol=%s&limit=100" % pair.upper()
+
+    try:
+      response = BytesIO()
 
+      curl = pycurl.Curl()
+      curl.setopt(pycurl.URL, uri)
+      curl.setopt(pycurl.ENCODING, "gzip")
+      curl.setopt(pycurl.TIMEOUT, self._config["request_timeout"])
+      curl.setopt(pycurl.HTTPHEADER, ["Accept:application/json",
+                                      "Accept-encoding:gzip"])
+      curl.setopt(pycurl.HTTPGET, 1)
+      curl.setopt(pycurl.WRITEFUNCTION, response.write)
+      curl.perform()
+      status_code = curl.getinfo(pycurl.HTTP_CODE)
+      curl.close()
 
-          response_str = response.getvalue().decode("utf-8")
-          response.close()
+      if status_code == 429:
+        self._app_state.connection_status = "RATE_LIMITED"
+        return False
 
-        
-          response = json.loads(response_str)
-          update_id = int(response["lastUpdateId"])
 
-          bids = {}
-          for level, quantity, _ in response["bids"]:
-            bids[level] = float(quantity)
+      response_str = response.getvalue().decode("utf-8")
+      response.close()
 
-          asks = {}
-          for level, quantity, _ in response["asks"]:
-            asks[level] = float(quantity)
 
+      response = json.loads(response_str)
+      update_id = int(response["lastUpdateId"])
 
-          self._last_snapshot_times[pair] = int(time())
+      price_to_int = self._numerics.get(pair).price_to_int
+      bids = [(price_to_int(level[0]), float(level[1])) for level in response["bids"]]
+      asks = [(price_to_int(level[0]), float(level[1])) for level in response["asks"]]
 
-          self._app_state._bid_snapshot_queue.put_nowait((pair, update_id, bids))
-          self._app_state._ask_snapshot_queue.put_nowait((pair, update_id, asks))
 
-        except: continue  # TODO Log errors somewhere.
+      self._last_snapshot_times[pair] = int(time())
 
+      self._app_state._depth_snapshot_queue.put(DepthSnapshot(pair, update_id,
+                                                              bids, asks))
 
+    except: pass  # TODO Log errors somewhere.
 
+    return True
@@ -8,14 +8,15 @@ from __future__ import division
 from __future__ import print_function
 
 
-import json
-
 from tornado import gen
 from tornado import httpclient
 from tornado import httputil
 from tornado import ioloop
 from tornado import websocket
 
+from trading_bot.decoding import StreamDecoder
+from trading_bot.numerics import PairNumericsCache
+from trading_bot.records import DepthUpdate, Trade
 from trading_bot.runners.base import Runner
 
 
@@ -109,8 +110,16 @@ class SocketClient(object):
 class SocketStreamRunner(Runner):
   """Runner for handling the connection to the exchange websocket stream."""
 
+  output_channels = ["trade", "depth_event"]
+
+  # The runner blocks in its own IO loop.
+  fusable = False
+
   def on_start(self, **kwargs):
     self._client = None
+    self._decoder = StreamDecoder(self._config["json_decoder"],
+                                  self._config["json_extract_fields"])
+    self._numerics = PairNumericsCache(self._app_state)
     self._ticker_lows = {}
     self._ticker_highs = {}
     self._ticker_vol = {}
@@ -139,6 +148,7 @@ class SocketStreamRunner(Runner):
 
     elif (self._client is None and self._app_state.connection_status == "CONNECTED"
         and (self._app_state.server_time - self._app_state.connect_time) >= 1000):
+      self._numerics.clear()
       self._client = SocketClient(self._app_state._ws_uri, None, None,
                                   self.on_message, self._config["connect_timeout"],
                                   self._config["request_timeout"])
@@ -150,12 +160,10 @@ class SocketStreamRunner(Runner):
 
   def on_message(self, msg):
     try:
-      event = json.loads(msg)
+      data = self._decoder.decode(msg)
+      event_type = data["e"]
     except: return
 
-    data = event["data"]
-    event_type = data["e"]
-
     try:
       server_timestamp = int(data["E"])
       if server_timestamp > self._app_state.server_time:
@@ -187,29 +195,20 @@ class SocketStreamRunner(Runner):
     buyer_id = int(data["b"])
     seller_id = int(data["a"])
 
-    cur_trade = {}
-    cur_trade["trade_timestamp"] = trade_timestamp
-    cur_trade["price"] = price
-    cur_trade["quantity"] = quantity
-    cur_trade["is_buyer_maker"] = is_buyer_maker
-    cur_trade["buyer_id"] = buyer_id
-    cur_trade["seller_id"] = seller_id
-    cur_trade["server_timestamp"] = self._app_state.server_time
     try:
-      cur_trade["low24"] = self._ticker_lows[pair]
+      low24 = self._ticker_lows[pair]
+      high24 = self._ticker_highs[pair]
+      vol24 = self._ticker_vol[pair]
     except KeyError:
-      cur_trade["low24"] = 0
-    try:
-      cur_trade["high24"] = self._ticker_highs[pair]
-    except KeyError:
-      cur_trade["high24"] = 0
-    try:
-      cur_trade["vol24"] = self._ticker_vol[pair]
-    except KeyError:
-      cur_trade["vol24"] = 0
+      low24 = 0
+      high24 = 0
+      vol24 = 0
 
+    cur_trade = Trade(trade_timestamp, price, quantity, is_buyer_maker, buyer_id,
+                      seller_id, self._app_state.server_time, low24, high24, vol24)
 
-    self._app_state._trade_queue.put_nowait((pair, cur_trade))
+    shard = self._app_state._analysis_shard(pair)
+    self._app_state._trade_queues[shard].put((pair, cur_trade))
 
 
 
@@ -229,21 +228,16 @@ class SocketStreamRunner(Runner):
 
   def _process_depth_event(self, data):
     pair = data["s"].lower()
-    min_update_id = int(data["u"]) - 1
-    max_update_id = int(data["U"]) - 1
-
-    bid_updates = {}
-    for level, quantity, _ in data["b"]:
-      bid_updates[level] = float(quantity)
+    first_update_id = int(data["U"])
+    final_update_id = int(data["u"])
 
-    ask_updates = {}
-    for level, quantity, _ in data["a"]:
-      ask_updates[level] = float(quantity)
+    price_to_int = self._numerics.get(pair).price_to_int
+    bid_updates = [(price_to_int(level[0]), float(level[1])) for level in data["b"]]
+    ask_updates = [(price_to_int(level[0]), float(level[1])) for level in data["a"]]
 
-    self._app_state._bid_depth_event_queue.put_nowait((pair, min_update_id,
-                                                      max_update_id, bid_updates))
-    self._app_state._ask_depth_event_queue.put_nowait((pair, min_update_id,
-                                                      max_update_id, ask_updates))
+    self._app_state._depth_event_queue.put(DepthUpdate(pair, first_update_id,
+                                                       final_update_id,
+                                                       bid_updates, ask_updates))
 
 
 
@@ -9,29 +9,74 @@ from __future__ import print_function
 
 
 import multiprocessing
+import zlib
+
+from trading_bot.channel import Channel, ChannelManager, LocalChannel
+from trading_bot.records import DepthSnapshot, DepthUpdate, OrderBookState, Trade
+
+
+_CHANNEL_NAMES = ["depth_snapshot", "depth_event", "snapshot_request",
+                  "orderbook_state", "trade", "executor"]
+
+# Channels with one instance per analysis worker, routed by symbol pair.
+_SHARDED_CHANNEL_NAMES = ["orderbook_state", "trade"]
+
+# Record class carried by each channel and its index in the channel's items, or
+# `None` if the items are the records.
+_CHANNEL_RECORDS = {"depth_snapshot": (DepthSnapshot, None),
+                    "depth_event": (DepthUpdate, None),
+                    "orderbook_state": (OrderBookState, 1),
+                    "trade": (Trade, 1)}
+
+# Names of the model inference counters kept for each analysis worker.
+_INFERENCE_COUNTER_NAMES = ["num_batches", "num_predictions", "num_misses",
+                            "num_load_errors"]
 
 
 class AppState(object):
   """Encapsulates app state in a process-safe way. Property changes are
-  propagated to the UI for all properties that do not start with _."""
+  propagated to the UI for all properties that do not start with _.
+
+  All fields are kept in a single versioned record in the manager process, so
+  reading or writing a field is one round trip and the UI loop fetches every
+  changed field with a single call."""
+
+
+  # Fields propagated to the UI and the action types used to write them.
+  _UI_FIELDS = [("latency", "SET_LATENCY"),
+                ("server_time", "SET_SERVER_TIME"),
+                ("connect_time", "SET_CONNECT_TIME"),
+                ("connection_status", "SET_CONNECTION_STATUS"),
+                ("fatal_error", "SET_FATAL_ERROR"),
+                ("error_msg", "SET_ERROR_MSG"),
+                ("trade_pairs", "SET_TRADE_PAIRS"),
+                ("save_pairs", "SET_SAVE_PAIRS"),
+                ("orderbook_metrics", "SET_ORDERBOOK_METRICS"),
+                ("orderbook_analytics", "SET_ORDERBOOK_ANALYTICS")]
+
+
+
+  def _get_field(self, name):
+    return self._record[name][1]
+
+  def _set_field(self, name, value):
+    # The record is stored under the lock, so that fields are stored in the
+    # order of their versions.
+    with self._version.get_lock():
+      self._version.value += 1
+      self._record[name] = (self._version.value, value)
+
+
 
 
   @property
   def latency(self):
     """Server latency in milliseconds."""
-    return self._status_ns.latency
+    return self._get_field("latency")
 
   @latency.setter
   def latency(self, value):
-    self._dirty_lock.acquire()
-    self._status_ns.latency = value
-    self._is_dirty.latency = True
-    self._dirty_lock.release()
-
-  def _write_latency(self, write_fns):
-    for fn in write_fns:
-      fn({"type": "SET_LATENCY", "payload": self._status_ns.latency})
-
+    self._set_field("latency", value)
 
 
 
@@ -39,18 +84,11 @@ class AppState(object):
   @property
   def server_time(self):
     """Server time in milliseconds."""
-    return self._status_ns.server_time
+    return self._get_field("server_time")
 
   @server_time.setter
   def server_time(self, value):
-    self._dirty_lock.acquire()
-    self._status_ns.server_time = value
-    self._is_dirty.server_time = True
-    self._dirty_lock.release()
-
-  def _write_server_time(self, write_fns):
-    for fn in write_fns:
-      fn({"type": "SET_SERVER_TIME", "payload": self._status_ns.server_time})
+    self._set_field("server_time", value)
 
 
 
@@ -58,19 +96,11 @@ class AppState(object):
   @property
   def connect_time(self):
     """Time in milliseconds the latest connection was opened."""
-    return self._status_ns.connect_time
+    return self._get_field("connect_time")
 
   @connect_time.setter
   def connect_time(self, value):
-    self._dirty_lock.acquire()
-    self._status_ns.connect_time = value
-    self._is_dirty.connect_time = True
-    self._dirty_lock.release()
-
-  def _write_connect_time(self, write_fns):
-    for fn in write_fns:
-      fn({"type": "SET_CONNECT_TIME", "payload": self._status_ns.connect_time})
-
+    self._set_field("connect_time", value)
 
 
 
@@ -78,21 +108,13 @@ class AppState(object):
   @property
   def connection_status(self):
     """Whether the application is connected to the exchange server."""
-    return self._status_ns.connection_status
+    return self._get_field("connection_status")
 
   @connection_status.setter
   def connection_status(self, value):
-    self._dirty_lock.acquire()
     if value not in ["NOT_CONNECTED", "CONNECTING", "CONNECTED", "RATE_LIMITED", "ERROR"]:
       raise ValueError("Invalid connection status: %s" % value)
-    self._status_ns.connection_status = value
-    self._is_dirty.connection_status = True
-    self._dirty_lock.release()
-
-  def _write_connection_status(self, write_fns):
-    for fn in write_fns:
-      fn({"type": "SET_CONNECTION_STATUS", "payload": self._status_ns.connection_status})
-
+    self._set_field("connection_status", value)
 
 
 
@@ -100,21 +122,11 @@ class AppState(object):
   @property
   def fatal_error(self):
     """Whether a fatal error has occurred."""
-    return self._status_ns.fatal_error
+    return self._get_field("fatal_error")
 
   @fatal_error.setter
   def fatal_error(self, value):
-    self._dirty_lock.acquire()
-    self._status_ns.fatal_error = value
-    self._is_dirty.fatal_error = True
-    self._dirty_lock.release()
-
-  def _write_fatal_error(self, write_fns):
-    for fn in write_fns:
-      fn({"type": "SET_FATAL_ERROR", "payload": self._status_ns.fatal_error})
-
-
-
+    self._set_field("fatal_error", value)
 
 
 
@@ -122,38 +134,23 @@ class AppState(object):
   @property
   def error_msg(self):
     """The latest error message if one is set."""
-    return self._status_ns.error_msg
+    return self._get_field("error_msg")
 
   @error_msg.setter
   def error_msg(self, value):
-    self._dirty_lock.acquire()
-    self._status_ns.error_msg = value
-    self._is_dirty.error_msg = True
-    self._dirty_lock.release()
+    self._set_field("error_msg", value)
 
-  def _write_error_msg(self, write_fns):
-    for fn in write_fns:
-      fn({"type": "SET_ERROR_MSG", "payload": self._status_ns.error_msg})
 
 
 
   @property
   def trade_pairs(self):
     """The list of symbol pairs used for trading."""
-    return [x for x in self._trade_pairs_list]
+    return list(self._get_field("trade_pairs"))
 
   @trade_pairs.setter
   def trade_pairs(self, value):
-    self._dirty_lock.acquire()
-    del self._trade_pairs_list[:]
-    self._trade_pairs_list.extend(value)
-    self._is_dirty.trade_pairs = True
-    self._dirty_lock.release()
-
-  def _write_trade_pairs(self, write_fns):
-    for fn in write_fns:
-      fn({"type": "SET_TRADE_PAIRS", "payload": [x for x in self._trade_pairs_list]})
-
+    self._set_field("trade_pairs", list(value))
 
 
 
@@ -161,19 +158,79 @@ class AppState(object):
   @property
   def save_pairs(self):
     """The list of symbol pairs used for saving data."""
-    return [x for x in self._save_pairs_list]
+    return list(self._get_field("save_pairs"))
 
   @save_pairs.setter
   def save_pairs(self, value):
-    self._dirty_lock.acquire()
-    del self._save_pairs_list[:]
-    self._save_pairs_list.extend(value)
-    self._is_dirty.save_pairs = True
-    self._dirty_lock.release()
+    self._set_field("save_pairs", list(value))
+
+
 
-  def _write_save_pairs(self, write_fns):
+
+
+  @property
+  def orderbook_metrics(self):
+    """Sync status and update gap and resync counts of each symbol pair's
+    orderbook."""
+    return dict(self._get_field("orderbook_metrics"))
+
+  @orderbook_metrics.setter
+  def orderbook_metrics(self, value):
+    self._set_field("orderbook_metrics", dict(value))
+
+
+
+
+
+  @property
+  def orderbook_analytics(self):
+    """The latest published analytics of each symbol pair's orderbook, as
+    dictionaries of `BookAnalytics` fields."""
+    return dict(self._get_field("orderbook_analytics"))
+
+  @orderbook_analytics.setter
+  def orderbook_analytics(self, value):
+    self._set_field("orderbook_analytics", dict(value))
+
+
+
+
+
+  @property
+  def channel_stats(self):
+    """Depth, high-water-mark, and overflow counters for each channel."""
+    return dict((name, self._channels[name].stats()) for name in self._channels)
+
+  def _write_channel_stats(self, write_fns, channel_stats):
     for fn in write_fns:
-      fn({"type": "SET_SAVE_PAIRS", "payload": [x for x in self._save_pairs_list]})
+      fn({"type": "SET_CHANNEL_STATS", "payload": channel_stats})
+
+
+
+
+  @property
+  def inference_stats(self):
+    """Model inference batch, prediction, deadline miss and model load error
+    counters for each analysis worker."""
+    num_counters = len(_INFERENCE_COUNTER_NAMES)
+    return dict(("%d" % shard, dict(zip(_INFERENCE_COUNTER_NAMES,
+                                        self._inference_counters[shard * num_counters:
+                                                                 (shard + 1) * num_counters])))
+                for shard in range(self._num_analysis_workers))
+
+  def _add_inference_counts(self, shard, num_batches, num_predictions, num_misses,
+                            num_load_errors=0):
+    """Adds to the inference counters of the analysis worker. Each worker only
+    writes its own counters."""
+    i = shard * len(_INFERENCE_COUNTER_NAMES)
+    self._inference_counters[i] += num_batches
+    self._inference_counters[i + 1] += num_predictions
+    self._inference_counters[i + 2] += num_misses
+    self._inference_counters[i + 3] += num_load_errors
+
+  def _write_inference_stats(self, write_fns, inference_stats):
+    for fn in write_fns:
+      fn({"type": "SET_INFERENCE_STATS", "payload": inference_stats})
 
 
 
@@ -186,160 +243,198 @@ class AppState(object):
   @property
   def _ws_uri(self):
     """The stream URI that the socket stream runner listens to."""
-    return self._private_strings.ws_uri
+    return self._get_field("_ws_uri")
 
   @_ws_uri.setter
   def _ws_uri(self, value):
-    self._private_strings.ws_uri = value
+    self._set_field("_ws_uri", value)
 
 
 
   @property
-  def _bid_snapshot_queue(self):
-    """The queue for buffering bid orderbook snapshots."""
-    return self._private_bid_snapshot_queue
+  def _pair_infos(self):
+    """The `PairInfo` of each symbol pair traded on the exchange. Pair infos are
+    kept in their own dictionary in the manager process, keyed by pair, so that
+    the UI loop does not copy them with the record."""
+    return self._pair_info_dict.copy()
 
+  @_pair_infos.setter
+  def _pair_infos(self, value):
+    self._pair_info_dict.update(value)
+    for pair in set(self._pair_info_dict.keys()).difference(value):
+      self._pair_info_dict.pop(pair, None)
+
+  def _get_pair_info(self, pair):
+    """Returns the `PairInfo` of the symbol pair, or `None` if it is unknown."""
+    return self._pair_info_dict.get(pair)
 
-  @property
-  def _ask_snapshot_queue(self):
-    """The queue for buffering ask orderbook snapshots."""
-    return self._private_ask_snapshot_queue
 
 
   @property
-  def _bid_depth_event_queue(self):
-    """The queue for buffering bid orderbook change events."""
-    return self._private_bid_depth_event_queue
+  def _depth_snapshot_queue(self):
+    """The queue for buffering orderbook snapshots."""
+    return self._channels["depth_snapshot"]
 
 
   @property
-  def _ask_depth_event_queue(self):
-    """The queue for buffering ask orderbook change events."""
-    return self._private_ask_depth_event_queue
+  def _depth_event_queue(self):
+    """The queue for buffering orderbook change events."""
+    return self._channels["depth_event"]
 
 
   @property
-  def _orderbook_state_queue(self):
-    """The queue for buffering updated orderbook states."""
-    return self._private_orderbook_state_queue
+  def _snapshot_request_queue(self):
+    """The queue for requesting depth snapshots of symbol pairs whose orderbooks
+    are out of sync."""
+    return self._channels["snapshot_request"]
+
 
   @property
-  def _trade_queue(self):
-    """The queue for buffering trades from the server."""
-    return self._private_trade_queue
+  def _orderbook_state_queues(self):
+    """The queues for buffering updated orderbook states, indexed by analysis
+    worker."""
+    return [self._channels[name] for name in self._channel_names("orderbook_state")]
 
+  @property
+  def _trade_queues(self):
+    """The queues for buffering trades from the server, indexed by analysis
+    worker."""
+    return [self._channels[name] for name in self._channel_names("trade")]
 
 
 
   @property
-  def _executor_queue(self):
-    """The queue for buffering trade execution events."""
-    return self._private_executor_queue
+  def _num_analysis_workers(self):
+    """The number of analysis workers that symbol pairs are sharded across."""
+    return self._private_num_analysis_workers
 
+  def _analysis_shard(self, pair):
+    """Returns the index of the analysis worker handling the symbol pair. Uses a
+    hash that is stable across processes and runs."""
+    return (zlib.crc32(pair.encode("utf-8")) & 0xffffffff) % self._num_analysis_workers
 
+  def _channel_names(self, name, shard=None):
+    """Returns the names of the channel instances for the base channel name,
+    or only the instance for the given analysis worker if the channel is
+    sharded."""
+    if name not in _SHARDED_CHANNEL_NAMES:
+      return [name]
+    if shard is not None:
+      return ["%s.%d" % (name, shard)]
+    return ["%s.%d" % (name, i) for i in range(self._num_analysis_workers)]
 
 
 
 
-  def __init__(self):
-    mp_mgr = multiprocessing.Manager()
+  @property
+  def _executor_queue(self):
+    """The queue for buffering trade execution events."""
+    return self._channels["executor"]
 
 
-    
-    self._is_dirty = mp_mgr.Namespace()
-    self._dirty_lock = mp_mgr.Lock()
 
 
-    self._status_ns = mp_mgr.Namespace()
 
-    self._status_ns.latency = 0
-    self._is_dirty.latency = False
 
-    self._status_ns.server_time = 0
-    self._is_dirty.server_time = False
+  def __init__(self, config):
+    mp_mgr = ChannelManager()
+    mp_mgr.start()
 
-    self._status_ns.connect_time = 0
-    self._is_dirty.connect_time = False
 
-    self._status_ns.connection_status = "NOT_CONNECTED"
-    self._is_dirty.connection_status = False
+    # Each record entry is a tuple of the version at which it was last set and
+    # its value. Versions are drawn from a counter in shared memory.
+    self._version = multiprocessing.Value("l", 0)
+    self._record = mp_mgr.dict()
+    self._pair_info_dict = mp_mgr.dict()
 
-    self._status_ns.fatal_error = False
-    self._is_dirty.fatal_error = False
+    self._set_field("latency", 0)
+    self._set_field("server_time", 0)
+    self._set_field("connect_time", 0)
+    self._set_field("connection_status", "NOT_CONNECTED")
+    self._set_field("fatal_error", False)
+    self._set_field("error_msg", None)
+    self._set_field("trade_pairs", [])
+    self._set_field("save_pairs", [])
+    self._set_field("orderbook_metrics", {})
+    self._set_field("orderbook_analytics", {})
+    self._set_field("_ws_uri", "")
 
-    self._status_ns.error_msg = None
-    self._is_dirty.error_msg = False
+    self._written_versions = {}
 
-    self._trade_pairs_list = mp_mgr.list()
-    self._save_pairs_list = mp_mgr.list()
 
+    self._private_num_analysis_workers = config["num_analysis_workers"]
 
-    self._private_strings = mp_mgr.Namespace()
-    self._private_strings.ws_uri = ""
+    self._channels = {}
+    for base_name in _CHANNEL_NAMES:
+      channel_config = config["channels"].get(base_name, {})
+      record_cls, record_index = _CHANNEL_RECORDS.get(base_name, (None, None))
+      for name in self._channel_names(base_name):
+        self._channels[name] = Channel(mp_mgr, name,
+                                       channel_config.get("capacity", 0),
+                                       channel_config.get("policy", "block"),
+                                       record_cls, record_index)
+    self._last_channel_stats = None
 
-    self._private_bid_snapshot_queue = mp_mgr.Queue()
-    self._private_ask_snapshot_queue = mp_mgr.Queue()
+    self._inference_counters = multiprocessing.RawArray(
+        "l", len(_INFERENCE_COUNTER_NAMES) * self._num_analysis_workers)
+    self._last_inference_stats = None
 
-    self._private_bid_depth_event_queue = mp_mgr.Queue()
-    self._private_ask_depth_event_queue = mp_mgr.Queue()
 
-    self._private_orderbook_state_queue = mp_mgr.Queue()
-    self._private_trade_queue = mp_mgr.Queue()
 
-    self._private_executor_queue = mp_mgr.Queue()
 
 
+  def localize_channels(self, names):
+    """Replaces the named channels with in-process channels. This only affects
+    the calling process, and must only be called when every producer and
+    consumer of the channels runs in that process."""
+
+    for name in names:
+      self._channels[name] = LocalChannel(self._channels[name])
 
 
 
-  def write_updates(self, write_fns):
 
-    self._dirty_lock.acquire()
 
-    if self._is_dirty.latency:
-      self._write_latency(write_fns)
-      self._is_dirty.latency = False
+  def _write_record(self, write_fns, record, since_versions):
+    """Writes each UI field of the record whose version is newer than in
+    `since_versions`, and returns the versions of the fields written."""
 
-    if self._is_dirty.server_time:
-      self._write_server_time(write_fns)
-      self._is_dirty.server_time = False
+    written_versions = {}
+    for name, action_type in self._UI_FIELDS:
+      version, value = record[name]
+      if version > since_versions.get(name, 0):
+        for fn in write_fns:
+          fn({"type": action_type, "payload": value})
+        written_versions[name] = version
 
-    if self._is_dirty.connect_time:
-      self._write_connect_time(write_fns)
-      self._is_dirty.connect_time = False
+    return written_versions
 
-    if self._is_dirty.connection_status:
-      self._write_connection_status(write_fns)
-      self._is_dirty.connection_status = False
 
-    if self._is_dirty.fatal_error:
-      self._write_fatal_error(write_fns)
-      self._is_dirty.fatal_error = False
 
-    if self._is_dirty.error_msg:
-      self._write_error_msg(write_fns)
-      self._is_dirty.error_msg = False
+  def write_updates(self, write_fns):
+    """Writes all fields changed since the previous call."""
 
-    if self._is_dirty.trade_pairs:
-      self._write_trade_pairs(write_fns)
-      self._is_dirty.trade_pairs = False
+    record = self._record.copy()
+    self._written_versions.update(self._write_record(write_fns, record,
+                                                     self._written_versions))
 
-    if self._is_dirty.save_pairs:
-      self._write_save_pairs(write_fns)
-      self._is_dirty.save_pairs = False
+    # Channel counters live in shared memory, so they are compared against the
+    # last written values instead of being versioned by every producer.
+    channel_stats = self.channel_stats
+    if channel_stats != self._last_channel_stats:
+      self._write_channel_stats(write_fns, channel_stats)
+      self._last_channel_stats = channel_stats
 
-    self._dirty_lock.release()
+    inference_stats = self.inference_stats
+    if inference_stats != self._last_inference_stats:
+      self._write_inference_stats(write_fns, inference_stats)
+      self._last_inference_stats = inference_stats
 
 
 
   def write_all(self, write_fns):
+    """Writes all fields."""
 
-    self._write_latency(write_fns)
-    self._write_server_time(write_fns)
-    self._write_connect_time(write_fns)
-    self._write_connection_status(write_fns)
-    self._write_fatal_error(write_fns)
-    self._write_error_msg(write_fns)
-    self._write_trade_pairs(write_fns)
-    self._write_save_pairs(write_fns)
-
+    self._write_record(write_fns, self._record.copy(), {})
+    self._write_channel_stats(write_fns, self.channel_stats)
+    self._write_inference_stats(write_fns, self.inference_stats)
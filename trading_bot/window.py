@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Defines fixed-length windows of the latest rows of streams, and running
+aggregates over them.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import numpy as np
+
+
+
+
+class SlotRingWindow(object):
+  """Window of the latest `length` rows, oldest first, for each of a number of
+  slots, backed by circular buffers stored in one array so that rows of any
+  subset of slots are appended or read with single array operations. Each row
+  is written twice, at the head of its slot and one window length past it, so
+  the ordered window of a slot is always a contiguous slice of its buffer. Each
+  slot has its own head. Rows are zero until written, and the number of slots
+  grows as slots are added."""
+
+
+  def __init__(self, length, row_shape=(), dtype="float32", num_slots=0):
+    self._length = length
+    self._buffer = np.zeros((num_slots, 2 * length) + tuple(row_shape), dtype=dtype)
+    self._heads = np.zeros((num_slots,), dtype="int64")
+
+
+  def __len__(self):
+    return self._length
+
+
+  @property
+  def num_slots(self):
+    return self._buffer.shape[0]
+
+
+  def resize(self, num_slots):
+    """Adds zeroed slots up to `num_slots` slots."""
+
+    num_new_slots = num_slots - self.num_slots
+    if num_new_slots > 0:
+      self._buffer = np.concatenate([self._buffer, np.zeros(
+          (num_new_slots,) + self._buffer.shape[1:], dtype=self._buffer.dtype)])
+      self._heads = np.concatenate([self._heads, np.zeros((num_new_slots,),
+                                                          dtype="int64")])
+
+
+
+  def append(self, slots, rows):
+    """Appends a row to each of the slots in the array of distinct slot
+    indices, dropping their oldest rows."""
+
+    if len(slots) == 1:
+      self.append_slot(slots[0], rows[0])
+      return
+
+    heads = self._heads[slots]
+    self._buffer[slots, heads] = rows
+    self._buffer[slots, heads + self._length] = rows
+    heads += 1
+    heads[heads == self._length] = 0
+    self._heads[slots] = heads
+
+
+
+  def append_slot(self, slot, row):
+    """Appends a row to the slot, dropping its oldest row."""
+
+    head = self._heads[slot]
+    self._buffer[slot, head] = row
+    self._buffer[slot, head + self._length] = row
+    self._heads[slot] = 0 if head + 1 == self._length else head + 1
+
+
+
+  def latest(self, slots):
+    """Returns an array of the latest row of each of the slots."""
+
+    if len(slots) == 1:
+      slot = slots[0]
+      return self._buffer[slot:slot + 1, self._heads[slot] + self._length - 1].copy()
+    return self._buffer[slots, self._heads[slots] + self._length - 1]
+
+
+  def latest_rows(self, slots, num_rows):
+    """Returns an array of the latest `num_rows` rows of each of the slots,
+    oldest first."""
+    row_inds = (self._heads[slots] + (self._length - num_rows))[:, None] + np.arange(num_rows)
+    return self._buffer[np.asarray(slots)[:, None], row_inds]
+
+
+  def windows(self, slots):
+    """Returns an array of the rows in the window of each of the slots, oldest
+    first."""
+    return self.latest_rows(slots, self._length)
+
+
+  def window(self, slot):
+    """Returns a view of the rows in the window of the slot, oldest first. The
+    view is only valid until the next row is appended to the slot."""
+    head = self._heads[slot]
+    return self._buffer[slot, head:head + self._length]
+
+
+
+
+class SlotRollingMax(object):
+  """Elementwise maximum of the latest `length` rows of each of a number of
+  slots, kept as rows are appended, using the van Herk/Gil-Werman algorithm.
+  Rows are split into blocks of `length` rows. The maximum is that of the current
+  block so far and the suffix of the previous block still in the window. Suffix
+  maximums are computed once per completed block, so appending costs O(1)
+  amortized for any window length, and any subset of slots is updated with
+  single array operations. Slots start with a window of zero rows."""
+
+
+  def __init__(self, length, row_shape=(), dtype="float32", num_slots=0):
+    self._length = length
+    self._row_shape = tuple(row_shape)
+    self._dtype = dtype
+    self._blocks = np.zeros((0, length) + self._row_shape, dtype=dtype)
+    self._suffix_maxes = np.zeros((0, length + 1) + self._row_shape, dtype=dtype)
+    self._prefix_maxes = np.zeros((0,) + self._row_shape, dtype=dtype)
+    self._positions = np.zeros((0,), dtype="int64")
+    self.resize(num_slots)
+
+
+  def __len__(self):
+    return self._length
+
+
+  @property
+  def num_slots(self):
+    return self._blocks.shape[0]
+
+
+  def resize(self, num_slots):
+    """Adds slots up to `num_slots` slots."""
+
+    num_new_slots = num_slots - self.num_slots
+    if num_new_slots > 0:
+      # The suffix maximums of the previous block of new slots are of zeros,
+      # with an extra column for when the window is only the current block.
+      suffix_maxes = np.zeros((num_new_slots, self._length + 1) + self._row_shape,
+                              dtype=self._dtype)
+      suffix_maxes[:, -1] = -np.inf
+
+      self._blocks = np.concatenate([self._blocks, np.zeros(
+          (num_new_slots,) + self._blocks.shape[1:], dtype=self._dtype)])
+      self._suffix_maxes = np.concatenate([self._suffix_maxes, suffix_maxes])
+      self._prefix_maxes = np.concatenate([self._prefix_maxes, np.zeros(
+          (num_new_slots,) + self._row_shape, dtype=self._dtype)])
+      self._positions = np.concatenate([self._positions, np.zeros(
+          (num_new_slots,), dtype="int64")])
+
+
+
+  def append(self, slots, rows):
+    """Appends a row to each of the slots in the array of distinct slot
+    indices, and returns an array of the elementwise maximum of the rows in each
+    of their windows."""
+
+    if len(slots) == 1:
+      return self.append_slot(slots[0], rows[0])[None]
+
+    rows = np.asarray(rows, dtype=self._dtype)
+    positions = self._positions[slots]
+    self._blocks[slots, positions] = rows
+
+    is_block_start = (positions == 0).reshape((-1,) + (1,) * len(self._row_shape))
+    prefix_maxes = np.where(is_block_start, rows, np.maximum(self._prefix_maxes[slots], rows))
+    self._prefix_maxes[slots] = prefix_maxes
+    maxes = np.maximum(prefix_maxes, self._suffix_maxes[slots, positions + 1])
+
+    positions += 1
+    is_full = positions == self._length
+    if np.count_nonzero(is_full):
+      full_slots = slots[is_full]
+      self._suffix_maxes[full_slots, :-1] = np.maximum.accumulate(
+          self._blocks[full_slots, ::-1], axis=1)[:, ::-1]
+      positions[is_full] = 0
+    self._positions[slots] = positions
+
+    return maxes
+
+
+
+  def append_slot(self, slot, row):
+    """Appends a row to the slot, and returns the elementwise maximum of the
+    rows in its window."""
+
+    row = np.asarray(row, dtype=self._dtype)
+    position = self._positions[slot]
+    self._blocks[slot, position] = row
+
+    prefix_max = row if position == 0 else np.maximum(self._prefix_maxes[slot], row)
+    self._prefix_maxes[slot] = prefix_max
+    maxes = np.maximum(prefix_max, self._suffix_maxes[slot, position + 1])
+
+    position += 1
+    if position == self._length:
+      self._suffix_maxes[slot, :-1] = np.maximum.accumulate(
+          self._blocks[slot, ::-1], axis=0)[::-1]
+      position = 0
+    self._positions[slot] = position
+
+    return maxes
+
+
+
+
+class SlotRingSum(object):
+  """Sum of the latest `length` rows of each of a number of slots, kept as a
+  running sum as rows are appended by adding the new row and subtracting the
+  evicted one, so reading the sums costs O(1) for any window length. Rows and
+  sums are stored in float64. Each time the ring of a slot wraps around, its
+  sum is recomputed from the ring, so rounding errors do not accumulate. Slots
+  start with a window of zero rows."""
+
+
+  def __init__(self, length, row_shape=(), num_slots=0):
+    self._length = length
+    self._rows = np.zeros((num_slots, length) + tuple(row_shape), dtype="float64")
+    self._sums = np.zeros((num_slots,) + tuple(row_shape), dtype="float64")
+    self._heads = np.zeros((num_slots,), dtype="int64")
+
+
+  def __len__(self):
+    return self._length
+
+
+  @property
+  def num_slots(self):
+    return self._rows.shape[0]
+
+
+  def resize(self, num_slots):
+    """Adds slots up to `num_slots` slots."""
+
+    num_new_slots = num_slots - self.num_slots
+    if num_new_slots > 0:
+      self._rows = np.concatenate([self._rows, np.zeros(
+          (num_new_slots,) + self._rows.shape[1:], dtype="float64")])
+      self._sums = np.concatenate([self._sums, np.zeros(
+          (num_new_slots,) + self._sums.shape[1:], dtype="float64")])
+      self._heads = np.concatenate([self._heads, np.zeros((num_new_slots,),
+                                                          dtype="int64")])
+
+
+
+  def append(self, slots, rows):
+    """Appends a row to each of the slots in the array of distinct slot
+    indices, dropping their oldest rows."""
+
+    heads = self._heads[slots]
+    self._sums[slots] += rows - self._rows[slots, heads]
+    self._rows[slots, heads] = rows
+
+    heads += 1
+    is_wrapped = heads == self._length
+    if np.count_nonzero(is_wrapped):
+      wrapped_slots = slots[is_wrapped]
+      self._sums[wrapped_slots] = self._rows[wrapped_slots].sum(axis=1)
+      heads[is_wrapped] = 0
+    self._heads[slots] = heads
+
+
+
+  def replace_latest(self, slots, rows):
+    """Replaces the latest row of each of the slots in the array of distinct
+    slot indices."""
+
+    latest = self._heads[slots] - 1
+    self._sums[slots] += rows - self._rows[slots, latest]
+    self._rows[slots, latest] = rows
+
+
+
+  def sums(self, slots):
+    """Returns an array of the sum of the rows in the window of each of the
+    slots."""
+    return self._sums[slots]
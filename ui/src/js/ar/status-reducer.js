@@ -6,7 +6,11 @@ const defaultState = {
   connectTime: 0,
   connectionStatus: "NOT_CONNECTED",
   fatalError: false,
-  errorMsg: ""
+  errorMsg: "",
+  channelStats: {},
+  inferenceStats: {},
+  orderbookMetrics: {},
+  orderbookAnalytics: {}
 };
 
 
@@ -39,6 +43,22 @@ export default function reducer(state=defaultState, action) {
       return {...state, errorMsg: action.payload}
     }
 
+    case "SET_CHANNEL_STATS": {
+      return {...state, channelStats: action.payload}
+    }
+
+    case "SET_INFERENCE_STATS": {
+      return {...state, inferenceStats: action.payload}
+    }
+
+    case "SET_ORDERBOOK_METRICS": {
+      return {...state, orderbookMetrics: action.payload}
+    }
+
+    case "SET_ORDERBOOK_ANALYTICS": {
+      return {...state, orderbookAnalytics: action.payload}
+    }
+
     default: {
       return state;
     }
@@ -13,6 +13,10 @@ import {connect} from "react-redux";
     errorMsg: store.status.errorMsg,
     latency: store.status.latency,
     connectionStatus: store.status.connectionStatus,
+    channelStats: store.status.channelStats,
+    inferenceStats: store.status.inferenceStats,
+    orderbookMetrics: store.status.orderbookMetrics,
+    orderbookAnalytics: store.status.orderbookAnalytics,
   };
 })
 class AppMain extends React.Component {
@@ -50,6 +54,107 @@ class AppMain extends React.Component {
 
 
 
+  renderChannelStats() {
+    const names = Object.keys(this.props.channelStats).sort();
+    return (
+      <table>
+        <thead>
+          <tr>
+            <th>{this.props.strings["channel"]}</th>
+            <th>{this.props.strings["channelDepth"]}</th>
+            <th>{this.props.strings["channelHighWaterMark"]}</th>
+            <th>{this.props.strings["channelCapacity"]}</th>
+            <th>{this.props.strings["channelDropped"]}</th>
+          </tr>
+        </thead>
+        <tbody>
+          {names.map(name => {
+            const stats = this.props.channelStats[name];
+            return (
+              <tr key={name}>
+                <td>{name}</td>
+                <td>{stats.depth}</td>
+                <td>{stats.high_water_mark}</td>
+                <td>{stats.capacity}</td>
+                <td>{stats.num_dropped}</td>
+              </tr>
+            );
+          })}
+        </tbody>
+      </table>
+    );
+  }
+
+
+  renderInferenceStats() {
+    const shards = Object.keys(this.props.inferenceStats).sort();
+    return (
+      <table>
+        <thead>
+          <tr>
+            <th>{this.props.strings["inferenceShard"]}</th>
+            <th>{this.props.strings["inferenceBatches"]}</th>
+            <th>{this.props.strings["inferencePredictions"]}</th>
+            <th>{this.props.strings["inferenceMisses"]}</th>
+            <th>{this.props.strings["inferenceLoadErrors"]}</th>
+          </tr>
+        </thead>
+        <tbody>
+          {shards.map(shard => {
+            const stats = this.props.inferenceStats[shard];
+            return (
+              <tr key={shard}>
+                <td>{shard}</td>
+                <td>{stats.num_batches}</td>
+                <td>{stats.num_predictions}</td>
+                <td>{stats.num_misses}</td>
+                <td>{stats.num_load_errors}</td>
+              </tr>
+            );
+          })}
+        </tbody>
+      </table>
+    );
+  }
+
+
+  renderOrderbookMetrics() {
+    const pairs = Object.keys(this.props.orderbookMetrics).sort();
+    return (
+      <table>
+        <thead>
+          <tr>
+            <th>{this.props.strings["orderbook"]}</th>
+            <th>{this.props.strings["orderbookSynced"]}</th>
+            <th>{this.props.strings["orderbookGaps"]}</th>
+            <th>{this.props.strings["orderbookResyncs"]}</th>
+            <th>{this.props.strings["orderbookMid"]}</th>
+            <th>{this.props.strings["orderbookSpread"]}</th>
+            <th>{this.props.strings["orderbookImbalance"]}</th>
+          </tr>
+        </thead>
+        <tbody>
+          {pairs.map(pair => {
+            const metrics = this.props.orderbookMetrics[pair];
+            const analytics = this.props.orderbookAnalytics[pair];
+            return (
+              <tr key={pair}>
+                <td>{pair}</td>
+                <td>{metrics.synced ? this.props.strings["yes"] : this.props.strings["no"]}</td>
+                <td>{metrics.num_gaps}</td>
+                <td>{metrics.num_resyncs}</td>
+                <td>{analytics ? analytics.mid.toPrecision(8) : ""}</td>
+                <td>{analytics ? analytics.spread.toPrecision(4) : ""}</td>
+                <td>{analytics ? analytics.imbalance.toFixed(3) : ""}</td>
+              </tr>
+            );
+          })}
+        </tbody>
+      </table>
+    );
+  }
+
+
   render() {
     if (!this.state.socketRunning) {
       if (this.props.fatalError){
@@ -69,6 +174,9 @@ class AppMain extends React.Component {
       {this.props.serverTime}<br />
       {this.props.latency}<br />
       {this.props.connectionStatus}<br />
+      {this.renderChannelStats()}
+      {this.renderInferenceStats()}
+      {this.renderOrderbookMetrics()}
       </div>
     );
   }